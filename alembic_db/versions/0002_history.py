@@ -0,0 +1,50 @@
+"""
+Prompt history
+Revision ID: 0002_history
+Revises: 0001_assets
+Create Date: 2026-10-16 00:00:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002_history"
+down_revision = "0001_assets"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "history",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("prompt_id", sa.String(length=255), nullable=False),
+        sa.Column("priority", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("status", sa.String(length=32), nullable=False),
+        sa.Column("create_time", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("execution_start_time", sa.BigInteger(), nullable=True),
+        sa.Column("execution_end_time", sa.BigInteger(), nullable=True),
+        sa.Column("execution_duration", sa.BigInteger(), nullable=False, server_default="0"),
+        sa.Column("execution_error", sa.JSON(), nullable=True),
+        sa.Column("workflow_id", sa.String(length=255), nullable=True),
+        sa.Column("outputs_count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("preview_output", sa.JSON(), nullable=True),
+        sa.Column("prompt", sa.JSON(), nullable=False),
+        sa.Column("execution_status", sa.JSON(), nullable=True),
+        sa.Column("outputs", sa.JSON(), nullable=True),
+        sa.Column("meta", sa.JSON(), nullable=True),
+    )
+    op.create_index("uq_history_prompt_id", "history", ["prompt_id"], unique=True)
+    op.create_index("ix_history_status_create_time", "history", ["status", "create_time", "prompt_id"])
+    op.create_index("ix_history_create_time", "history", ["create_time", "prompt_id"])
+    op.create_index("ix_history_execution_duration", "history", ["execution_duration", "prompt_id"])
+    op.create_index("ix_history_workflow_id", "history", ["workflow_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_history_workflow_id", table_name="history")
+    op.drop_index("ix_history_execution_duration", table_name="history")
+    op.drop_index("ix_history_create_time", table_name="history")
+    op.drop_index("ix_history_status_create_time", table_name="history")
+    op.drop_index("uq_history_prompt_id", table_name="history")
+    op.drop_table("history")
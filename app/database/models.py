@@ -1,6 +1,7 @@
 from typing import Any
 from datetime import datetime
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy import JSON, BigInteger, Float, Index, Integer, String
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
 class Base(DeclarativeBase):
     pass
@@ -18,4 +19,39 @@ def to_dict(obj: Any, include_none: bool = False) -> dict[str, Any]:
             out[field] = val
     return out
 
-# TODO: Define models here
+
+class HistoryItem(Base):
+    """
+    A finished prompt. The job summary columns are what /api/jobs lists and sorts on, the full
+    prompt, status and outputs are deferred and only loaded for single item lookups.
+    """
+    __tablename__ = "history"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    prompt_id: Mapped[str] = mapped_column(String(255), nullable=False)
+    priority: Mapped[float] = mapped_column(Float, nullable=False, default=0)
+    status: Mapped[str] = mapped_column(String(32), nullable=False)
+    create_time: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    execution_start_time: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    execution_end_time: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    execution_duration: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    execution_error: Mapped[Any | None] = mapped_column(JSON, nullable=True)
+    workflow_id: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    outputs_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    preview_output: Mapped[Any | None] = mapped_column(JSON, nullable=True)
+
+    prompt: Mapped[Any] = mapped_column(JSON, nullable=False, deferred=True)
+    execution_status: Mapped[Any | None] = mapped_column(JSON, nullable=True, deferred=True)
+    outputs: Mapped[Any | None] = mapped_column(JSON, nullable=True, deferred=True)
+    meta: Mapped[Any | None] = mapped_column(JSON, nullable=True, deferred=True)
+
+    __table_args__ = (
+        Index("uq_history_prompt_id", "prompt_id", unique=True),
+        Index("ix_history_status_create_time", "status", "create_time", "prompt_id"),
+        Index("ix_history_create_time", "create_time", "prompt_id"),
+        Index("ix_history_execution_duration", "execution_duration", "prompt_id"),
+        Index("ix_history_workflow_id", "workflow_id"),
+    )
+
+    def __repr__(self) -> str:
+        return f"<HistoryItem prompt_id={self.prompt_id} status={self.status}>"
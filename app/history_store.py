@@ -0,0 +1,199 @@
+"""
+Database backed prompt history.
+
+When the database is available the PromptQueue keeps its history here instead of in memory, so it
+survives restarts. Listing only reads the indexed job summary columns of one page of rows, the
+prompt and outputs of an item are loaded when that item is requested.
+"""
+import heapq
+from typing import Optional
+
+from sqlalchemy import delete, func, select, tuple_
+from sqlalchemy.orm import undefer
+
+from app.database.db import create_session
+from app.database.models import HistoryItem
+from comfy_api.internal import prune_dict
+from comfy_execution.jobs import JobStatus, get_all_jobs, get_sort_key, get_sort_value, normalize_history_item
+
+# Oldest items are deleted once the history grows past this many items.
+MAXIMUM_HISTORY_SIZE = 1000000
+# Items returned by get_items without max_items, the size the in memory history is capped at
+DEFAULT_MAX_ITEMS = 10000
+
+HISTORY_STATUSES = frozenset({JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED})
+
+SUMMARY_COLUMNS = (
+    HistoryItem.prompt_id,
+    HistoryItem.priority,
+    HistoryItem.status,
+    HistoryItem.create_time,
+    HistoryItem.execution_start_time,
+    HistoryItem.execution_end_time,
+    HistoryItem.execution_error,
+    HistoryItem.outputs_count,
+    HistoryItem.preview_output,
+    HistoryItem.workflow_id,
+)
+
+
+# Loads the deferred columns of a history item in the same query as the row
+FULL_ITEM = tuple(undefer(column) for column in (HistoryItem.prompt, HistoryItem.execution_status, HistoryItem.outputs, HistoryItem.meta))
+
+
+def _priority(value):
+    # The column is a float, give back the int the prompt was queued with
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _summary_to_job(row) -> dict:
+    return prune_dict({
+        'id': row.prompt_id,
+        'status': row.status,
+        'priority': _priority(row.priority),
+        'create_time': row.create_time or None,
+        'execution_start_time': row.execution_start_time,
+        'execution_end_time': row.execution_end_time,
+        'execution_error': row.execution_error,
+        'outputs_count': row.outputs_count,
+        'preview_output': row.preview_output,
+        'workflow_id': row.workflow_id,
+    })
+
+
+def _to_history_item(row: HistoryItem) -> dict:
+    item = {
+        "prompt": tuple(row.prompt),
+        "outputs": row.outputs if row.outputs is not None else {},
+        "status": row.execution_status,
+    }
+    if row.meta is not None:
+        item["meta"] = row.meta
+    return item
+
+
+class HistoryStore:
+    def __init__(self, max_items=MAXIMUM_HISTORY_SIZE):
+        self.max_items = max_items
+
+    def add(self, prompt_id: str, history_item: dict):
+        job = normalize_history_item(prompt_id, history_item)
+        with create_session() as session:
+            session.execute(delete(HistoryItem).where(HistoryItem.prompt_id == prompt_id))
+            row = HistoryItem(
+                prompt_id=prompt_id,
+                priority=job.get('priority', 0),
+                status=job['status'],
+                create_time=job.get('create_time') or 0,
+                execution_start_time=job.get('execution_start_time'),
+                execution_end_time=job.get('execution_end_time'),
+                execution_duration=get_sort_value(job, 'execution_duration'),
+                execution_error=job.get('execution_error'),
+                workflow_id=job.get('workflow_id'),
+                outputs_count=job.get('outputs_count', 0),
+                preview_output=job.get('preview_output'),
+                prompt=list(history_item["prompt"]),
+                execution_status=history_item.get("status"),
+                outputs=history_item.get("outputs", {}),
+                meta=history_item.get("meta"),
+            )
+            session.add(row)
+            session.flush()
+            if row.id > self.max_items:
+                session.execute(delete(HistoryItem).where(HistoryItem.id <= row.id - self.max_items))
+            session.commit()
+
+    def get(self, prompt_id: str) -> Optional[dict]:
+        with create_session() as session:
+            row = session.scalars(select(HistoryItem).options(*FULL_ITEM).where(HistoryItem.prompt_id == prompt_id)).first()
+            if row is None:
+                return None
+            return _to_history_item(row)
+
+    def get_items(self, max_items=None, offset=-1) -> dict:
+        """
+        Returns history items in the order they finished, with the same offset semantics as the in
+        memory history: a negative offset returns the most recent items. At most DEFAULT_MAX_ITEMS
+        items are returned when max_items is None.
+        """
+        if max_items is None:
+            max_items = DEFAULT_MAX_ITEMS
+        with create_session() as session:
+            if offset < 0:
+                offset = max(0, session.scalar(select(func.count()).select_from(HistoryItem)) - max_items)
+            stmt = select(HistoryItem).options(*FULL_ITEM).order_by(HistoryItem.id).offset(offset).limit(max_items)
+            return {row.prompt_id: _to_history_item(row) for row in session.scalars(stmt)}
+
+    def get_jobs(self, running: list, queued: list,
+                 status_filter: Optional[list[str]] = None,
+                 workflow_id: Optional[str] = None,
+                 sort_by: str = "created_at",
+                 sort_order: str = "desc",
+                 limit: Optional[int] = None,
+                 offset: int = 0,
+                 cursor: Optional[tuple] = None) -> tuple[list[dict], int]:
+        """
+        Same as comfy_execution.jobs.get_all_jobs but with the history read from the database.
+        Only offset + limit history rows after the cursor are read.
+        """
+        if status_filter is None:
+            status_filter = JobStatus.ALL
+
+        active_jobs, active_total = get_all_jobs(running, queued, {},
+                                                 status_filter=status_filter,
+                                                 workflow_id=workflow_id,
+                                                 sort_by=sort_by,
+                                                 sort_order=sort_order,
+                                                 cursor=cursor)
+
+        history_jobs = []
+        history_total = 0
+        statuses = HISTORY_STATUSES & set(status_filter)
+        if statuses:
+            filters = []
+            if len(statuses) == 1:
+                # Equality instead of IN so the rows come in index order
+                filters.append(HistoryItem.status == next(iter(statuses)))
+            elif statuses != HISTORY_STATUSES:
+                filters.append(HistoryItem.status.in_(statuses))
+            if workflow_id:
+                filters.append(HistoryItem.workflow_id == workflow_id)
+
+            sort_column = HistoryItem.execution_duration if sort_by == 'execution_duration' else HistoryItem.create_time
+            key = tuple_(sort_column, HistoryItem.prompt_id)
+            stmt = select(*SUMMARY_COLUMNS).where(*filters)
+            if sort_order == 'desc':
+                if cursor is not None:
+                    stmt = stmt.where(key < tuple_(*cursor))
+                stmt = stmt.order_by(sort_column.desc(), HistoryItem.prompt_id.desc())
+            else:
+                if cursor is not None:
+                    stmt = stmt.where(key > tuple_(*cursor))
+                stmt = stmt.order_by(sort_column, HistoryItem.prompt_id)
+            if limit is not None:
+                stmt = stmt.limit(offset + limit)
+
+            with create_session() as session:
+                history_total = session.scalar(select(func.count()).select_from(HistoryItem).where(*filters))
+                history_jobs = [_summary_to_job(row) for row in session.execute(stmt)]
+
+        jobs = list(heapq.merge(active_jobs, history_jobs,
+                                key=lambda job: get_sort_key(job, sort_by),
+                                reverse=(sort_order == 'desc')))
+        if offset > 0:
+            jobs = jobs[offset:]
+        if limit is not None:
+            jobs = jobs[:limit]
+        return (jobs, active_total + history_total)
+
+    def delete(self, prompt_id: str):
+        with create_session() as session:
+            session.execute(delete(HistoryItem).where(HistoryItem.prompt_id == prompt_id))
+            session.commit()
+
+    def wipe(self):
+        with create_session() as session:
+            session.execute(delete(HistoryItem))
+            session.commit()
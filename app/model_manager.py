@@ -82,6 +82,9 @@ class ModelFileManager:
         output_list: list[dict] = []
 
         for index, folder in enumerate(folders[0]):
+            if folder_paths.model_index is not None:
+                output_list.extend(self.index_model_file_list_(folder, index))
+                continue
             if not os.path.isdir(folder):
                 continue
             out = self.cache_model_file_list_(folder)
@@ -109,6 +112,23 @@ class ModelFileManager:
 
         return model_file_list_cache
 
+    def index_model_file_list_(self, directory: str, pathIndex: int) -> list[dict]:
+        # Same listing as recursive_search_models_, from the shared model index
+        result: list[dict] = []
+        files = folder_paths.model_index.get(directory).get_files()
+        for relative_path in filter_files_extensions(files.keys(), folder_paths.supported_pt_extensions):
+            if any(part.startswith(".") for part in relative_path.split(os.sep)):
+                continue
+            modified, created, size = files[relative_path]
+            result.append({
+                "name": relative_path,
+                "pathIndex": pathIndex,
+                "modified": modified,
+                "created": created,
+                "size": size
+            })
+        return result
+
     def recursive_search_models_(self, directory: str, pathIndex: int) -> tuple[list[str], dict[str, float], float]:
         if not os.path.isdir(directory):
             return [], {}, time.perf_counter()
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import logging
+import traceback
+from typing import Any, Callable, Optional
+
+import folder_paths
+import nodes
+
+
+class ObjectInfoCache:
+    """
+    Node definitions served by /object_info. Each node class is only asked for its definition again
+    when its class changed or one of the model folders or directories its INPUT_TYPES read changed
+    (see folder_paths.dependency_tracker). The serialized document is kept until a definition
+    changes.
+    """
+    def __init__(self, node_info: Callable[[str], dict]):
+        self.node_info = node_info
+        # node class -> (class object, {dependency: fingerprint}, definition)
+        self.entries: dict[str, tuple[type, dict, dict]] = {}
+        # (definitions, json body, etag), the gzip body is added on first use
+        self.document: Optional[tuple[dict, bytes, str]] = None
+        self.gzip_body: Optional[bytes] = None
+
+    def _fingerprint(self, dependency, fingerprints: dict) -> Any:
+        if dependency not in fingerprints:
+            fingerprints[dependency] = folder_paths.get_dependency_fingerprint(dependency)
+        return fingerprints[dependency]
+
+    def _get(self, node_class: str, fingerprints: dict) -> tuple[dict, bool]:
+        obj_class = nodes.NODE_CLASS_MAPPINGS[node_class]
+        entry = self.entries.get(node_class)
+        if entry is not None and entry[0] is obj_class and all(self._fingerprint(d, fingerprints) == f for d, f in entry[1].items()):
+            return entry[2], False
+
+        with folder_paths.dependency_tracker.track(fingerprints) as dependencies:
+            info = self.node_info(node_class)
+        self.entries[node_class] = (obj_class, dependencies, info)
+        # Definitions with untracked reads are rebuilt every time, usually to the same value
+        return info, entry is None or entry[2] != info
+
+    def get(self, node_class: str) -> dict:
+        with folder_paths.cache_helper:
+            return self._get(node_class, {})[0]
+
+    def get_document(self) -> tuple[bytes, str]:
+        """
+        Returns the json encoded definitions of every node class and their etag.
+        """
+        fingerprints = {}
+        changed = self.document is None
+        out = {}
+        with folder_paths.cache_helper:
+            for x in nodes.NODE_CLASS_MAPPINGS:
+                try:
+                    info, updated = self._get(x, fingerprints)
+                except Exception:
+                    logging.error(f"[ERROR] An error occurred while retrieving information for the '{x}' node.")
+                    logging.error(traceback.format_exc())
+                    self.entries.pop(x, None)
+                    continue
+                out[x] = info
+                changed = changed or updated
+
+        if changed or self.document[0].keys() != out.keys():
+            body = json.dumps(out).encode("utf-8")
+            self.document = (out, body, '"{}"'.format(hashlib.sha256(body).hexdigest()))
+            self.gzip_body = None
+        return self.document[1], self.document[2]
+
+    def get_gzip_document(self) -> bytes:
+        if self.gzip_body is None:
+            self.gzip_body = gzip.compress(self.document[1], compresslevel=6)
+        return self.gzip_body
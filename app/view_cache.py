@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import collections
+import hashlib
+import logging
+import os
+import threading
+from io import BytesIO
+from typing import Optional
+
+from PIL import Image
+
+
+def get_rendition_key(file: str, stat: os.stat_result, image_format: str, quality: int, channel: str) -> str:
+    """
+    Content address of a derived rendition of file. The mtime and size make it change whenever the
+    source image is rewritten.
+    """
+    key = "{}|{}|{}|{}|{}|{}".format(os.path.abspath(file), stat.st_mtime_ns, stat.st_size, image_format, quality, channel)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def render_preview(file: str, image_format: str, quality: int, channel: str) -> bytes:
+    with Image.open(file) as img:
+        buffer = BytesIO()
+        if image_format in ['jpeg'] or channel == 'rgb':
+            img = img.convert("RGB")
+        img.save(buffer, format=image_format, quality=quality)
+        return buffer.getvalue()
+
+
+def render_channel(file: str, channel: str) -> bytes:
+    with Image.open(file) as img:
+        buffer = BytesIO()
+        if channel == 'rgb':
+            if img.mode == "RGBA":
+                r, g, b, a = img.split()
+                new_img = Image.merge('RGB', (r, g, b))
+            else:
+                new_img = img.convert("RGB")
+            new_img.save(buffer, format='PNG')
+        else:
+            if img.mode == "RGBA":
+                _, _, _, a = img.split()
+            else:
+                a = Image.new('L', img.size, 255)
+
+            # alpha img
+            alpha_img = Image.new('RGBA', img.size)
+            alpha_img.putalpha(a)
+            alpha_img.save(buffer, format='PNG')
+        return buffer.getvalue()
+
+
+class RenditionCache:
+    """
+    Size bounded LRU store of the previews and channel extracts served by /view, one file per
+    rendition named after its key.
+    """
+    def __init__(self, directory: str, max_size_bytes: int):
+        self.directory = directory
+        self.max_size_bytes = max_size_bytes
+        self.lock = threading.Lock()
+        self.entries: collections.OrderedDict[str, int] = collections.OrderedDict()
+        self.total_size = 0
+        self.scanned = False
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _scan(self):
+        # Called with the lock held, the directory is only scanned on first use
+        self.scanned = True
+        found = []
+        if os.path.isdir(self.directory):
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        if name.endswith(".tmp"):
+                            # Leftover from an interrupted write
+                            os.remove(path)
+                            continue
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    found.append((stat.st_mtime, name, stat.st_size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.total_size += size
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            if not self.scanned:
+                self._scan()
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            with self.lock:
+                size = self.entries.pop(key, None)
+                if size is not None:
+                    self.total_size -= size
+            return None
+
+    def set(self, key: str, data: bytes):
+        if len(data) > self.max_size_bytes:
+            return
+        path = self._path(key)
+        tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning("Failed to write preview cache entry {}: {}".format(path, e))
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        to_remove = []
+        with self.lock:
+            if not self.scanned:
+                self._scan()
+            self.total_size -= self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            self.total_size += len(data)
+            while self.total_size > self.max_size_bytes and len(self.entries) > 0:
+                old_key, size = self.entries.popitem(last=False)
+                self.total_size -= size
+                to_remove.append(old_key)
+        for old_key in to_remove:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def get_or_render(self, key: str, render, *args) -> bytes:
+        data = self.get(key)
+        if data is None:
+            data = render(*args)
+            self.set(key, data)
+        return data
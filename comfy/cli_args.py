@@ -114,6 +114,21 @@ cache_group.add_argument("--cache-lru", type=int, default=0, help="Use LRU cachi
 cache_group.add_argument("--cache-none", action="store_true", help="Reduced RAM/VRAM usage at the expense of executing every node for each run.")
 cache_group.add_argument("--cache-ram", nargs='?', const=4.0, type=float, default=0, help="Use RAM pressure caching with the specified headroom threshold. If available RAM drops below the threhold the cache remove large items to free RAM. Default 4GB")
 
+parser.add_argument("--cache-disk", nargs='?', const=10.0, type=float, default=0, help="Spill node outputs (conditionings, latents, images...) to a persistent on-disk cache behind the RAM cache, limited to the specified size in GB. Entries survive restarts and can be shared between instances. Default 10GB")
+parser.add_argument("--view-cache-size", type=float, default=1024, help="Maximum size in MB of the on-disk cache of image previews rendered by /view. Set to 0 to disable.")
+parser.add_argument("--model-index", nargs='?', const="auto", default=None, choices=["auto", "inotify", "poll"], help="Keep a persistent index of the model folders that is updated incrementally instead of walking them whenever they change. Changes are picked up with inotify where available or by polling directory mtimes (use poll for network storage, where inotify misses remote changes).")
+parser.add_argument("--prefetch-models", type=int, nargs='?', const=2, default=0, metavar="THREADS", help="Read the model files of queued prompts in the background so they are in the page cache by the time their loader nodes run. The optional value is the number of reader threads (default 2).")
+parser.add_argument("--patched-weight-cache-size", type=float, default=0, metavar="MB", help="Keep up to the specified size in MB of LoRA patched weights in RAM so reusing the same model and LoRAs in a later prompt copies the merged weights instead of recomputing them. Set to 0 to disable.")
+parser.add_argument("--batch-prompts", type=int, default=0, metavar="N", help="Sample the KSampler of up to N queued prompts that use the same model, sampler settings and latent size in one batch. Only samplers that do not add noise while sampling (euler, dpmpp_2m, uni_pc...) are batched. Needs the node cache, so it does nothing with --cache-none.")
+parser.add_argument("--model-index-poll-interval", type=float, default=5.0, metavar="SECONDS", help="How often the model index checks the model folders for changes when polling.")
+parser.add_argument("--cache-directory", type=str, default=None, help="Set the ComfyUI cache directory used by the persistent caches. Overrides --base-directory.")
+
+parser.add_argument("--workers", type=int, default=1, metavar="NUM_WORKERS", help="Run prompts on N separate worker processes pulling from the same queue. Prompts are routed to the worker that already has their models loaded.")
+parser.add_argument("--worker-devices", type=int, nargs="+", default=None, metavar="DEVICE_ID", help="Pin the --workers processes to these cuda devices (round robin).")
+parser.add_argument("--worker-connect", type=str, default=None, help=argparse.SUPPRESS)
+
+parser.add_argument("--parallel-cpu-nodes", nargs='?', const=4, type=int, default=0, metavar="NUM_THREADS", help="Run nodes that declare a CPU device affinity (image loading, mask ops...) in a pool of worker threads so independent branches overlap with GPU work. Default 4 threads.")
+
 attn_group = parser.add_mutually_exclusive_group()
 attn_group.add_argument("--use-split-cross-attention", action="store_true", help="Use the split cross attention optimization. Ignored when xformers is used.")
 attn_group.add_argument("--use-quad-cross-attention", action="store_true", help="Use the sub-quadratic cross attention optimization . Ignored when xformers is used.")
@@ -173,6 +188,9 @@ parser.add_argument("--quick-test-for-ci", action="store_true", help="Quick test
 parser.add_argument("--windows-standalone-build", action="store_true", help="Windows standalone build: Enable convenient things that most people using the standalone windows build will probably enjoy (like auto opening the page on startup).")
 
 parser.add_argument("--disable-metadata", action="store_true", help="Disable saving prompt metadata in files.")
+parser.add_argument("--image-writer-threads", type=int, default=0, metavar="NUM_THREADS", help="Threads encoding the images saved by SaveImage and PreviewImage in parallel. Default: the number of CPUs, at most 8.")
+parser.add_argument("--async-image-save", action="store_true", help="Let SaveImage and PreviewImage return once their images are handed to the image writer threads instead of waiting for the files to be written.")
+parser.add_argument("--disable-profiler", action="store_true", help="Disable recording the per node, sampler step and model load timings of prompts served by /api/jobs/{id}/profile.")
 parser.add_argument("--disable-all-custom-nodes", action="store_true", help="Disable loading all custom nodes.")
 parser.add_argument("--whitelist-custom-nodes", type=str, nargs='+', default=[], help="Specify custom node folders to load even when --disable-all-custom-nodes is enabled.")
 parser.add_argument("--disable-api-nodes", action="store_true", help="Disable loading all api nodes. Also prevents the frontend from communicating with the internet.")
@@ -233,6 +251,7 @@ database_default_path = os.path.abspath(
 )
 parser.add_argument("--database-url", type=str, default=f"sqlite:///{database_default_path}", help="Specify the database URL, e.g. for an in-memory database you can use 'sqlite:///:memory:'.")
 parser.add_argument("--disable-assets-autoscan", action="store_true", help="Disable asset scanning on startup for database synchronization.")
+parser.add_argument("--disable-persistent-history", action="store_true", help="Keep the prompt history in memory instead of the database, it will be lost on restart.")
 
 if comfy.options.args_parsing:
     args = parser.parse_args()
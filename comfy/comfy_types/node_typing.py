@@ -318,6 +318,15 @@ class ComfyNodeABC(ABC):
 
     Comfy Docs: https://docs.comfy.org/custom-nodes/backend/server_overview#function
     """
+    DEVICE_AFFINITY: Optional[Literal["cpu"]]
+    """Hints where the node does its work. Nodes with ``DEVICE_AFFINITY = "cpu"`` only do CPU work (file I/O, PIL, numpy)
+    and are thread safe, so they can run in a worker thread alongside other nodes when ``--parallel-cpu-nodes`` is enabled.
+    """
+
+    PREFETCH_MODELS: Optional[dict[str, str]]
+    """Maps the inputs that name a model file to the model folder it is in, e.g. ``{"ckpt_name": "checkpoints"}``.
+    With ``--prefetch-models`` those files are read into the page cache in the background as soon as a prompt using the node is queued.
+    """
 
 
 class CheckLazyMixin:
@@ -0,0 +1,114 @@
+"""
+Encoding and writing of the images saved by SaveImage and PreviewImage in a thread pool.
+
+PNG encoding (zlib) releases the GIL, so the images of a batch are encoded in parallel. With
+--async-image-save the node returns once the images are handed to the pool and the files are written
+shortly after, /view waits for files that are still being written. Files are written under a
+temporary name and renamed, so a file that exists is complete.
+
+set_writer replaces the writer, e.g. with a subclass of ImageWriter that overrides write_file.
+"""
+import concurrent.futures
+import functools
+import logging
+import os
+import threading
+
+import torch
+from PIL import Image
+
+from comfy.cli_args import args
+
+# Images handed to the pool and not written yet, saving more waits for a slot
+MAX_PENDING = 256
+
+
+def to_uint8(images):
+    """
+    Converts a batch of images with values in 0-1 to a uint8 numpy array in one operation, on the
+    device of the images so only the uint8 data is copied to the CPU.
+    """
+    if not isinstance(images, torch.Tensor):
+        return [to_uint8(image) for image in images]
+    return torch.clamp(images * 255, min=0, max=255).to(torch.uint8).cpu().numpy()
+
+
+class ImageWriter:
+    def __init__(self, threads, asynchronous=False, max_pending=MAX_PENDING):
+        self.threads = threads
+        self.asynchronous = asynchronous
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix="image-writer")
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        # absolute path -> future of the write
+        self.pending = {}
+
+    def write_file(self, path, image, pnginfo=None, compress_level=4):
+        tmp_path = path + ".tmp"
+        try:
+            Image.fromarray(image).save(tmp_path, format="PNG", pnginfo=pnginfo, compress_level=compress_level)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def save(self, images, paths, pnginfo=None, compress_level=4):
+        """
+        Writes the uint8 images (H, W, C) to paths as PNG, all with the same metadata. Returns once
+        they are written, or once they are handed to the pool if the writer is asynchronous.
+        """
+        futures = []
+        for image, path in zip(images, paths):
+            path = os.path.abspath(path)
+            self.slots.acquire()
+            with self.lock:
+                future = self.pool.submit(self.write_file, path, image, pnginfo, compress_level)
+                self.pending[path] = future
+            future.add_done_callback(functools.partial(self._done, path))
+            futures.append(future)
+        if not self.asynchronous:
+            for future in futures:
+                future.result()
+
+    def _done(self, path, future):
+        with self.lock:
+            if self.pending.get(path) is future:
+                del self.pending[path]
+        self.slots.release()
+        if self.asynchronous and not future.cancelled() and future.exception() is not None:
+            logging.error("Failed to save image {}: {}".format(path, future.exception()))
+
+    def get_pending(self, path):
+        """
+        Returns the future of the write of path if it is still being written, or None.
+        """
+        with self.lock:
+            return self.pending.get(os.path.abspath(path))
+
+    def wait(self):
+        """
+        Waits for the writes handed to the pool so far.
+        """
+        with self.lock:
+            futures = list(self.pending.values())
+        concurrent.futures.wait(futures)
+
+
+writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global writer
+    with _writer_lock:
+        if writer is None:
+            threads = args.image_writer_threads or min(8, os.cpu_count() or 1)
+            writer = ImageWriter(threads, asynchronous=args.async_image_save)
+        return writer
+
+
+def set_writer(image_writer):
+    global writer
+    with _writer_lock:
+        writer = image_writer
@@ -438,3 +438,56 @@ def calculate_weight(patches, weight, key, intermediate_dtype=torch.float32, ori
             weight = old_weight
 
     return weight
+
+def _batchable_lora_patch(p, weight):
+    strength, v, strength_model, offset, function = p
+    if offset is not None or function is not None or strength_model != 1.0:
+        return False
+    if not isinstance(v, weight_adapter.LoRAAdapter):
+        return False
+    mat1, mat2, alpha, mid, dora_scale, reshape = v.weights
+    if mid is not None or dora_scale is not None or reshape is not None:
+        return False
+    return mat1.shape[0] * mat2.shape[1:].numel() == weight.numel()
+
+def calculate_weights_batched(patches, weights, intermediate_dtype=torch.float32):
+    """
+    calculate_weight for several keys at once. patches and weights are dicts of key -> patch list
+    and key -> weight, weights are modified in place like calculate_weight does and the dict of
+    patched weights is returned.
+
+    The deltas of plain LoRA patches (no dora, locon mid, offset or function) with the same up and
+    down shapes are computed together with one torch.bmm instead of one torch.mm per key, all the
+    other patches go through calculate_weight. The order the patches of a key are applied in is kept.
+    """
+    groups = {}
+    for key, key_patches in patches.items():
+        weight = weights[key]
+        for i, p in enumerate(key_patches):
+            if _batchable_lora_patch(p, weight):
+                mat1, mat2 = p[1].weights[:2]
+                groups.setdefault((mat1.shape[0], mat1.shape[1], mat2.shape[1:].numel(), weight.device), []).append((key, i))
+
+    diffs = {}
+    for (_, _, _, device), members in groups.items():
+        mat1 = torch.stack([comfy.model_management.cast_to_device(patches[key][i][1].weights[0], device, intermediate_dtype).flatten(start_dim=1) for key, i in members])
+        mat2 = torch.stack([comfy.model_management.cast_to_device(patches[key][i][1].weights[1], device, intermediate_dtype).flatten(start_dim=1) for key, i in members])
+        for member, diff in zip(members, torch.bmm(mat1, mat2).unbind(0)):
+            diffs[member] = diff
+        del mat1, mat2
+
+    for key, key_patches in patches.items():
+        weight = weights[key]
+        for i, p in enumerate(key_patches):
+            lora_diff = diffs.pop((key, i), None)
+            if lora_diff is None:
+                weight = calculate_weight([p], weight, key, intermediate_dtype=intermediate_dtype)
+                continue
+            v = p[1].weights
+            if v[2] is not None:
+                alpha = v[2] / v[1].shape[0]
+            else:
+                alpha = 1.0
+            weight += ((p[0] * alpha) * lora_diff.reshape(weight.shape)).type(weight.dtype)
+        weights[key] = weight
+    return weights
@@ -0,0 +1,159 @@
+"""
+Counters, gauges and histograms served in the Prometheus text format by /metrics.
+
+The metrics are plain module level objects updated where things happen (queue, executor, model
+management). Gauges that are cheap to read are set when /metrics is scraped instead, see
+PromptServer.update_metrics. Updating a metric is a dict lookup under a lock.
+"""
+import bisect
+import math
+import threading
+
+REGISTRY = []
+
+# Seconds, from a cached node to a long video sampler
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if len(pairs) == 0:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, _escape(v)) for k, v in pairs) + "}"
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        # label values -> value
+        self.values = {}
+        if registry is not None:
+            registry.append(self)
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError("{} takes the labels {}, got {}".format(self.name, self.labelnames, labels))
+        return tuple(str(v) for v in labels)
+
+    def get(self, *labels):
+        with self.lock:
+            return self.values.get(self._key(labels), 0)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def samples(self):
+        with self.lock:
+            values = list(self.values.items())
+        for labels, value in sorted(values):
+            yield self.name, labels, None, value
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation.replace("\\", "\\\\").replace("\n", "\\n")),
+                 "# TYPE {} {}".format(self.name, self.type)]
+        for name, labels, extra, value in self.samples():
+            lines.append("{}{} {}".format(name, _format_labels(self.labelnames, labels, extra), _format_value(value)))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, *labels):
+        if amount < 0:
+            raise ValueError("Counters can only be increased")
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, *labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # count per bucket (the last one is +Inf), sum
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[i] += 1
+            counts[-1] += value
+
+    def get(self, *labels):
+        """
+        Returns the (count, sum) of the observations.
+        """
+        with self.lock:
+            counts = self.values.get(self._key(labels))
+            if counts is None:
+                return 0, 0.0
+            return sum(counts[:-1]), counts[-1]
+
+    def samples(self):
+        with self.lock:
+            values = [(k, list(v)) for k, v in self.values.items()]
+        for labels, counts in sorted(values):
+            total = 0
+            for le, count in zip(self.buckets + (math.inf,), counts[:-1]):
+                total += count
+                yield self.name + "_bucket", labels, ("le", _format_value(float(le))), total
+            yield self.name + "_sum", labels, None, counts[-1]
+            yield self.name + "_count", labels, None, total
+
+
+def render(registry=REGISTRY):
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+QUEUE_PENDING = Gauge("comfyui_queue_pending", "Prompts waiting in the queue.")
+QUEUE_RUNNING = Gauge("comfyui_queue_running", "Prompts being executed.")
+QUEUE_WAIT_SECONDS = Histogram("comfyui_queue_wait_seconds", "Time from queuing a prompt to the start of its execution.")
+PROMPTS = Counter("comfyui_prompts_total", "Executed prompts by outcome.", ("status",))
+PROMPT_SECONDS = Histogram("comfyui_prompt_execution_seconds", "Execution time of prompts.")
+NODE_SECONDS = Histogram("comfyui_node_execution_seconds", "Execution time of nodes that were not cached, by node class.", ("class_type",))
+CACHE_LOOKUPS = Counter("comfyui_cache_lookups_total", "Lookups in the execution caches by cache and result (hit or miss).", ("cache", "result"))
+CACHE_ENTRIES = Gauge("comfyui_cache_entries", "Entries in the execution caches.", ("cache",))
+MODELS_LOADED = Counter("comfyui_models_loaded_total", "Models loaded (fully or partially) to a device.")
+MODELS_UNLOADED = Counter("comfyui_models_unloaded_total", "Models unloaded by free_memory.")
+FREED_BYTES = Counter("comfyui_free_memory_unloaded_bytes_total", "Bytes of model weights moved off the device by free_memory.")
+LOADED_MODELS = Gauge("comfyui_loaded_models", "Models currently loaded.")
+LOADED_MODEL_BYTES = Gauge("comfyui_loaded_model_bytes", "Bytes of model weights currently loaded to a device.")
+PINNED_MEMORY_BYTES = Gauge("comfyui_pinned_memory_bytes", "Pinned host memory.")
+DEVICE_MEMORY_BYTES = Gauge("comfyui_device_memory_bytes", "Memory of the torch device.", ("kind",))
+WEBSOCKET_BACKLOG = Gauge("comfyui_websocket_send_backlog", "Messages waiting to be sent to websocket clients.")
+WEBSOCKET_DROPPED = Counter("comfyui_websocket_dropped_messages_total", "Messages to websocket clients that were not sent, replaced by a newer one (coalesced) or dropped with a client that fell too far behind (overflow).", ("reason",))
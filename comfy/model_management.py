@@ -29,6 +29,8 @@ import gc
 import os
 from contextlib import nullcontext
 import comfy.memory_management
+import comfy.metrics
+import comfy.profiler
 import comfy.utils
 import comfy.quant_ops
 
@@ -632,15 +634,20 @@ def free_memory(memory_required, device, keep_loaded=[], for_dynamic=False, ram_
             #as that works on-demand.
             memory_required -= current_loaded_models[i].model.loaded_size()
             memory_to_free = 0
-        if memory_to_free > 0 and current_loaded_models[i].model_unload(memory_to_free):
-            logging.debug(f"Unloading {current_loaded_models[i].model.model.__class__.__name__}")
-            unloaded_model.append(i)
+        if memory_to_free > 0:
+            loaded_memory = current_loaded_models[i].model_loaded_memory()
+            unloaded = current_loaded_models[i].model_unload(memory_to_free)
+            comfy.metrics.FREED_BYTES.inc(max(0, loaded_memory - current_loaded_models[i].model_loaded_memory()))
+            if unloaded:
+                logging.debug(f"Unloading {current_loaded_models[i].model.model.__class__.__name__}")
+                unloaded_model.append(i)
         if ram_to_free > 0:
             logging.debug(f"RAM Unloading {current_loaded_models[i].model.model.__class__.__name__}")
             current_loaded_models[i].model.partially_unload_ram(ram_to_free)
 
     for i in sorted(unloaded_model, reverse=True):
         unloaded_models.append(current_loaded_models.pop(i))
+    comfy.metrics.MODELS_UNLOADED.inc(len(unloaded_model))
 
     if len(unloaded_model) > 0:
         soft_empty_cache()
@@ -743,8 +750,10 @@ def load_models_gpu_orig(models, memory_required=0, force_patch_weights=False, m
         if vram_set_state == VRAMState.NO_VRAM:
             lowvram_model_memory = 0.1
 
-        loaded_model.model_load(lowvram_model_memory, force_patch_weights=force_patch_weights)
+        with comfy.profiler.span("model_load", "model_load", {"model": loaded_model.model.model.__class__.__name__, "lowvram_memory": lowvram_model_memory}):
+            loaded_model.model_load(lowvram_model_memory, force_patch_weights=force_patch_weights)
         current_loaded_models.insert(0, loaded_model)
+        comfy.metrics.MODELS_LOADED.inc()
     return
 
 def load_models_gpu_thread(models, memory_required, force_patch_weights, minimum_memory_required, force_full_load):
@@ -753,19 +762,20 @@ def load_models_gpu_thread(models, memory_required, force_patch_weights, minimum
         soft_empty_cache()
 
 def load_models_gpu(models, memory_required=0, force_patch_weights=False, minimum_memory_required=None, force_full_load=False):
-    #Deliberately load models outside of the Aimdo mempool so they can be retained accross
-    #nodes. Use a dummy thread to do it as pytorch documents that mempool contexts are
-    #thread local. So exploit that to escape context
-    if enables_dynamic_vram():
-        t = threading.Thread(
-            target=load_models_gpu_thread,
-            args=(models, memory_required, force_patch_weights, minimum_memory_required, force_full_load)
-        )
-        t.start()
-        t.join()
-    else:
-        load_models_gpu_orig(models, memory_required=memory_required, force_patch_weights=force_patch_weights,
-                             minimum_memory_required=minimum_memory_required, force_full_load=force_full_load)
+    with comfy.profiler.span("load_models_gpu", "model_load", {"models": len(models)}):
+        #Deliberately load models outside of the Aimdo mempool so they can be retained accross
+        #nodes. Use a dummy thread to do it as pytorch documents that mempool contexts are
+        #thread local. So exploit that to escape context
+        if enables_dynamic_vram():
+            t = threading.Thread(
+                target=load_models_gpu_thread,
+                args=(models, memory_required, force_patch_weights, minimum_memory_required, force_full_load)
+            )
+            t.start()
+            t.join()
+        else:
+            load_models_gpu_orig(models, memory_required=memory_required, force_patch_weights=force_patch_weights,
+                                 minimum_memory_required=minimum_memory_required, force_full_load=force_full_load)
 
 def load_model_gpu(model):
     return load_models_gpu([model])
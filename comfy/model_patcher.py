@@ -32,6 +32,7 @@ import comfy.float
 import comfy.hooks
 import comfy.lora
 import comfy.model_management
+import comfy.patched_weight_cache
 import comfy.patcher_extension
 import comfy.utils
 from comfy.comfy_types import UnetWrapperFunction
@@ -127,6 +128,9 @@ class LowVramPatch:
 
 LOWVRAM_PATCH_ESTIMATE_MATH_FACTOR = 2
 
+# Size of the weights patched together by patch_weights_to_device
+PATCH_BATCH_MEMORY = 256 * 1024 * 1024
+
 def low_vram_patch_estimate_vram(model, key):
     weight, set_func, convert_func = get_key_weight(model, key)
     if weight is None:
@@ -641,21 +645,38 @@ class ModelPatcher:
             return weight
 
         inplace_update = self.weight_inplace_update or inplace_update
+        temp_dtype = comfy.model_management.lora_compute_dtype(device_to)
+
+        # Only weights that are not patched yet can be looked up, set_func weights are quantized
+        # from the unrounded result so they are not cached
+        cache = comfy.patched_weight_cache.cache
+        cache_key = None
+        if cache is not None and set_func is None and key not in self.backup:
+            device_type = torch.device(device_to).type if device_to is not None else weight.device.type
+            cache_key = cache.get_key(self.model, key, weight, self.patches[key], device_type, temp_dtype)
 
         if key not in self.backup and not return_weight:
             self.backup[key] = collections.namedtuple('Dimension', ['weight', 'inplace_update'])(weight.to(device=self.offload_device, copy=inplace_update), inplace_update)
 
-        temp_dtype = comfy.model_management.lora_compute_dtype(device_to)
-        if device_to is not None:
-            temp_weight = comfy.model_management.cast_to_device(weight, device_to, temp_dtype, copy=True)
-        else:
-            temp_weight = weight.to(temp_dtype, copy=True)
-        if convert_func is not None:
-            temp_weight = convert_func(temp_weight, inplace=True)
+        out_weight = None
+        if cache_key is not None:
+            out_weight = cache.get(cache_key, device_to)
+
+        if out_weight is None:
+            if device_to is not None:
+                temp_weight = comfy.model_management.cast_to_device(weight, device_to, temp_dtype, copy=True)
+            else:
+                temp_weight = weight.to(temp_dtype, copy=True)
+            if convert_func is not None:
+                temp_weight = convert_func(temp_weight, inplace=True)
+
+            out_weight = comfy.lora.calculate_weight(self.patches[key], temp_weight, key)
+            if set_func is None:
+                out_weight = comfy.float.stochastic_rounding(out_weight, weight.dtype, seed=comfy.utils.string_to_seed(key))
+                if cache_key is not None:
+                    cache.put(cache_key, out_weight)
 
-        out_weight = comfy.lora.calculate_weight(self.patches[key], temp_weight, key)
         if set_func is None:
-            out_weight = comfy.float.stochastic_rounding(out_weight, weight.dtype, seed=comfy.utils.string_to_seed(key))
             if return_weight:
                 return out_weight
             elif inplace_update:
@@ -665,6 +686,56 @@ class ModelPatcher:
         else:
             return set_func(out_weight, inplace_update=inplace_update, seed=comfy.utils.string_to_seed(key), return_weight=return_weight)
 
+    def patch_weights_to_device(self, keys, device_to=None):
+        """
+        Same as calling patch_weight_to_device on each key, except that the LoRA deltas of the
+        weights are computed in batches (see comfy.lora.calculate_weights_batched). Weights are
+        patched in chunks of up to PATCH_BATCH_MEMORY bytes to bound the extra memory used.
+        """
+        inplace_update = self.weight_inplace_update
+        temp_dtype = comfy.model_management.lora_compute_dtype(device_to)
+        batch = {}
+        batch_memory = 0
+
+        def patch_batch():
+            patched = comfy.lora.calculate_weights_batched({k: self.patches[k] for k in batch}, batch)
+            for key, out_weight in patched.items():
+                weight, _, _ = get_key_weight(self.model, key)
+                out_weight = comfy.float.stochastic_rounding(out_weight, weight.dtype, seed=comfy.utils.string_to_seed(key))
+                if inplace_update:
+                    comfy.utils.copy_to_param(self.model, key, out_weight)
+                else:
+                    comfy.utils.set_attr_param(self.model, key, out_weight)
+            batch.clear()
+            if comfy.model_management.is_device_cuda(device_to):
+                torch.cuda.synchronize()
+
+        for key in keys:
+            if key not in self.patches:
+                continue
+            weight, set_func, convert_func = get_key_weight(self.model, key)
+            if set_func is not None or comfy.patched_weight_cache.cache is not None:
+                self.patch_weight_to_device(key, device_to=device_to)
+                continue
+
+            if key not in self.backup:
+                self.backup[key] = collections.namedtuple('Dimension', ['weight', 'inplace_update'])(weight.to(device=self.offload_device, copy=inplace_update), inplace_update)
+
+            if device_to is not None:
+                temp_weight = comfy.model_management.cast_to_device(weight, device_to, temp_dtype, copy=True)
+            else:
+                temp_weight = weight.to(temp_dtype, copy=True)
+            if convert_func is not None:
+                temp_weight = convert_func(temp_weight, inplace=True)
+            batch[key] = temp_weight
+            batch_memory += temp_weight.nbytes
+            if batch_memory >= PATCH_BATCH_MEMORY:
+                patch_batch()
+                batch_memory = 0
+
+        if len(batch) > 0:
+            patch_batch()
+
     def pin_weight_to_device(self, key):
         weight, set_func, convert_func = get_key_weight(self.model, key)
         if comfy.model_management.pin_memory(weight):
@@ -791,6 +862,8 @@ class ModelPatcher:
                 mem_counter += move_weight_functions(m, device_to)
 
             load_completely.sort(reverse=True)
+            patch_keys = []
+            patch_modules = []
             for x in load_completely:
                 n = x[1]
                 m = x[2]
@@ -802,10 +875,11 @@ class ModelPatcher:
                 for param in params:
                     key = key_param_name_to_key(n, param)
                     self.unpin_weight(key)
-                    self.patch_weight_to_device(key, device_to=device_to)
-                if comfy.model_management.is_device_cuda(device_to):
-                    torch.cuda.synchronize()
+                    patch_keys.append(key)
+                patch_modules.append((n, m))
 
+            self.patch_weights_to_device(patch_keys, device_to=device_to)
+            for n, m in patch_modules:
                 logging.debug("lowvram: loaded module regularly {} {}".format(n, m))
                 m.comfy_patched_weights = True
 
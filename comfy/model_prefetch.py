@@ -0,0 +1,148 @@
+"""
+Background reads of model files that queued prompts are going to load, so that the loader nodes
+find them in the page cache instead of waiting on the disk.
+"""
+import collections
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# Only warm files that fit in this fraction of the currently available RAM, larger ones would
+# evict each other (and everything else) from the page cache before they are loaded.
+MAX_AVAILABLE_RAM_FRACTION = 0.5
+
+# Number of finished prefetches remembered so that prompts queued in a row do not read the same
+# files again.
+RECENT_PREFETCHES = 32
+
+
+class ModelPrefetcher:
+    def __init__(self, num_threads=2):
+        self.executor = ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix="model-prefetch")
+        self.lock = threading.Lock()
+        # path -> (future, started event, cancel event, size)
+        self.pending = {}
+        # path -> ids of the queued prompts a pending prefetch is for
+        self.owners = {}
+        # path -> (size, mtime) of finished prefetches
+        self.recent = collections.OrderedDict()
+        self.pending_bytes = 0
+
+    def prefetch(self, paths, prompt_id=None):
+        """
+        Starts reading paths for the queued prompt prompt_id, see cancel.
+        """
+        for path in paths:
+            path = os.path.abspath(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            with self.lock:
+                if path in self.pending:
+                    self.owners[path].add(prompt_id)
+                    continue
+                if self.recent.get(path) == (stat.st_size, stat.st_mtime):
+                    continue
+                if self.pending_bytes + stat.st_size > psutil.virtual_memory().available * MAX_AVAILABLE_RAM_FRACTION:
+                    logging.debug("Not prefetching {}, not enough free RAM".format(path))
+                    continue
+                started = threading.Event()
+                cancel = threading.Event()
+                self.pending_bytes += stat.st_size
+                future = self.executor.submit(self._read, path, stat, started, cancel)
+                self.pending[path] = (future, started, cancel, stat.st_size)
+                self.owners[path] = {prompt_id}
+
+    def _read(self, path, stat, started, cancel):
+        started.set()
+        try:
+            if cancel.is_set():
+                return
+            with open(path, "rb", buffering=0) as f:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                buffer = bytearray(CHUNK_SIZE)
+                while not cancel.is_set():
+                    if f.readinto(buffer) == 0:
+                        break
+            if cancel.is_set():
+                return
+            with self.lock:
+                self.recent[path] = (stat.st_size, stat.st_mtime)
+                self.recent.move_to_end(path)
+                while len(self.recent) > RECENT_PREFETCHES:
+                    self.recent.popitem(last=False)
+        except OSError as e:
+            logging.debug("Failed to prefetch {}: {}".format(path, e))
+        finally:
+            self._drop(path)
+
+    def _drop(self, path):
+        with self.lock:
+            entry = self.pending.pop(path, None)
+            if entry is not None:
+                self.pending_bytes -= entry[3]
+                del self.owners[path]
+
+    def _cancel(self, path, entry):
+        entry[2].set()
+        if entry[0].cancel():
+            # Never started, so _read will not clean up after it
+            self._drop(path)
+
+    def wait(self, path):
+        """
+        Called before loading path. Waits for a prefetch of the file that is already reading it,
+        so the load does not compete with it for the disk, and drops one that has not started yet.
+        """
+        path = os.path.abspath(path)
+        with self.lock:
+            entry = self.pending.get(path)
+        if entry is None:
+            return
+        if not entry[1].is_set():
+            self._cancel(path, entry)
+            return
+        try:
+            entry[0].result()
+        except Exception:
+            pass
+
+    def cancel(self, prompt_ids):
+        """
+        Called when the prompts in prompt_ids are removed from the queue. Stops the prefetches that
+        no other prompt is waiting for.
+        """
+        prompt_ids = set(prompt_ids)
+        entries = []
+        with self.lock:
+            for path, owners in self.owners.items():
+                if owners.isdisjoint(prompt_ids):
+                    continue
+                owners.difference_update(prompt_ids)
+                if len(owners) == 0:
+                    entries.append((path, self.pending[path]))
+        for path, entry in entries:
+            self._cancel(path, entry)
+
+
+# Set with set_prefetcher (--prefetch-models)
+prefetcher = None
+
+def set_prefetcher(model_prefetcher):
+    global prefetcher
+    prefetcher = model_prefetcher
+
+def wait_for_prefetch(path):
+    if prefetcher is not None:
+        prefetcher.wait(path)
+
+def cancel_prefetch(prompt_ids):
+    if prefetcher is not None:
+        prefetcher.cancel(prompt_ids)
@@ -0,0 +1,128 @@
+"""
+Cache of patched (LoRA merged) weights, so applying the same patches to the same model again copies
+the merged weights instead of recomputing every up @ down (and LoHa/LoKr/OFT equivalent).
+
+Entries are keyed by the model, the weight key, the base weight (its storage and version, so a
+replaced or modified weight misses), the patch list (the identity of the patch tensors, strengths and
+offsets), the compute dtype and device type. They are kept in RAM on the CPU and
+evicted least recently used first once they exceed the configured size. Entries of models and
+patch tensors that were freed are dropped.
+"""
+import collections
+import logging
+import threading
+import weakref
+
+import torch
+
+import comfy.weight_adapter
+
+
+class NotCacheable(Exception):
+    pass
+
+
+def _tensor_version(tensor):
+    try:
+        return tensor._version
+    except RuntimeError:
+        # Inference tensors do not count their in place modifications
+        return None
+
+
+class PatchedWeightCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        # Reentrant, weakref callbacks can run during garbage collection while the lock is held
+        self.lock = threading.RLock()
+        # cache key -> (merged weight on the cpu, weakrefs that must stay alive)
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _fingerprint(self, value, refs):
+        if isinstance(value, torch.Tensor):
+            refs.append(value)
+            return ("tensor", id(value), value.data_ptr(), tuple(value.shape), value.dtype, value.device.type, _tensor_version(value))
+        if isinstance(value, comfy.weight_adapter.WeightAdapterBase):
+            if isinstance(value, torch.nn.Module):
+                # Trainable adapters change their weights in place
+                raise NotCacheable()
+            return (type(value).__name__, self._fingerprint(value.weights, refs))
+        if isinstance(value, (tuple, list)):
+            return tuple(self._fingerprint(v, refs) for v in value)
+        if isinstance(value, dict):
+            return tuple((k, self._fingerprint(v, refs)) for k, v in sorted(value.items()))
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        raise NotCacheable()
+
+    def get_key(self, model, key, weight, patches, device_type, dtype):
+        """
+        Returns the cache key of weight patched with patches together with the objects the entry
+        depends on, or None if the patches can not be cached (patch functions, nested patches,
+        trainable adapters).
+        """
+        refs = [model]
+        fingerprint = []
+        try:
+            for strength, v, strength_model, offset, function in patches:
+                if function is not None or isinstance(v, list):
+                    return None
+                fingerprint.append((strength, self._fingerprint(v, refs), strength_model, offset))
+        except NotCacheable:
+            return None
+        # Inference tensors have no version, only a weight replaced with another tensor is detected for them
+        base = (weight.data_ptr(), _tensor_version(weight), tuple(weight.shape), weight.dtype)
+        cache_key = (id(model), key, base, tuple(fingerprint), device_type, dtype)
+        return cache_key, refs
+
+    def get(self, cache_key, device):
+        with self.lock:
+            entry = self.entries.get(cache_key[0])
+            if entry is None or any(ref() is None for ref in entry[1]):
+                self.misses += 1
+                return None
+            self.entries.move_to_end(cache_key[0])
+            self.hits += 1
+            weight = entry[0]
+        return weight.to(device=device if device is not None else weight.device, copy=True)
+
+    def put(self, cache_key, weight):
+        size = weight.numel() * weight.element_size()
+        if size > self.max_bytes:
+            return
+        weight = weight.to(device="cpu", copy=True)
+        key = cache_key[0]
+        refs = [weakref.ref(obj, lambda _, key=key: self._drop(key)) for obj in cache_key[1]]
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[0].numel() * old[0].element_size()
+            self.entries[key] = (weight, refs)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.size -= evicted.numel() * evicted.element_size()
+
+    def _drop(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[0].numel() * entry[0].element_size()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+# Set with set_cache (--patched-weight-cache-size)
+cache = None
+
+def set_cache(patched_weight_cache):
+    global cache
+    cache = patched_weight_cache
+    if patched_weight_cache is not None:
+        logging.info("Caching patched weights, up to {:.0f} MB".format(patched_weight_cache.max_bytes / (1024 * 1024)))
@@ -0,0 +1,195 @@
+"""
+Timing of prompt execution.
+
+While a prompt runs, the executor records how long every node took (wall and CPU time of the thread
+running it) and whether it was cached, and spans are recorded for sampling, sampler steps,
+calc_cond_batch calls and model loads. Recording is two clock reads and a list append, nothing is
+recorded outside of a prompt. The profile is kept next to the history of the prompt and served by
+/api/jobs/{id}/profile, as a summary or as Chrome trace JSON (chrome://tracing, ui.perfetto.dev).
+
+GPU work is asynchronous and nothing here synchronizes the device: the sampler spans are the time the
+CPU spent queuing the work, which approaches the GPU time once its queue is full.
+"""
+import contextlib
+import threading
+import time
+
+from comfy.cli_args import args
+
+enabled = not args.disable_profiler
+
+# Profile of the running prompt
+current = None
+
+_null_span = contextlib.nullcontext()
+
+
+class Profile:
+    def __init__(self, prompt_id):
+        self.prompt_id = prompt_id
+        self.start_time = time.time()
+        self.start_ns = time.perf_counter_ns()
+        self.thread = threading.get_ident()
+        # (name, category, start_ns, end_ns, thread id, args)
+        self.events = []
+        self.nodes = {}
+
+    def add(self, name, cat, start_ns, end_ns, event_args=None):
+        self.events.append((name, cat, start_ns, end_ns, threading.get_ident(), event_args))
+
+    def node(self, node_id, class_type, cached, wall_ns=0, cpu_ns=0):
+        node = self.nodes.get(node_id)
+        if node is None:
+            node = self.nodes[node_id] = {"class_type": class_type, "cached": cached, "wall_ms": 0.0, "cpu_ms": 0.0}
+        elif class_type is not None:
+            node["class_type"] = class_type
+        node["wall_ms"] += wall_ns / 1e6
+        node["cpu_ms"] += cpu_ns / 1e6
+
+    def to_dict(self):
+        end_ns = time.perf_counter_ns()
+        totals = {}
+        events = []
+        for name, cat, start_ns, stop_ns, tid, event_args in self.events:
+            total = totals.setdefault(cat, {"count": 0, "total_ms": 0.0})
+            total["count"] += 1
+            total["total_ms"] += (stop_ns - start_ns) / 1e6
+            events.append([name, cat, (start_ns - self.start_ns) // 1000, (stop_ns - start_ns) // 1000, tid, event_args])
+        cached = sum(1 for n in self.nodes.values() if n["cached"])
+        return {
+            "prompt_id": self.prompt_id,
+            "start_time": self.start_time,
+            "duration_ms": (end_ns - self.start_ns) / 1e6,
+            "thread": self.thread,
+            "cache": {"hits": cached, "misses": len(self.nodes) - cached},
+            "nodes": self.nodes,
+            "totals": totals,
+            "events": events,
+        }
+
+
+class _Span:
+    __slots__ = ("profile", "name", "cat", "args", "start_ns")
+
+    def __init__(self, profile, name, cat, event_args):
+        self.profile = profile
+        self.name = name
+        self.cat = cat
+        self.args = event_args
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profile.add(self.name, self.cat, self.start_ns, time.perf_counter_ns(), self.args)
+
+
+def start(prompt_id):
+    global current
+    current = Profile(prompt_id) if enabled else None
+
+
+def finish():
+    """
+    Stops profiling the running prompt and returns its profile as a dict, or None.
+    """
+    global current
+    profile = current
+    current = None
+    if profile is None:
+        return None
+    return profile.to_dict()
+
+
+def span(name, cat, event_args=None):
+    """
+    Context manager recording a span of the running prompt, does nothing outside of a prompt.
+    """
+    profile = current
+    if profile is None:
+        return _null_span
+    return _Span(profile, name, cat, event_args)
+
+
+def node_start(cpu=True):
+    """
+    cpu=False leaves out the CPU time of the calling thread, for nodes that run in another thread
+    (see thread_cpu_start).
+    """
+    if current is None:
+        return None
+    return (current, time.perf_counter_ns(), time.thread_time_ns() if cpu else None)
+
+
+def node_end(started, node_id, class_type):
+    """
+    Records the execution of node_id that started when node_start() returned started.
+    """
+    if started is None:
+        return
+    profile, start_ns, start_cpu_ns = started
+    end_ns = time.perf_counter_ns()
+    cpu_ns = 0 if start_cpu_ns is None else time.thread_time_ns() - start_cpu_ns
+    profile.node(node_id, class_type, False, end_ns - start_ns, cpu_ns)
+    profile.add(class_type or node_id, "node", start_ns, end_ns, {"node": node_id})
+
+
+def thread_cpu_start():
+    if current is None:
+        return None
+    return (current, time.thread_time_ns())
+
+
+def thread_cpu_end(started, node_id):
+    """
+    Adds the CPU time the calling thread spent since thread_cpu_start() returned started to node_id.
+    """
+    if started is None:
+        return
+    profile, start_cpu_ns = started
+    profile.node(node_id, None, False, cpu_ns=time.thread_time_ns() - start_cpu_ns)
+
+
+def node_cached(node_id, class_type):
+    profile = current
+    if profile is not None:
+        profile.node(node_id, class_type, True)
+
+
+def wrap_step_callback(callback, total_steps):
+    """
+    Wraps a sampler step callback (which may be None) to record a span for each step.
+    """
+    profile = current
+    if profile is None:
+        return callback
+    last_ns = time.perf_counter_ns()
+
+    def step_callback(x):
+        nonlocal last_ns
+        now_ns = time.perf_counter_ns()
+        profile.add("step", "sampler_step", last_ns, now_ns, {"step": x["i"], "steps": total_steps})
+        last_ns = now_ns
+        if callback is not None:
+            return callback(x)
+    return step_callback
+
+
+def chrome_trace(profile):
+    """
+    Converts a profile returned by finish() to the Chrome trace event format.
+    """
+    events = []
+    # The executor thread first
+    threads = {profile["thread"]: 0}
+    for name, cat, ts, dur, tid, event_args in profile["events"]:
+        tid = threads.setdefault(tid, len(threads))
+        event = {"name": name, "cat": cat, "ph": "X", "ts": ts, "dur": dur, "pid": 0, "tid": tid}
+        if event_args is not None:
+            event["args"] = event_args
+        events.append(event)
+    events.append({"name": "process_name", "ph": "M", "pid": 0, "args": {"name": "prompt {}".format(profile["prompt_id"])}})
+    for i in threads.values():
+        events.append({"name": "thread_name", "ph": "M", "pid": 0, "tid": i, "args": {"name": "executor" if i == 0 else "thread {}".format(i)}})
+    return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"prompt_id": profile["prompt_id"], "start_time": profile["start_time"]}}
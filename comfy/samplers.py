@@ -16,6 +16,7 @@ import comfy.model_patcher
 import comfy.patcher_extension
 import comfy.hooks
 import comfy.context_windows
+import comfy.profiler
 import comfy.utils
 import scipy.stats
 import numpy
@@ -200,10 +201,11 @@ def finalize_default_conds(model: 'BaseModel', hooked_to_run: dict[comfy.hooks.H
             hooked_to_run[p.hooks] += [(p, i)]
 
 def calc_cond_batch(model: BaseModel, conds: list[list[dict]], x_in: torch.Tensor, timestep, model_options: dict[str]):
-    handler: comfy.context_windows.ContextHandlerABC = model_options.get("context_handler", None)
-    if handler is None or not handler.should_use_context(model, conds, x_in, timestep, model_options):
-        return _calc_cond_batch_outer(model, conds, x_in, timestep, model_options)
-    return handler.execute(_calc_cond_batch_outer, model, conds, x_in, timestep, model_options)
+    with comfy.profiler.span("calc_cond_batch", "model", {"batch": x_in.shape[0], "conds": len(conds)}):
+        handler: comfy.context_windows.ContextHandlerABC = model_options.get("context_handler", None)
+        if handler is None or not handler.should_use_context(model, conds, x_in, timestep, model_options):
+            return _calc_cond_batch_outer(model, conds, x_in, timestep, model_options)
+        return handler.execute(_calc_cond_batch_outer, model, conds, x_in, timestep, model_options)
 
 def _calc_cond_batch_outer(model: BaseModel, conds: list[list[dict]], x_in: torch.Tensor, timestep, model_options):
     executor = comfy.patcher_extension.WrapperExecutor.new_executor(
@@ -747,8 +749,10 @@ class KSAMPLER(Sampler):
         total_steps = len(sigmas) - 1
         if callback is not None:
             k_callback = lambda x: callback(x["i"], x["denoised"], x["x"], total_steps)
+        k_callback = comfy.profiler.wrap_step_callback(k_callback, total_steps)
 
-        samples = self.sampler_function(model_k, noise, sigmas, extra_args=extra_args, callback=k_callback, disable=disable_pbar, **self.extra_options)
+        with comfy.profiler.span("sample", "sampler", {"sampler": getattr(self.sampler_function, "__name__", None), "steps": total_steps}):
+            samples = self.sampler_function(model_k, noise, sigmas, extra_args=extra_args, callback=k_callback, disable=disable_pbar, **self.extra_options)
         samples = model_wrap.inner_model.model_sampling.inverse_noise_scaling(sigmas[-1], samples)
         return samples
 
@@ -24,8 +24,11 @@ import comfy.weight_adapter
 import yaml
 import math
 import os
+import hashlib
 
 import comfy.utils
+import comfy.supported_models
+import comfy.supported_models_base
 
 from . import clip_vision
 from . import gligen
@@ -858,18 +861,36 @@ class VAE:
                 pixels = torch.nn.functional.pad(pixels, (0, self.output_channels - pixels.shape[-1]), mode=mode, value=value)
         return pixels
 
+    def run_tile_batches_(self, run, tile_batch_size):
+        """
+        Calls run(tile_batch_size), halving the tile batch size each time it runs out of memory.
+        """
+        while True:
+            try:
+                return run(tile_batch_size)
+            except model_management.OOM_EXCEPTION:
+                if tile_batch_size <= 1:
+                    raise
+                tile_batch_size //= 2
+                logging.warning("Ran out of memory with batches of tiles, retrying with {} tiles per batch.".format(tile_batch_size))
+                model_management.soft_empty_cache()
+
     def decode_tiled_(self, samples, tile_x=64, tile_y=64, overlap = 16):
         steps = samples.shape[0] * comfy.utils.get_tiled_scale_steps(samples.shape[3], samples.shape[2], tile_x, tile_y, overlap)
         steps += samples.shape[0] * comfy.utils.get_tiled_scale_steps(samples.shape[3], samples.shape[2], tile_x // 2, tile_y * 2, overlap)
         steps += samples.shape[0] * comfy.utils.get_tiled_scale_steps(samples.shape[3], samples.shape[2], tile_x * 2, tile_y // 2, overlap)
-        pbar = comfy.utils.ProgressBar(steps)
 
+        #The three tilings have tiles of the same area
+        tile_batch_size = comfy.utils.get_tile_batch_size(self.patcher.get_free_memory(self.device), self.memory_used_decode((1, samples.shape[1], tile_y, tile_x), self.vae_dtype))
         decode_fn = lambda a: self.first_stage_model.decode(a.to(self.vae_dtype).to(self.device)).float()
-        output = self.process_output(
-            (comfy.utils.tiled_scale(samples, decode_fn, tile_x // 2, tile_y * 2, overlap, upscale_amount = self.upscale_ratio, output_device=self.output_device, pbar = pbar) +
-            comfy.utils.tiled_scale(samples, decode_fn, tile_x * 2, tile_y // 2, overlap, upscale_amount = self.upscale_ratio, output_device=self.output_device, pbar = pbar) +
-             comfy.utils.tiled_scale(samples, decode_fn, tile_x, tile_y, overlap, upscale_amount = self.upscale_ratio, output_device=self.output_device, pbar = pbar))
-            / 3.0)
+
+        def run(tile_batch_size):
+            pbar = comfy.utils.ProgressBar(steps)
+            return (comfy.utils.tiled_scale(samples, decode_fn, tile_x // 2, tile_y * 2, overlap, upscale_amount = self.upscale_ratio, output_device=self.output_device, pbar = pbar, tile_batch_size=tile_batch_size, device=self.device) +
+                    comfy.utils.tiled_scale(samples, decode_fn, tile_x * 2, tile_y // 2, overlap, upscale_amount = self.upscale_ratio, output_device=self.output_device, pbar = pbar, tile_batch_size=tile_batch_size, device=self.device) +
+                    comfy.utils.tiled_scale(samples, decode_fn, tile_x, tile_y, overlap, upscale_amount = self.upscale_ratio, output_device=self.output_device, pbar = pbar, tile_batch_size=tile_batch_size, device=self.device))
+
+        output = self.process_output(self.run_tile_batches_(run, tile_batch_size) / 3.0)
         return output
 
     def decode_tiled_1d(self, samples, tile_x=256, overlap=32):
@@ -890,12 +911,18 @@ class VAE:
         steps = pixel_samples.shape[0] * comfy.utils.get_tiled_scale_steps(pixel_samples.shape[3], pixel_samples.shape[2], tile_x, tile_y, overlap)
         steps += pixel_samples.shape[0] * comfy.utils.get_tiled_scale_steps(pixel_samples.shape[3], pixel_samples.shape[2], tile_x // 2, tile_y * 2, overlap)
         steps += pixel_samples.shape[0] * comfy.utils.get_tiled_scale_steps(pixel_samples.shape[3], pixel_samples.shape[2], tile_x * 2, tile_y // 2, overlap)
-        pbar = comfy.utils.ProgressBar(steps)
 
+        tile_batch_size = comfy.utils.get_tile_batch_size(self.patcher.get_free_memory(self.device), self.memory_used_encode((1, pixel_samples.shape[1], tile_y, tile_x), self.vae_dtype))
         encode_fn = lambda a: self.first_stage_model.encode((self.process_input(a)).to(self.vae_dtype).to(self.device)).float()
-        samples = comfy.utils.tiled_scale(pixel_samples, encode_fn, tile_x, tile_y, overlap, upscale_amount = (1/self.downscale_ratio), out_channels=self.latent_channels, output_device=self.output_device, pbar=pbar)
-        samples += comfy.utils.tiled_scale(pixel_samples, encode_fn, tile_x * 2, tile_y // 2, overlap, upscale_amount = (1/self.downscale_ratio), out_channels=self.latent_channels, output_device=self.output_device, pbar=pbar)
-        samples += comfy.utils.tiled_scale(pixel_samples, encode_fn, tile_x // 2, tile_y * 2, overlap, upscale_amount = (1/self.downscale_ratio), out_channels=self.latent_channels, output_device=self.output_device, pbar=pbar)
+
+        def run(tile_batch_size):
+            pbar = comfy.utils.ProgressBar(steps)
+            samples = comfy.utils.tiled_scale(pixel_samples, encode_fn, tile_x, tile_y, overlap, upscale_amount = (1/self.downscale_ratio), out_channels=self.latent_channels, output_device=self.output_device, pbar=pbar, tile_batch_size=tile_batch_size, device=self.device)
+            samples += comfy.utils.tiled_scale(pixel_samples, encode_fn, tile_x * 2, tile_y // 2, overlap, upscale_amount = (1/self.downscale_ratio), out_channels=self.latent_channels, output_device=self.output_device, pbar=pbar, tile_batch_size=tile_batch_size, device=self.device)
+            samples += comfy.utils.tiled_scale(pixel_samples, encode_fn, tile_x // 2, tile_y * 2, overlap, upscale_amount = (1/self.downscale_ratio), out_channels=self.latent_channels, output_device=self.output_device, pbar=pbar, tile_batch_size=tile_batch_size, device=self.device)
+            return samples
+
+        samples = self.run_tile_batches_(run, tile_batch_size)
         samples /= 3.0
         return samples
 
@@ -1476,10 +1503,117 @@ def load_gligen(ckpt_path):
         model = model.half()
     return comfy.model_patcher.CoreModelPatcher(model, load_device=model_management.get_torch_device(), offload_device=model_management.unet_offload_device())
 
+_detection_version = None
+
+def detection_version():
+    """
+    Hash of the model detection code, stored with the detection results cached per file so they
+    are computed again when an update changes how models are detected.
+    """
+    global _detection_version
+    if _detection_version is None:
+        h = hashlib.sha256()
+        for file in (model_detection.__file__, comfy.supported_models.__file__, comfy.supported_models_base.__file__, __file__):
+            with open(file, "rb") as f:
+                h.update(f.read())
+        _detection_version = h.hexdigest()
+    return _detection_version
+
+def detect_model_file(path):
+    """
+    Guesses what a safetensors model file contains from its header alone, without reading the
+    weights: the diffusion model config class (for checkpoints and diffusion models) and the text
+    encoder type. The result is cached with the file's header.
+    """
+    detection = comfy.utils.safetensors_header_cache.get_detection(path, "model_type", version=detection_version())
+    if detection is not None:
+        return detection
+
+    sd, metadata = comfy.utils.load_safetensors_meta(path)
+    detection = {"unet_prefix": None, "model_config": None, "text_encoder": None}
+    for prefix in (model_detection.unet_prefix_from_state_dict(sd), ""):
+        try:
+            unet_config = model_detection.detect_unet_config(sd, prefix, metadata=metadata)
+            model_config = None if unet_config is None else model_detection.model_config_from_unet_config(unet_config, sd)
+        except Exception as e:
+            logging.debug("Model detection failed for {} with prefix '{}': {}".format(path, prefix, e))
+            continue
+        if model_config is not None:
+            detection["unet_prefix"] = prefix
+            detection["model_config"] = type(model_config).__name__
+            break
+    te_model = detect_te_model(sd)
+    if te_model is not None:
+        detection["text_encoder"] = te_model.name
+
+    comfy.utils.safetensors_header_cache.set_detection(path, "model_type", detection, version=detection_version())
+    return detection
+
+def _unet_config_to_json(value):
+    if isinstance(value, dict):
+        if not all(isinstance(k, str) for k in value):
+            raise TypeError("unet config keys must be strings")
+        return {"__dict__": {k: _unet_config_to_json(v) for k, v in value.items()}}
+    if isinstance(value, tuple):
+        return {"__tuple__": [_unet_config_to_json(v) for v in value]}
+    if isinstance(value, list):
+        return [_unet_config_to_json(v) for v in value]
+    if isinstance(value, torch.dtype):
+        return {"__dtype__": str(value).split(".")[-1]}
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    raise TypeError("can't store {} in the detection cache".format(type(value).__name__))
+
+def _unet_config_from_json(value):
+    if isinstance(value, dict):
+        if "__dict__" in value:
+            return {k: _unet_config_from_json(v) for k, v in value["__dict__"].items()}
+        if "__tuple__" in value:
+            return tuple(_unet_config_from_json(v) for v in value["__tuple__"])
+        return getattr(torch, value["__dtype__"])
+    if isinstance(value, list):
+        return [_unet_config_from_json(v) for v in value]
+    return value
+
+def model_config_from_unet_cached(path, sd, prefix, metadata=None, converted=True):
+    """
+    model_detection.model_config_from_unet for a state dict loaded from the safetensors file at path.
+    The detected unet config is stored with the file's cached header so loading the same file again
+    skips the detection. converted tells whether sd went through convert_old_quants.
+    """
+    if path is None or not path.lower().endswith((".safetensors", ".sft")):
+        return model_detection.model_config_from_unet(sd, prefix, metadata=metadata)
+
+    name = "unet_config:{}:{}".format(prefix, int(converted))
+    try:
+        unet_config = comfy.utils.safetensors_header_cache.get_detection(path, name, version=detection_version())
+    except Exception as e:
+        logging.debug("Could not read the cached detection of {}: {}".format(path, e))
+        return model_detection.model_config_from_unet(sd, prefix, metadata=metadata)
+
+    if unet_config is not None:
+        unet_config = _unet_config_from_json(unet_config)
+    else:
+        unet_config = model_detection.detect_unet_config(sd, prefix, metadata=metadata)
+        if unet_config is None:
+            return None
+        try:
+            comfy.utils.safetensors_header_cache.set_detection(path, name, _unet_config_to_json(unet_config), version=detection_version())
+        except TypeError as e:
+            logging.debug("Not caching the unet config of {}: {}".format(path, e))
+    return model_detection.model_config_from_unet(sd, prefix, metadata=metadata, unet_config=unet_config)
+
 def model_detection_error_hint(path, state_dict):
     filename = os.path.basename(path)
     if 'lora' in filename.lower():
         return "\nHINT: This seems to be a Lora file and Lora files should be put in the lora folder and loaded with a lora loader node.."
+    if filename.lower().endswith((".safetensors", ".sft")):
+        try:
+            detection = detect_model_file(path)
+        except Exception:
+            return ""
+        if detection["model_config"] is None and detection["text_encoder"] is not None:
+            return "\nHINT: This seems to be a text encoder file ({}), it should be put in the text_encoders folder and loaded with a clip loader node.".format(detection["text_encoder"])
     return ""
 
 def load_checkpoint(config_path=None, ckpt_path=None, output_vae=True, output_clip=True, embedding_directory=None, state_dict=None, config=None):
@@ -1508,12 +1642,12 @@ def load_checkpoint(config_path=None, ckpt_path=None, output_vae=True, output_cl
 
 def load_checkpoint_guess_config(ckpt_path, output_vae=True, output_clip=True, output_clipvision=False, embedding_directory=None, output_model=True, model_options={}, te_model_options={}):
     sd, metadata = comfy.utils.load_torch_file(ckpt_path, return_metadata=True)
-    out = load_state_dict_guess_config(sd, output_vae, output_clip, output_clipvision, embedding_directory, output_model, model_options, te_model_options=te_model_options, metadata=metadata)
+    out = load_state_dict_guess_config(sd, output_vae, output_clip, output_clipvision, embedding_directory, output_model, model_options, te_model_options=te_model_options, metadata=metadata, ckpt_path=ckpt_path)
     if out is None:
         raise RuntimeError("ERROR: Could not detect model type of: {}\n{}".format(ckpt_path, model_detection_error_hint(ckpt_path, sd)))
     return out
 
-def load_state_dict_guess_config(sd, output_vae=True, output_clip=True, output_clipvision=False, embedding_directory=None, output_model=True, model_options={}, te_model_options={}, metadata=None):
+def load_state_dict_guess_config(sd, output_vae=True, output_clip=True, output_clipvision=False, embedding_directory=None, output_model=True, model_options={}, te_model_options={}, metadata=None, ckpt_path=None):
     clip = None
     clipvision = None
     vae = None
@@ -1529,7 +1663,7 @@ def load_state_dict_guess_config(sd, output_vae=True, output_clip=True, output_c
     if custom_operations is None:
         sd, metadata = comfy.utils.convert_old_quants(sd, diffusion_model_prefix, metadata=metadata)
 
-    model_config = model_detection.model_config_from_unet(sd, diffusion_model_prefix, metadata=metadata)
+    model_config = model_config_from_unet_cached(ckpt_path, sd, diffusion_model_prefix, metadata=metadata, converted=custom_operations is None)
     if model_config is None:
         logging.warning("Warning, This is not a checkpoint file, trying to load it as a diffusion model only.")
         diffusion_model = load_diffusion_model_state_dict(sd, model_options={})
@@ -1613,7 +1747,7 @@ def load_state_dict_guess_config(sd, output_vae=True, output_clip=True, output_c
     return (model_patcher, clip, vae, clipvision)
 
 
-def load_diffusion_model_state_dict(sd, model_options={}, metadata=None):
+def load_diffusion_model_state_dict(sd, model_options={}, metadata=None, unet_path=None):
     """
     Loads a UNet diffusion model from a state dictionary, supporting both diffusers and regular formats.
 
@@ -1623,6 +1757,8 @@ def load_diffusion_model_state_dict(sd, model_options={}, metadata=None):
             - dtype: Override model data type
             - custom_operations: Custom model operations
             - fp8_optimizations: Enable FP8 optimizations
+        metadata (dict, optional): Metadata of the file the state dictionary was loaded from
+        unet_path (str, optional): Path of that file, used to cache the model detection
 
     Returns:
         ModelPatcher: A wrapped model instance that handles device management and weight loading.
@@ -1650,7 +1786,7 @@ def load_diffusion_model_state_dict(sd, model_options={}, metadata=None):
     weight_dtype = comfy.utils.weight_dtype(sd)
 
     load_device = model_management.get_torch_device()
-    model_config = model_detection.model_config_from_unet(sd, "", metadata=metadata)
+    model_config = model_config_from_unet_cached(unet_path, sd, "", metadata=metadata, converted=custom_operations is None)
 
     if model_config is not None:
         new_sd = sd
@@ -1708,7 +1844,7 @@ def load_diffusion_model_state_dict(sd, model_options={}, metadata=None):
 
 def load_diffusion_model(unet_path, model_options={}):
     sd, metadata = comfy.utils.load_torch_file(unet_path, return_metadata=True)
-    model = load_diffusion_model_state_dict(sd, model_options=model_options, metadata=metadata)
+    model = load_diffusion_model_state_dict(sd, model_options=model_options, metadata=metadata, unet_path=unet_path)
     if model is None:
         logging.error("ERROR UNSUPPORTED DIFFUSION MODEL {}".format(unet_path))
         raise RuntimeError("ERROR: Could not detect model type of: {}\n{}".format(unet_path, model_detection_error_hint(unet_path, sd)))
@@ -21,6 +21,7 @@ import torch
 import math
 import struct
 import comfy.checkpoint_pickle
+import comfy.model_prefetch
 import safetensors.torch
 import numpy as np
 from PIL import Image
@@ -33,6 +34,10 @@ import json
 import time
 import mmap
 import warnings
+import os
+import hashlib
+import threading
+import collections
 
 MMAP_TORCH_FILES = args.mmap_torch_files
 DISABLE_MMAP = args.disable_mmap
@@ -79,13 +84,139 @@ _TYPES = {
     "U16": torch.uint16,
 }
 
+class SafetensorsHeaderCache:
+    """
+    Parsed safetensors headers (tensor names, dtypes, shapes, offsets and __metadata__) keyed by
+    path and checked against the file size and mtime, so listing, metadata views and repeat loads
+    do not read the header from the file again. Detection results computed from a file can be stored
+    alongside its header with set_detection. Entries are also saved to directory when one is set.
+    """
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self.directory = None
+        self.lock = threading.Lock()
+        # path -> {"size", "mtime_ns", "header_size", "header", "detection"}
+        self.entries = collections.OrderedDict()
+
+    def set_directory(self, directory):
+        self.directory = directory
+
+    def _entry_path(self, path):
+        return os.path.join(self.directory, hashlib.sha256(path.encode("utf-8")).hexdigest() + ".json")
+
+    def _load_entry(self, path, stat):
+        if self.directory is None:
+            return None
+        try:
+            with open(self._entry_path(path), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("path") != path or entry.get("size") != stat.st_size or entry.get("mtime_ns") != stat.st_mtime_ns:
+            return None
+        return entry
+
+    def _save_entry(self, path, entry):
+        if self.directory is None:
+            return
+        entry_path = self._entry_path(path)
+        tmp_path = "{}.{}.tmp".format(entry_path, threading.get_ident())
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(dict(entry, path=path), f)
+            os.replace(tmp_path, entry_path)
+        except OSError as e:
+            logging.warning("Failed to save the safetensors header of {}: {}".format(path, e))
+
+    def _get_entry(self, path, f=None):
+        path = os.path.abspath(path)
+        stat = os.fstat(f.fileno()) if f is not None else os.stat(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                self.entries.move_to_end(path)
+                return path, entry
+
+        entry = self._load_entry(path, stat)
+        if entry is None:
+            if f is None:
+                with open(path, "rb") as f:
+                    header_size, header = read_safetensors_header_from(f)
+            else:
+                f.seek(0)
+                header_size, header = read_safetensors_header_from(f)
+            entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "header_size": header_size, "header": header, "detection": {}}
+            self._save_entry(path, entry)
+
+        with self.lock:
+            self.entries[path] = entry
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return path, entry
+
+    def get(self, path, f=None):
+        """
+        Returns (header size in bytes, parsed header) of the safetensors file at path. f can be the
+        file already opened, it is only read on a cache miss.
+        """
+        entry = self._get_entry(path, f)[1]
+        return entry["header_size"], entry["header"]
+
+    def get_detection(self, path, name, version=None):
+        """
+        Returns the detection result stored with set_detection for the current version of the file
+        at path, or None if there is none or it was stored with a different version.
+        """
+        detection = self._get_entry(path)[1]["detection"].get(name, None)
+        if not isinstance(detection, dict) or "value" not in detection or detection.get("version") != version:
+            return None
+        return detection["value"]
+
+    def set_detection(self, path, name, value, version=None):
+        """
+        Stores a json serializable detection result for the current version of the file at path.
+        version identifies the code that computed it, results of other versions are ignored.
+        """
+        path, entry = self._get_entry(path)
+        with self.lock:
+            # Replaced rather than updated so readers and _save_entry never see it change
+            entry["detection"] = dict(entry["detection"], **{name: {"version": version, "value": value}})
+            entry = dict(entry)
+        self._save_entry(path, entry)
+
+safetensors_header_cache = SafetensorsHeaderCache()
+
+def read_safetensors_header_from(f):
+    header_size = struct.unpack("<Q", f.read(8))[0]
+    if header_size > 100 * 1024 * 1024:
+        raise ValueError("HeaderTooLarge")
+    data = f.read(header_size)
+    if len(data) != header_size:
+        raise ValueError("MetadataIncompleteBuffer")
+    return header_size, json.loads(data.decode("utf-8"))
+
+def load_safetensors_meta(ckpt):
+    """
+    State dict of meta tensors with the names, shapes and dtypes of the safetensors file, for
+    detecting the model type without reading or mapping the weights.
+    """
+    _, header = safetensors_header_cache.get(ckpt)
+    sd = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        sd[name] = torch.empty(info["shape"], dtype=_TYPES[info["dtype"]], device="meta")
+    return sd, header.get("__metadata__", {})
+
+
 def load_safetensors(ckpt):
     f = open(ckpt, "rb")
     mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
     mv = memoryview(mapping)
 
-    header_size = struct.unpack("<Q", mapping[:8])[0]
-    header = json.loads(mapping[8:8+header_size].decode("utf-8"))
+    header_size, header = safetensors_header_cache.get(ckpt, f)
 
     mv = mv[8 + header_size:]
 
@@ -107,6 +238,7 @@ def load_safetensors(ckpt):
 
 
 def load_torch_file(ckpt, safe_load=False, device=None, return_metadata=False):
+    comfy.model_prefetch.wait_for_prefetch(ckpt)
     if device is None:
         device = torch.device("cpu")
     metadata = None
@@ -125,7 +257,7 @@ def load_torch_file(ckpt, safe_load=False, device=None, return_metadata=False):
                             tensor = tensor.to(device=device, copy=True)
                         sd[k] = tensor
                     if return_metadata:
-                        metadata = f.metadata()
+                        metadata = safetensors_header_cache.get(ckpt)[1].get("__metadata__", None)
         except Exception as e:
             if len(e.args) > 0:
                 message = e.args[0]
@@ -862,12 +994,13 @@ def convert_sd_to(state_dict, dtype):
     return state_dict
 
 def safetensors_header(safetensors_path, max_size=100*1024*1024):
-    with open(safetensors_path, "rb") as f:
-        header = f.read(8)
-        length_of_header = struct.unpack('<Q', header)[0]
-        if length_of_header > max_size:
-            return None
-        return f.read(length_of_header)
+    try:
+        header_size, header = safetensors_header_cache.get(safetensors_path)
+    except ValueError:
+        return None
+    if header_size > max_size:
+        return None
+    return json.dumps(header).encode("utf-8")
 
 ATTR_UNSET={}
 
@@ -1041,9 +1174,50 @@ def get_tiled_scale_steps(width, height, tile_x, tile_y, overlap):
     cols = 1 if width <= tile_x else math.ceil((width - overlap) / (tile_x - overlap))
     return rows * cols
 
+# Most tiles passed to function in one call by the callers that size the batches to the free memory
+MAX_TILE_BATCH = 16
+
+def get_tile_batch_size(free_memory, memory_per_tile, max_batch=MAX_TILE_BATCH):
+    return max(1, min(max_batch, int(free_memory / max(memory_per_tile, 1))))
+
+def _load_tiles(tiles, device):
+    """
+    Starts copying a batch of tiles to device, on an offload stream when there is one so the copy overlaps
+    with running the previous batch. Returns the tiles and the stream to wait for before using them.
+    """
+    if device is None or tiles.device == torch.device(device):
+        return tiles, None
+    import comfy.model_management
+    if not comfy.model_management.device_supports_non_blocking(device):
+        return tiles.to(device), None
+    stream = comfy.model_management.get_offload_stream(device)
+    if stream is None:
+        return tiles.to(device, non_blocking=True), None
+    if tiles.device.type == "cpu":
+        tiles = tiles.pin_memory()
+    with stream.as_context(stream):
+        tiles = tiles.to(device, non_blocking=True)
+    return tiles, stream
+
+def _wait_tiles(tiles, stream, device):
+    if stream is not None:
+        import comfy.model_management
+        comfy.model_management.sync_stream(device, stream)
+        # the memory was allocated on the offload stream but is used on the current one
+        tiles.record_stream(comfy.model_management.current_stream(device))
+    return tiles
+
 @torch.inference_mode()
-def tiled_scale_multidim(samples, function, tile=(64, 64), overlap=8, upscale_amount=4, out_channels=3, output_device="cpu", downscale=False, index_formulas=None, pbar=None):
+def tiled_scale_multidim(samples, function, tile=(64, 64), overlap=8, upscale_amount=4, out_channels=3, output_device="cpu", downscale=False, index_formulas=None, pbar=None, tile_batch_size=1, device=None):
+    """
+    Runs function on overlapping tiles of samples and blends the results with feathered masks.
+
+    Tiles of the same shape, from any element of the batch, are concatenated and passed to function
+    tile_batch_size at a time, function must return one result per tile. If device is set, the next batch
+    of tiles is copied to it while function runs on the current one.
+    """
     dims = len(tile)
+    tile_batch_size = max(1, tile_batch_size)
 
     if not (isinstance(upscale_amount, (tuple, list))):
         upscale_amount = [upscale_amount] * dims
@@ -1098,62 +1272,107 @@ def tiled_scale_multidim(samples, function, tile=(64, 64), overlap=8, upscale_am
             out.append(round(get_scale(i, a[i])))
         return out
 
-    output = torch.empty([samples.shape[0], out_channels] + mult_list_upscale(samples.shape[2:]), device=output_device)
-
-    for b in range(samples.shape[0]):
-        s = samples[b:b+1]
-
-        # handle entire input fitting in a single tile
-        if all(s.shape[d+2] <= tile[d] for d in range(dims)):
-            output[b:b+1] = function(s).to(output_device)
+    def run_batches(batches, get_tiles, get_count):
+        """
+        Yields (batch, result of function) for each batch, loading the tiles of the next batch before
+        running function on the current one. get_count returns the number of tiles in a batch.
+        """
+        next_tiles = _load_tiles(get_tiles(batches[0]), device) if len(batches) > 0 else None
+        for i, batch in enumerate(batches):
+            tiles, stream = next_tiles
+            if i + 1 < len(batches):
+                next_tiles = _load_tiles(get_tiles(batches[i + 1]), device)
+            yield batch, function(_wait_tiles(tiles, stream, device)).to(output_device)
             if pbar is not None:
-                pbar.update(1)
-            continue
-
-        out = torch.zeros([s.shape[0], out_channels] + mult_list_upscale(s.shape[2:]), device=output_device)
-        out_div = torch.zeros([s.shape[0], out_channels] + mult_list_upscale(s.shape[2:]), device=output_device)
-
-        positions = [range(0, s.shape[d+2] - overlap[d], tile[d] - overlap[d]) if s.shape[d+2] > tile[d] else [0] for d in range(dims)]
-
-        for it in itertools.product(*positions):
-            s_in = s
-            upscaled = []
-
+                pbar.update(get_count(batch))
+
+    output_shape = [samples.shape[0], out_channels] + mult_list_upscale(samples.shape[2:])
+
+    # handle entire input fitting in a single tile
+    if all(samples.shape[d+2] <= tile[d] for d in range(dims)):
+        output = torch.empty(output_shape, device=output_device)
+        batches = [range(b, min(b + tile_batch_size, samples.shape[0])) for b in range(0, samples.shape[0], tile_batch_size)]
+        for batch, ps in run_batches(batches, lambda batch: samples[batch.start:batch.stop], len):
+            output[batch.start:batch.stop] = ps
+        return output
+
+    positions = [range(0, samples.shape[d+2] - overlap[d], tile[d] - overlap[d]) if samples.shape[d+2] > tile[d] else [0] for d in range(dims)]
+
+    # tile shape -> [(input position, output position)], the tiles are at the same place in every element
+    tiles_by_shape = {}
+    for it in itertools.product(*positions):
+        pos_in = []
+        pos_out = []
+        shape = []
+        for d in range(dims):
+            pos = max(0, min(samples.shape[d + 2] - overlap[d], it[d]))
+            pos_in.append(pos)
+            shape.append(min(tile[d], samples.shape[d + 2] - pos))
+            pos_out.append(round(get_pos(d, pos)))
+        tiles_by_shape.setdefault(tuple(shape), []).append((pos_in, pos_out))
+
+    batches = []
+    for shape, tiles in tiles_by_shape.items():
+        jobs = [(b, pos_in, pos_out) for b in range(samples.shape[0]) for pos_in, pos_out in tiles]
+        for i in range(0, len(jobs), tile_batch_size):
+            batches.append((shape, jobs[i:i + tile_batch_size]))
+
+    def get_tiles(batch):
+        shape, jobs = batch
+        tiles = []
+        for b, pos_in, _ in jobs:
+            s_in = samples[b:b+1]
             for d in range(dims):
-                pos = max(0, min(s.shape[d + 2] - overlap[d], it[d]))
-                l = min(tile[d], s.shape[d + 2] - pos)
-                s_in = s_in.narrow(d + 2, pos, l)
-                upscaled.append(round(get_pos(d, pos)))
+                s_in = s_in.narrow(d + 2, pos_in[d], shape[d])
+            tiles.append(s_in)
+        return torch.cat(tiles) if len(tiles) > 1 else tiles[0]
 
-            ps = function(s_in).to(output_device)
-            mask = torch.ones_like(ps)
+    # output shape of a tile -> feather mask, the same for every channel
+    masks = {}
 
-            for d in range(2, dims + 2):
-                feather = round(get_scale(d - 2, overlap[d - 2]))
-                if feather >= mask.shape[d]:
-                    continue
-                for t in range(feather):
-                    a = (t + 1) / feather
-                    mask.narrow(d, t, 1).mul_(a)
-                    mask.narrow(d, mask.shape[d] - 1 - t, 1).mul_(a)
-
-            o = out
-            o_d = out_div
+    def get_mask(shape):
+        mask = masks.get(shape)
+        if mask is not None:
+            return mask
+        mask = torch.ones([1, 1] + list(shape), device=output_device)
+        for d in range(dims):
+            feather = round(get_scale(d, overlap[d]))
+            length = shape[d]
+            if feather >= length:
+                continue
+            ramp = torch.ones(length, dtype=torch.float64)
+            a = torch.arange(1, feather + 1, dtype=torch.float64) / feather
+            ramp[:feather] *= a
+            ramp[length - feather:] *= a.flip(0)
+            view = [1] * (dims + 2)
+            view[d + 2] = length
+            mask.mul_(ramp.to(device=output_device, dtype=mask.dtype).view(view))
+        masks[shape] = mask
+        return mask
+
+    # The results are blended in place in output, the weights are the same for every element and channel
+    output = torch.zeros(output_shape, device=output_device)
+    out_div = torch.zeros([1, 1] + output_shape[2:], device=output_device)
+
+    for (shape, jobs), ps in run_batches(batches, get_tiles, lambda batch: len(batch[1])):
+        mask = get_mask(tuple(ps.shape[2:]))
+        for (b, _, pos_out), p in zip(jobs, ps):
+            o = output[b]
             for d in range(dims):
-                o = o.narrow(d + 2, upscaled[d], mask.shape[d + 2])
-                o_d = o_d.narrow(d + 2, upscaled[d], mask.shape[d + 2])
+                o = o.narrow(d + 1, pos_out[d], mask.shape[d + 2])
+            o.addcmul_(p, mask[0])
 
-            o.add_(ps * mask)
-            o_d.add_(mask)
-
-            if pbar is not None:
-                pbar.update(1)
+            if b == 0:
+                o_d = out_div
+                for d in range(dims):
+                    o_d = o_d.narrow(d + 2, pos_out[d], mask.shape[d + 2])
+                o_d.add_(mask)
 
-        output[b:b+1] = out/out_div
+    output.div_(out_div)
     return output
 
-def tiled_scale(samples, function, tile_x=64, tile_y=64, overlap = 8, upscale_amount = 4, out_channels = 3, output_device="cpu", pbar = None):
-    return tiled_scale_multidim(samples, function, (tile_y, tile_x), overlap=overlap, upscale_amount=upscale_amount, out_channels=out_channels, output_device=output_device, pbar=pbar)
+def tiled_scale(samples, function, tile_x=64, tile_y=64, overlap = 8, upscale_amount = 4, out_channels = 3, output_device="cpu", pbar = None, tile_batch_size=1, device=None):
+    return tiled_scale_multidim(samples, function, (tile_y, tile_x), overlap=overlap, upscale_amount=upscale_amount, out_channels=out_channels, output_device=output_device, pbar=pbar, tile_batch_size=tile_batch_size, device=device)
 
 PROGRESS_BAR_ENABLED = True
 def set_progress_bar_enabled(enabled):
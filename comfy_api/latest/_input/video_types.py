@@ -1,9 +1,10 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
 from fractions import Fraction
-from typing import Optional, Union, IO
+from typing import Iterator, Optional, Union, IO
 import io
 import av
+import torch
 from .._util import VideoContainer, VideoCodec, VideoComponents
 
 class VideoInput(ABC):
@@ -50,6 +51,30 @@ class VideoInput(ABC):
         buffer.seek(0)
         return buffer
 
+    def iter_frames(
+        self,
+        chunk_size: int = 16,
+        start_frame: int = 0,
+        end_frame: Optional[int] = None,
+        stride: int = 1,
+        dtype: Optional[torch.dtype] = None,
+        threaded: bool = False,
+    ) -> Iterator[torch.Tensor]:
+        """
+        Yields the frames start_frame, start_frame + stride, ... before end_frame as
+        (chunk_size, H, W, 3) image tensors.
+
+        Default implementation slices the images of :meth:`get_components`. File-based
+        implementations should override this and decode one chunk at a time.
+        """
+        images = self.get_components().images[start_frame:end_frame:stride]
+        if dtype == torch.uint8:
+            images = (images * 255).round().clamp(0, 255).to(dtype)
+        elif dtype is not None:
+            images = images.to(dtype)
+        for i in range(0, images.shape[0], chunk_size):
+            yield images[i:i + chunk_size]
+
     # Provide a default implementation, but subclasses can provide optimized versions
     # if possible.
     def get_dimensions(self) -> tuple[int, int]:
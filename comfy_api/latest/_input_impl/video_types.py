@@ -2,16 +2,23 @@ from __future__ import annotations
 from av.container import InputContainer
 from av.subtitles.stream import SubtitleStream
 from fractions import Fraction
-from typing import Optional
+from typing import Iterator, Optional
 from .._input import AudioInput, VideoInput
 import av
 import io
 import json
 import numpy as np
 import math
+import queue
+import threading
 import torch
+import comfy.utils
 from .._util import VideoContainer, VideoCodec, VideoComponents
 
+# Frames converted to uint8 at a time, and converted batches waiting for the encoder thread
+ENCODE_BATCH_SIZE = 16
+ENCODE_QUEUE_SIZE = 4
+
 
 def container_to_output_format(container_format: str | None) -> str | None:
     """
@@ -52,6 +59,85 @@ def get_open_write_kwargs(
     return open_kwargs
 
 
+def encode_video_frames(
+    output: av.container.OutputContainer,
+    video_stream: av.VideoStream,
+    images: torch.Tensor,
+    pix_fmt: Optional[str] = None,
+    batch_size: int = ENCODE_BATCH_SIZE,
+):
+    """
+    Encodes images (N, H, W, C) with values in 0-1 to video_stream and muxes the packets into
+    output, including the final flush of the encoder.
+
+    The frames are converted to uint8 on the calling thread batch_size at a time and passed through
+    a bounded queue to an encoder thread, so converting the next batch overlaps with encoding the
+    previous one and only a few batches of uint8 frames exist at once. The encoder uses codec
+    threading where the codec supports it. Progress is reported as frames are encoded.
+
+    Returns once every frame is encoded and muxed, saving does not overlap with the nodes that run
+    after the caller.
+    """
+    video_stream.thread_type = "AUTO"
+    batches = queue.Queue(maxsize=ENCODE_QUEUE_SIZE)
+    stop = threading.Event()
+    encoded = 0
+    error = None
+
+    def encode():
+        nonlocal encoded, error
+        try:
+            while True:
+                try:
+                    batch = batches.get(timeout=0.1)
+                except queue.Empty:
+                    if stop.is_set():
+                        return
+                    continue
+                if batch is None:
+                    break
+                for img in batch:
+                    frame = av.VideoFrame.from_ndarray(img, format='rgb24')
+                    if pix_fmt is not None:
+                        frame = frame.reformat(format=pix_fmt)
+                    output.mux(video_stream.encode(frame))
+                    encoded += 1
+            output.mux(video_stream.encode(None))
+        except Exception as e:
+            error = e
+            stop.set()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    pbar = comfy.utils.ProgressBar(images.shape[0])
+    thread = threading.Thread(target=encode, daemon=True, name="video-encode")
+    thread.start()
+    try:
+        for start in range(0, images.shape[0], batch_size):
+            batch = images[start:start + batch_size, ..., :3]
+            batch = torch.clamp(batch * 255, min=0, max=255).to(device=torch.device("cpu"), dtype=torch.uint8).numpy()
+            if not put(batch):
+                break
+            pbar.update_absolute(encoded)
+        put(None)
+        while thread.is_alive():
+            thread.join(timeout=0.5)
+            pbar.update_absolute(encoded)
+    finally:
+        stop.set()
+        thread.join()
+    if error is not None:
+        raise error
+    pbar.update_absolute(images.shape[0])
+
+
 class VideoFromFile(VideoInput):
     """
     Class representing video input from a file.
@@ -131,26 +217,10 @@ class VideoFromFile(VideoInput):
 
         with av.open(self.__file, mode="r") as container:
             video_stream = self._get_first_video_stream(container)
-            # 1. Prefer the frames field if available
-            if video_stream.frames and video_stream.frames > 0:
-                return int(video_stream.frames)
-
-            # 2. Try to estimate from duration and average_rate using only metadata
-            if container.duration is not None and video_stream.average_rate:
-                duration_seconds = float(container.duration / av.time_base)
-                estimated_frames = int(round(duration_seconds * float(video_stream.average_rate)))
-                if estimated_frames > 0:
-                    return estimated_frames
-
-            if (
-                getattr(video_stream, "duration", None) is not None
-                and getattr(video_stream, "time_base", None) is not None
-                and video_stream.average_rate
-            ):
-                duration_seconds = float(video_stream.duration * video_stream.time_base)
-                estimated_frames = int(round(duration_seconds * float(video_stream.average_rate)))
-                if estimated_frames > 0:
-                    return estimated_frames
+            # 1. and 2. Frames field or estimate from duration and average_rate
+            frame_count = self._get_frame_count_from_metadata(container, video_stream)
+            if frame_count > 0:
+                return frame_count
 
             # 3. Last resort: decode frames and count them (streaming)
             frame_count = 0
@@ -198,21 +268,110 @@ class VideoFromFile(VideoInput):
         with av.open(self.__file, mode='r') as container:
             return container.format.name
 
-    def get_components_internal(self, container: InputContainer) -> VideoComponents:
-        # Get video frames
-        frames = []
-        for frame in container.decode(video=0):
-            img = frame.to_ndarray(format='rgb24')  # shape: (H, W, 3)
-            img = torch.from_numpy(img) / 255.0  # shape: (H, W, 3)
-            frames.append(img)
-
-        images = torch.stack(frames) if len(frames) > 0 else torch.zeros(0, 3, 0, 0)
-
-        # Get frame rate
-        video_stream = next(s for s in container.streams if s.type == 'video')
-        frame_rate = Fraction(video_stream.average_rate) if video_stream and video_stream.average_rate else Fraction(1)
-
-        # Get audio if available
+    @staticmethod
+    def _get_frame_count_from_metadata(container: InputContainer, video_stream) -> int:
+        """
+        Number of frames from the stream or container metadata, 0 if it is not known.
+        """
+        if video_stream.frames and video_stream.frames > 0:
+            return int(video_stream.frames)
+
+        if container.duration is not None and video_stream.average_rate:
+            duration_seconds = float(container.duration / av.time_base)
+            estimated_frames = int(round(duration_seconds * float(video_stream.average_rate)))
+            if estimated_frames > 0:
+                return estimated_frames
+
+        if (
+            getattr(video_stream, "duration", None) is not None
+            and getattr(video_stream, "time_base", None) is not None
+            and video_stream.average_rate
+        ):
+            duration_seconds = float(video_stream.duration * video_stream.time_base)
+            estimated_frames = int(round(duration_seconds * float(video_stream.average_rate)))
+            if estimated_frames > 0:
+                return estimated_frames
+        return 0
+
+    @staticmethod
+    def _check_frame_range(start_frame: int, end_frame: Optional[int], stride: int):
+        if start_frame < 0 or (end_frame is not None and end_frame < start_frame) or stride < 1:
+            raise ValueError(f"Invalid frame range: start_frame={start_frame}, end_frame={end_frame}, stride={stride}")
+
+    def _decode_frames(self, container: InputContainer, start_frame: int = 0, end_frame: Optional[int] = None, stride: int = 1) -> Iterator[av.VideoFrame]:
+        """
+        Yields the frames start_frame, start_frame + stride, ... before end_frame of the first
+        video stream. Frames before start_frame are skipped by seeking when the stream has
+        timestamps, their index is then computed from the timestamp and the average frame rate.
+        """
+        video_stream = self._get_first_video_stream(container)
+        video_stream.thread_type = "AUTO"
+
+        time_base = video_stream.time_base
+        frame_rate = video_stream.average_rate
+        start_pts = video_stream.start_time or 0
+        seek = start_frame > 0 and time_base and frame_rate
+        if seek:
+            container.seek(start_pts + int(start_frame / (frame_rate * time_base)), stream=video_stream, backward=True)
+
+        index = -1
+        for frame in container.decode(video_stream):
+            if seek and index < 0 and frame.pts is None:
+                # No timestamps to tell where seeking ended up, decode from the start instead
+                container.seek(0)
+                yield from self._decode_frames_from_start(container, video_stream, start_frame, end_frame, stride)
+                return
+            if seek and frame.pts is not None:
+                index = round((frame.pts - start_pts) * time_base * frame_rate)
+            else:
+                index += 1
+            if end_frame is not None and index >= end_frame:
+                break
+            if index >= start_frame and (index - start_frame) % stride == 0:
+                yield frame
+
+    def _decode_frames_from_start(self, container: InputContainer, video_stream, start_frame: int, end_frame: Optional[int], stride: int) -> Iterator[av.VideoFrame]:
+        for index, frame in enumerate(container.decode(video_stream)):
+            if end_frame is not None and index >= end_frame:
+                break
+            if index >= start_frame and (index - start_frame) % stride == 0:
+                yield frame
+
+    @staticmethod
+    def _copy_frame(frame: av.VideoFrame, out: torch.Tensor):
+        out.copy_(torch.from_numpy(frame.to_ndarray(format='rgb24')))  # shape: (H, W, 3)
+        if out.is_floating_point():
+            out.div_(255.0)
+
+    def _get_images(self, container: InputContainer, start_frame: int, end_frame: Optional[int], stride: int, dtype: torch.dtype) -> torch.Tensor:
+        """
+        Decodes the selected frames straight into one preallocated (N, H, W, 3) tensor instead of
+        stacking a list of per frame tensors.
+        """
+        video_stream = self._get_first_video_stream(container)
+        total = self._get_frame_count_from_metadata(container, video_stream)
+        if end_frame is not None and (total == 0 or end_frame < total):
+            total = end_frame
+        capacity = len(range(start_frame, total, stride))
+        images = None
+        count = 0
+        for frame in self._decode_frames(container, start_frame, end_frame, stride):
+            if images is None:
+                images = torch.empty((max(capacity, 1), frame.height, frame.width, 3), dtype=dtype)
+            elif count == images.shape[0]:
+                # The metadata underestimated the number of frames
+                images = torch.cat((images, torch.empty_like(images[:max(count // 4, 16)])))
+            self._copy_frame(frame, images[count])
+            count += 1
+
+        if images is None:
+            return torch.zeros(0, 3, 0, 0, dtype=dtype)
+        if count < images.shape[0]:
+            # Only copy when the metadata overestimated by a lot, a few unused frames are cheaper
+            images = images[:count].clone() if count < images.shape[0] * 3 // 4 else images[:count]
+        return images
+
+    def _get_audio(self, container: InputContainer, start_time: float = 0.0, end_time: Optional[float] = None) -> Optional[AudioInput]:
         audio = None
         try:
             container.seek(0)  # Reset the container to the beginning
@@ -227,24 +386,141 @@ class VideoFromFile(VideoInput):
                         audio_frames.append(frame.to_ndarray())  # shape: (channels, samples)
                 if len(audio_frames) > 0:
                     audio_data = np.concatenate(audio_frames, axis=1)  # shape: (channels, total_samples)
+                    sample_rate = int(stream.sample_rate) if stream.sample_rate else 1
+                    if start_time > 0 or end_time is not None:
+                        start_sample = round(start_time * sample_rate)
+                        end_sample = None if end_time is None else round(end_time * sample_rate)
+                        audio_data = np.ascontiguousarray(audio_data[:, start_sample:end_sample])
                     audio_tensor = torch.from_numpy(audio_data).unsqueeze(0)  # shape: (1, channels, total_samples)
                     audio = AudioInput({
                         "waveform": audio_tensor,
-                        "sample_rate": int(stream.sample_rate) if stream.sample_rate else 1,
+                        "sample_rate": sample_rate,
                     })
         except StopIteration:
             pass  # No audio stream
+        return audio
+
+    def get_components_internal(
+        self,
+        container: InputContainer,
+        start_frame: int = 0,
+        end_frame: Optional[int] = None,
+        stride: int = 1,
+        dtype: torch.dtype = torch.float32,
+    ) -> VideoComponents:
+        self._check_frame_range(start_frame, end_frame, stride)
+
+        # Get video frames
+        images = self._get_images(container, start_frame, end_frame, stride, dtype)
+
+        # Get frame rate
+        video_stream = next(s for s in container.streams if s.type == 'video')
+        frame_rate = Fraction(video_stream.average_rate) if video_stream and video_stream.average_rate else Fraction(1)
+
+        # Get audio if available, the part playing during the selected frames
+        start_time = float(start_frame / frame_rate)
+        end_time = None if end_frame is None else float(end_frame / frame_rate)
+        audio = self._get_audio(container, start_time, end_time)
 
         metadata = container.metadata
-        return VideoComponents(images=images, audio=audio, frame_rate=frame_rate, metadata=metadata)
+        return VideoComponents(images=images, audio=audio, frame_rate=frame_rate / stride, metadata=metadata)
 
-    def get_components(self) -> VideoComponents:
+    def get_components(
+        self,
+        start_frame: int = 0,
+        end_frame: Optional[int] = None,
+        stride: int = 1,
+        dtype: torch.dtype = torch.float32,
+    ) -> VideoComponents:
+        """
+        Decodes the video, or only the frames start_frame, start_frame + stride, ... before
+        end_frame. dtype can be torch.uint8 (0-255) to keep the frames at a quarter of the memory,
+        or a floating point type (0-1).
+        """
         if isinstance(self.__file, io.BytesIO):
             self.__file.seek(0)  # Reset the BytesIO object to the beginning
         with av.open(self.__file, mode='r') as container:
-            return self.get_components_internal(container)
+            return self.get_components_internal(container, start_frame, end_frame, stride, dtype)
         raise ValueError(f"No video stream found in file '{self.__file}'")
 
+    def _iter_frame_chunks(self, chunk_size: int, start_frame: int, end_frame: Optional[int], stride: int, dtype: torch.dtype, stop: Optional[threading.Event] = None) -> Iterator[torch.Tensor]:
+        if isinstance(self.__file, io.BytesIO):
+            self.__file.seek(0)
+        with av.open(self.__file, mode='r') as container:
+            chunk = None
+            count = 0
+            for frame in self._decode_frames(container, start_frame, end_frame, stride):
+                if stop is not None and stop.is_set():
+                    return
+                if chunk is None:
+                    chunk = torch.empty((chunk_size, frame.height, frame.width, 3), dtype=dtype)
+                self._copy_frame(frame, chunk[count])
+                count += 1
+                if count == chunk_size:
+                    yield chunk
+                    chunk = None
+                    count = 0
+            if count > 0:
+                yield chunk[:count]
+
+    def iter_frames(
+        self,
+        chunk_size: int = 16,
+        start_frame: int = 0,
+        end_frame: Optional[int] = None,
+        stride: int = 1,
+        dtype: torch.dtype = torch.float32,
+        threaded: bool = False,
+    ) -> Iterator[torch.Tensor]:
+        """
+        Decodes the selected frames (see get_components) chunk_size at a time, yielding
+        (chunk_size, H, W, 3) tensors, so long videos can be processed without holding every frame
+        in memory. With threaded=True the next chunks are decoded in a worker thread while the
+        caller processes the current one.
+        """
+        self._check_frame_range(start_frame, end_frame, stride)
+        if chunk_size < 1:
+            raise ValueError(f"Invalid chunk_size: {chunk_size}")
+        if not threaded:
+            yield from self._iter_frame_chunks(chunk_size, start_frame, end_frame, stride, dtype)
+            return
+
+        chunks = queue.Queue(maxsize=2)
+        stop = threading.Event()
+
+        def put(item):
+            # Gives up when the caller stopped reading
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def decode():
+            try:
+                for chunk in self._iter_frame_chunks(chunk_size, start_frame, end_frame, stride, dtype, stop):
+                    if not put((chunk, None)):
+                        return
+                put((None, None))
+            except Exception as e:
+                put((None, e))
+
+        thread = threading.Thread(target=decode, daemon=True, name="video-decode")
+        thread.start()
+        try:
+            while True:
+                chunk, error = chunks.get()
+                if error is not None:
+                    raise error
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            stop.set()
+            thread.join()
+
     def save_to(
         self,
         path: str | io.BytesIO,
@@ -359,17 +635,8 @@ class VideoFromComponents(VideoInput):
                 audio_sample_rate = int(self.__components.audio['sample_rate'])
                 audio_stream = output.add_stream('aac', rate=audio_sample_rate)
 
-            # Encode video
-            for i, frame in enumerate(self.__components.images):
-                img = (frame * 255).clamp(0, 255).byte().cpu().numpy() # shape: (H, W, 3)
-                frame = av.VideoFrame.from_ndarray(img, format='rgb24')
-                frame = frame.reformat(format='yuv420p')  # Convert to YUV420P as required by h264
-                packet = video_stream.encode(frame)
-                output.mux(packet)
-
-            # Flush video
-            packet = video_stream.encode(None)
-            output.mux(packet)
+            # Encode and flush video, converted to YUV420P as required by h264
+            encode_video_frames(output, video_stream, self.__components.images, pix_fmt='yuv420p')
 
             if audio_stream and self.__components.audio:
                 waveform = self.__components.audio['waveform']
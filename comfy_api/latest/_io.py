@@ -1430,6 +1430,8 @@ class Schema:
     """Flags a node as expandable, allowing NodeOutput to include 'expand' property."""
     accept_all_inputs: bool=False
     """When True, all inputs from the prompt will be passed to the node as kwargs, even if not defined in the schema."""
+    device_affinity: str | None = None
+    """Hints where the node does its work; "cpu" nodes are thread safe and may run in a worker thread when ``--parallel-cpu-nodes`` is enabled."""
 
     def validate(self):
         '''Validate the schema:
@@ -1875,6 +1877,15 @@ class _ComfyNodeBaseInternal(_ComfyNodeInternal):
             cls.GET_SCHEMA()
         return cls._ACCEPT_ALL_INPUTS
 
+    _DEVICE_AFFINITY = None
+    @final
+    @classproperty
+    def DEVICE_AFFINITY(cls):  # noqa
+        # None is a valid affinity so check a field GET_SCHEMA always fills in
+        if cls._ACCEPT_ALL_INPUTS is None:
+            cls.GET_SCHEMA()
+        return cls._DEVICE_AFFINITY
+
     @final
     @classmethod
     def INPUT_TYPES(cls) -> dict[str, dict]:
@@ -1917,6 +1928,8 @@ class _ComfyNodeBaseInternal(_ComfyNodeInternal):
             cls._NOT_IDEMPOTENT = schema.not_idempotent
         if cls._ACCEPT_ALL_INPUTS is None:
             cls._ACCEPT_ALL_INPUTS = schema.accept_all_inputs
+        if cls._DEVICE_AFFINITY is None:
+            cls._DEVICE_AFFINITY = schema.device_affinity
 
         if cls._RETURN_TYPES is None:
             output = []
@@ -140,7 +140,7 @@ class ImageSaveHelper:
     ) -> list[SavedResult]:
         """Saves a batch of images as individual PNG files."""
         full_output_folder, filename, counter, subfolder, _ = folder_paths.get_save_image_path(
-            filename_prefix, _get_directory_by_folder_type(folder_type), images[0].shape[1], images[0].shape[0]
+            filename_prefix, _get_directory_by_folder_type(folder_type), images[0].shape[1], images[0].shape[0], count=len(images), extension="png"
         )
         results = []
         metadata = ImageSaveHelper._create_png_metadata(cls)
@@ -172,7 +172,7 @@ class ImageSaveHelper:
     ) -> SavedResult:
         """Saves a batch of images as a single animated PNG."""
         full_output_folder, filename, counter, subfolder, _ = folder_paths.get_save_image_path(
-            filename_prefix, _get_directory_by_folder_type(folder_type), images[0].shape[1], images[0].shape[0]
+            filename_prefix, _get_directory_by_folder_type(folder_type), images[0].shape[1], images[0].shape[0], count=1, extension="png"
         )
         pil_images = [ImageSaveHelper._convert_tensor_to_pil(img) for img in images]
         metadata = ImageSaveHelper._create_animated_png_metadata(cls)
@@ -216,7 +216,7 @@ class ImageSaveHelper:
     ) -> SavedResult:
         """Saves a batch of images as a single animated WebP."""
         full_output_folder, filename, counter, subfolder, _ = folder_paths.get_save_image_path(
-            filename_prefix, _get_directory_by_folder_type(folder_type), images[0].shape[1], images[0].shape[0]
+            filename_prefix, _get_directory_by_folder_type(folder_type), images[0].shape[1], images[0].shape[0], count=1, extension="webp"
         )
         pil_images = [ImageSaveHelper._convert_tensor_to_pil(img) for img in images]
         pil_exif = ImageSaveHelper._create_webp_metadata(pil_images[0], cls)
@@ -271,7 +271,7 @@ class AudioSaveHelper:
         quality: str = "128k",
     ) -> list[SavedResult]:
         full_output_folder, filename, counter, subfolder, _ = folder_paths.get_save_image_path(
-            filename_prefix, _get_directory_by_folder_type(folder_type)
+            filename_prefix, _get_directory_by_folder_type(folder_type), count=audio["waveform"].shape[0], extension=format
         )
 
         metadata = {}
@@ -1,14 +1,27 @@
 import bisect
+import collections
 import gc
+import hashlib
 import itertools
+import json
+import logging
+import mmap
+import os
 import psutil
+import queue
+import struct
+import sys
+import threading
 import time
 import torch
-from typing import Sequence, Mapping, Dict
+import safetensors.torch
+from typing import Sequence, Mapping, Dict, NamedTuple
 from comfy_execution.graph import DynamicPrompt
 from abc import ABC, abstractmethod
 
 import nodes
+import comfy.utils
+import comfyui_version
 
 from comfy_execution.graph_utils import is_link
 
@@ -22,6 +35,10 @@ def include_unique_id_in_input(class_type: str) -> bool:
     NODE_CLASS_CONTAINS_UNIQUE_ID[class_type] = "UNIQUE_ID" in class_def.INPUT_TYPES().get("hidden", {}).values()
     return NODE_CLASS_CONTAINS_UNIQUE_ID[class_type]
 
+class CacheEntry(NamedTuple):
+    ui: dict
+    outputs: list
+
 class CacheKeySet(ABC):
     def __init__(self, dynprompt, node_ids, is_changed_cache):
         self.keys = {}
@@ -97,18 +114,46 @@ class CacheKeySetInputSignature(CacheKeySet):
             self.keys[node_id] = await self.get_node_signature(self.dynprompt, node_id)
             self.subcache_keys[node_id] = (node_id, node["class_type"])
 
+    def get_signature_memo(self):
+        # Signatures only depend on the node and its ancestors, so the key sets of the subcaches
+        # share them through the prompt instead of computing the ancestry again
+        return self.dynprompt.signatures.setdefault((type(self), self.is_changed_cache), {})
+
     async def get_node_signature(self, dynprompt, node_id):
-        signature = []
-        ancestors, order_mapping = self.get_ordered_ancestry(dynprompt, node_id)
-        signature.append(await self.get_immediate_node_signature(dynprompt, node_id, order_mapping))
-        for ancestor_id in ancestors:
-            signature.append(await self.get_immediate_node_signature(dynprompt, ancestor_id, order_mapping))
-        return to_hashable(signature)
-
-    async def get_immediate_node_signature(self, dynprompt, node_id, ancestor_order_mapping):
+        """
+        Returns the digest of the node's immediate signature and the digests of its inputs, so equal
+        digests mean equal ancestry. Returns an Unhashable if the node can't be cached.
+        """
+        signatures = self.get_signature_memo()
+        if node_id in signatures:
+            return signatures[node_id]
+
+        # Parents before children, without recursing on deep graphs
+        order = []
+        visited = set()
+        stack = [(node_id, False)]
+        while len(stack) > 0:
+            current, expanded = stack.pop()
+            if expanded:
+                order.append(current)
+                continue
+            if current in signatures or current in visited:
+                continue
+            visited.add(current)
+            stack.append((current, True))
+            if dynprompt.has_node(current):
+                for value in dynprompt.get_node(current)["inputs"].values():
+                    if is_link(value):
+                        stack.append((value[0], False))
+
+        for current in order:
+            signatures[current] = await self.get_immediate_node_signature(dynprompt, current, signatures)
+        return signatures[node_id]
+
+    async def get_immediate_node_signature(self, dynprompt, node_id, ancestor_signatures):
         if not dynprompt.has_node(node_id):
             # This node doesn't exist -- we can't cache it.
-            return [float("NaN")]
+            return Unhashable()
         node = dynprompt.get_node(node_id)
         class_type = node["class_type"]
         class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
@@ -119,32 +164,14 @@ class CacheKeySetInputSignature(CacheKeySet):
         for key in sorted(inputs.keys()):
             if is_link(inputs[key]):
                 (ancestor_id, ancestor_socket) = inputs[key]
-                ancestor_index = ancestor_order_mapping[ancestor_id]
-                signature.append((key,("ANCESTOR", ancestor_index, ancestor_socket)))
+                ancestor_signature = ancestor_signatures.get(ancestor_id)
+                if not isinstance(ancestor_signature, bytes):
+                    # The ancestor can't be cached (or is part of a cycle), neither can this node
+                    return Unhashable()
+                signature.append((key, ("ANCESTOR", ancestor_signature, ancestor_socket)))
             else:
                 signature.append((key, inputs[key]))
-        return signature
-
-    # This function returns a list of all ancestors of the given node. The order of the list is
-    # deterministic based on which specific inputs the ancestor is connected by.
-    def get_ordered_ancestry(self, dynprompt, node_id):
-        ancestors = []
-        order_mapping = {}
-        self.get_ordered_ancestry_internal(dynprompt, node_id, ancestors, order_mapping)
-        return ancestors, order_mapping
-
-    def get_ordered_ancestry_internal(self, dynprompt, node_id, ancestors, order_mapping):
-        if not dynprompt.has_node(node_id):
-            return
-        inputs = dynprompt.get_node(node_id)["inputs"]
-        input_keys = sorted(inputs.keys())
-        for key in input_keys:
-            if is_link(inputs[key]):
-                ancestor_id = inputs[key][0]
-                if ancestor_id not in order_mapping:
-                    ancestors.append(ancestor_id)
-                    order_mapping[ancestor_id] = len(ancestors) - 1
-                    self.get_ordered_ancestry_internal(dynprompt, ancestor_id, ancestors, order_mapping)
+        return signature_digest(signature)
 
 class BasicCache:
     def __init__(self, key_class):
@@ -169,6 +196,9 @@ class BasicCache:
             node_ids = node_ids.union(subcache.all_node_ids())
         return node_ids
 
+    def entry_count(self):
+        return len(self.cache) + sum(subcache.entry_count() for subcache in self.subcaches.values())
+
     def _clean_cache(self):
         preserve_keys = set(self.cache_key_set.get_used_keys())
         to_remove = []
@@ -281,6 +311,9 @@ class NullCache:
     def all_node_ids(self):
         return []
 
+    def entry_count(self):
+        return 0
+
     def clean_unused(self):
         pass
 
@@ -414,10 +447,392 @@ class RAMPressureCache(LRUCache):
 
             oom_score *= ram_usage
             #In the case where we have no information on the node ram usage at all,
-            #break OOM score ties on the last touch timestamp (pure LRU)
-            bisect.insort(clean_list, (oom_score, self.timestamps[key], key))
+            #break OOM score ties on the last touch timestamp (pure LRU). Unhashable keys
+            #don't compare with each other or with digests, so ties left after that go by id
+            bisect.insort(clean_list, (oom_score, self.timestamps[key], id(key), key))
 
         while _ram_gb() < ram_headroom * RAM_CACHE_HYSTERESIS and clean_list:
-            _, _, key = clean_list.pop()
+            _, _, _, key = clean_list.pop()
             del self.cache[key]
             gc.collect()
+
+
+#Bump this whenever the on-disk layout or the key derivation changes so stale
+#entries from older versions are never picked up.
+
+DISK_CACHE_FORMAT_VERSION = 2
+
+#Writes happen on a background thread. If it can't keep up we drop the write
+#rather than stalling execution, the entry will simply be recomputed next time.
+
+DISK_CACHE_MAX_PENDING_WRITES = 32
+
+class _NotPersistable(Exception):
+    pass
+
+def _stable_key_bytes(key, out):
+    # Produces a deterministic byte encoding of a cache key. Python's hash() is
+    # salted per process so frozensets have to be canonicalized by sorting the
+    # encodings of their members.
+    if isinstance(key, bool):
+        out.append(b"b1" if key else b"b0")
+    elif isinstance(key, int):
+        out.append(b"i" + str(key).encode() + b";")
+    elif isinstance(key, float):
+        if key != key:
+            # NaN keys (failed IS_CHANGED, missing nodes) never match
+            raise _NotPersistable()
+        out.append(b"f" + float.hex(key).encode() + b";")
+    elif isinstance(key, str):
+        data = key.encode("utf-8")
+        out.append(b"s" + str(len(data)).encode() + b":" + data)
+    elif isinstance(key, bytes):
+        out.append(b"y" + str(len(key)).encode() + b":" + key)
+    elif key is None:
+        out.append(b"n")
+    elif isinstance(key, (tuple, list)):
+        out.append(b"(")
+        for item in key:
+            _stable_key_bytes(item, out)
+        out.append(b")")
+    elif isinstance(key, Mapping):
+        items = []
+        for k, v in key.items():
+            item_out = []
+            _stable_key_bytes(k, item_out)
+            _stable_key_bytes(v, item_out)
+            items.append(b"".join(item_out))
+        out.append(b"<")
+        out.extend(sorted(items))
+        out.append(b">")
+    elif isinstance(key, frozenset):
+        items = []
+        for item in key:
+            item_out = []
+            _stable_key_bytes(item, item_out)
+            items.append(b"".join(item_out))
+        out.append(b"{")
+        out.extend(sorted(items))
+        out.append(b"}")
+    else:
+        raise _NotPersistable()
+
+def node_code_version():
+    """
+    Identifies the code that computes node outputs: the ComfyUI version and the path, size and
+    mtime of the module of every node class. A node's cache key doesn't cover the code of the nodes
+    upstream of it, so updating ComfyUI or any custom node changes the version of every key.
+    """
+    modules = set()
+    for class_def in nodes.NODE_CLASS_MAPPINGS.values():
+        module = sys.modules.get(getattr(class_def, "__module__", None), None)
+        modules.add(getattr(module, "__file__", None) or "")
+    h = hashlib.sha256(comfyui_version.__version__.encode("utf-8"))
+    for file in sorted(modules):
+        try:
+            stat = os.stat(file)
+            h.update("{};{};{};".format(file, stat.st_size, stat.st_mtime_ns).encode("utf-8"))
+        except OSError:
+            h.update("{};;;".format(file).encode("utf-8"))
+    return h.hexdigest()
+
+def stable_key_digest(key, code_version=""):
+    """
+    Returns a hex digest of a cache key that is stable across processes or None if the key
+    can't be persisted. code_version (see node_code_version) is part of the digest.
+    """
+    out = [b"comfy-cache-v%d;" % DISK_CACHE_FORMAT_VERSION, code_version.encode("utf-8"), b";"]
+    try:
+        _stable_key_bytes(key, out)
+    except _NotPersistable:
+        return None
+    return hashlib.sha256(b"".join(out)).hexdigest()
+
+def signature_digest(signature):
+    """
+    Returns a 16 byte digest of a node signature or an Unhashable if it contains values that don't
+    compare equal across prompts (NaN from IS_CHANGED, objects).
+    """
+    out = []
+    try:
+        _stable_key_bytes(signature, out)
+    except _NotPersistable:
+        return Unhashable()
+    return hashlib.blake2b(b"".join(out), digest_size=16).digest()
+
+def _encode_value(value, tensors, seen_storage):
+    if isinstance(value, (bool, int, str, type(None))):
+        return value
+    elif isinstance(value, float):
+        return {"__float__": float.hex(value)}
+    elif type(value) is torch.Tensor:
+        if value.device.type != "cpu" or value.requires_grad:
+            raise _NotPersistable()
+        tensor = value.contiguous()
+        ptr = tensor.untyped_storage().data_ptr()
+        if ptr in seen_storage:
+            tensor = tensor.clone()
+        seen_storage.add(ptr)
+        name = "t{}".format(len(tensors))
+        tensors[name] = tensor
+        return {"__tensor__": name}
+    elif isinstance(value, (list, tuple)):
+        items = [_encode_value(v, tensors, seen_storage) for v in value]
+        if isinstance(value, tuple):
+            return {"__tuple__": items}
+        return items
+    elif type(value) is dict:
+        if not all(isinstance(k, str) for k in value):
+            raise _NotPersistable()
+        return {"__dict__": {k: _encode_value(v, tensors, seen_storage) for k, v in value.items()}}
+    raise _NotPersistable()
+
+def _decode_value(value, tensors):
+    if isinstance(value, list):
+        return [_decode_value(v, tensors) for v in value]
+    elif isinstance(value, dict):
+        if "__tensor__" in value:
+            return tensors[value["__tensor__"]]
+        if "__float__" in value:
+            return float.fromhex(value["__float__"])
+        if "__tuple__" in value:
+            return tuple(_decode_value(v, tensors) for v in value["__tuple__"])
+        return {k: _decode_value(v, tensors) for k, v in value["__dict__"].items()}
+    return value
+
+def _load_safetensors_cow(path):
+    # Copy-on-write mapping: pages are only read from disk when touched and a
+    # node that modifies its input in place can't corrupt the cache file.
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    header_size = struct.unpack("<Q", mapping[:8])[0]
+    header = json.loads(mapping[8:8 + header_size].decode("utf-8"))
+    mv = memoryview(mapping)[8 + header_size:]
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = comfy.utils._TYPES[info["dtype"]]
+        start, end = info["data_offsets"]
+        if start == end:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+        else:
+            tensors[name] = torch.frombuffer(mv[start:end], dtype=dtype).view(info["shape"])
+    return tensors, header.get("__metadata__", {})
+
+class DiskCache:
+    """
+    Size bounded LRU store of node outputs on disk. Each entry is a single safetensors file
+    named after the stable digest of its cache key, with the structure of the outputs stored
+    as json in the safetensors metadata. Entries are memory mapped on load.
+    """
+    def __init__(self, directory, max_size_bytes):
+        self.directory = directory
+        self.max_size_bytes = max_size_bytes
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.total_size = 0
+        self.pending = queue.Queue(maxsize=DISK_CACHE_MAX_PENDING_WRITES)
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan()
+        self.writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer.start()
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest + ".safetensors")
+
+    def _scan(self):
+        found = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".safetensors"):
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name[:-len(".safetensors")], stat.st_size))
+            elif entry.name.endswith(".tmp"):
+                # Leftover from an interrupted write
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+        for _, digest, size in sorted(found):
+            self.entries[digest] = size
+            self.total_size += size
+        self._evict()
+
+    def _evict(self):
+        with self.lock:
+            to_remove = []
+            while self.total_size > self.max_size_bytes and len(self.entries) > 0:
+                digest, size = self.entries.popitem(last=False)
+                self.total_size -= size
+                to_remove.append(digest)
+        for digest in to_remove:
+            try:
+                os.remove(self._path(digest))
+            except OSError:
+                pass
+
+    def contains(self, digest):
+        with self.lock:
+            if digest in self.entries:
+                return True
+        # Another instance sharing the directory may have written it.
+        return os.path.isfile(self._path(digest))
+
+    def get(self, digest):
+        path = self._path(digest)
+        try:
+            tensors, metadata = _load_safetensors_cow(path)
+            value = json.loads(metadata["comfy_cache"])
+            ui = _decode_value(value["ui"], tensors)
+            outputs = _decode_value(value["outputs"], tensors)
+        except FileNotFoundError:
+            with self.lock:
+                size = self.entries.pop(digest, None)
+                if size is not None:
+                    self.total_size -= size
+            return None
+        except Exception as e:
+            logging.warning("Failed to load disk cache entry {}: {}".format(path, e))
+            return None
+
+        with self.lock:
+            if digest not in self.entries:
+                size = os.path.getsize(path)
+                self.entries[digest] = size
+                self.total_size += size
+            self.entries.move_to_end(digest)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return ui, outputs
+
+    def set(self, digest, ui, outputs):
+        """
+        Queues a write of the entry. Returns False if the value can't be persisted.
+        """
+        if self.contains(digest):
+            return True
+        tensors = {}
+        seen_storage = set()
+        try:
+            value = {
+                "ui": _encode_value(ui, tensors, seen_storage),
+                "outputs": _encode_value(outputs, tensors, seen_storage),
+            }
+        except _NotPersistable:
+            return False
+        try:
+            self.pending.put_nowait((digest, tensors, json.dumps(value)))
+        except queue.Full:
+            logging.debug("Disk cache writer is behind, dropping entry {}".format(digest))
+        return True
+
+    def flush(self):
+        self.pending.join()
+
+    def _writer_loop(self):
+        while True:
+            digest, tensors, value = self.pending.get()
+            try:
+                self._write(digest, tensors, value)
+            except Exception as e:
+                logging.warning("Failed to write disk cache entry {}: {}".format(digest, e))
+            finally:
+                self.pending.task_done()
+
+    def _write(self, digest, tensors, value):
+        path = self._path(digest)
+        tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        safetensors.torch.save_file(tensors, tmp_path, metadata={"comfy_cache": value})
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self.lock:
+            if digest in self.entries:
+                self.total_size -= self.entries[digest]
+            self.entries[digest] = size
+            self.total_size += size
+        self._evict()
+
+class DiskTieredCache:
+    """
+    Puts a DiskCache behind one of the in-memory output caches. Lookups that miss in RAM are
+    served from disk and promoted, new results are written through to disk.
+    """
+    def __init__(self, ram_cache, disk_cache):
+        self.ram_cache = ram_cache
+        self.disk_cache = disk_cache
+        self.code_version = None
+
+    async def set_prompt(self, dynprompt, node_ids, is_changed_cache):
+        self.code_version = node_code_version()
+        await self.ram_cache.set_prompt(dynprompt, node_ids, is_changed_cache)
+
+    def all_node_ids(self):
+        return self.ram_cache.all_node_ids()
+
+    def entry_count(self):
+        return self.ram_cache.entry_count()
+
+    def clean_unused(self):
+        self.ram_cache.clean_unused()
+
+    def poll(self, **kwargs):
+        self.ram_cache.poll(**kwargs)
+
+    def _get_disk_digest(self, node_id):
+        if not self.ram_cache.initialized:
+            return None
+        dynprompt = self.ram_cache.dynprompt
+        # Ephemeral nodes from subgraph expansion are keyed inside subcaches.
+        if dynprompt.get_parent_node_id(node_id) is not None or not dynprompt.has_node(node_id):
+            return None
+        class_def = nodes.NODE_CLASS_MAPPINGS[dynprompt.get_node(node_id)["class_type"]]
+        # Output nodes have side effects (saved files, previews in temp) that are not part of the outputs.
+        if getattr(class_def, "OUTPUT_NODE", False):
+            return None
+        cache_key = self.ram_cache.cache_key_set.get_data_key(node_id)
+        if cache_key is None:
+            return None
+        return stable_key_digest(cache_key, self.code_version)
+
+    def get(self, node_id):
+        value = self.ram_cache.get(node_id)
+        if value is not None:
+            return value
+        digest = self._get_disk_digest(node_id)
+        if digest is None or not self.disk_cache.contains(digest):
+            return None
+        loaded = self.disk_cache.get(digest)
+        if loaded is None:
+            return None
+        ui, outputs = loaded
+        value = CacheEntry(ui=ui, outputs=outputs)
+        self.ram_cache.set(node_id, value)
+        return value
+
+    def set(self, node_id, value):
+        self.ram_cache.set(node_id, value)
+        digest = self._get_disk_digest(node_id)
+        if digest is not None:
+            self.disk_cache.set(digest, value.ui, value.outputs)
+
+    async def ensure_subcache_for(self, node_id, children_ids):
+        return await self.ram_cache.ensure_subcache_for(node_id, children_ids)
+
+    def recursive_debug_dump(self):
+        return self.ram_cache.recursive_debug_dump()
+
+_disk_caches = {}
+
+def get_disk_cache(directory, max_size_bytes):
+    # The executor recreates its CacheSet when memory is freed, the disk tier
+    # (and its writer thread) outlives that.
+    directory = os.path.abspath(directory)
+    disk_cache = _disk_caches.get(directory)
+    if disk_cache is None:
+        disk_cache = DiskCache(directory, max_size_bytes)
+        _disk_caches[directory] = disk_cache
+    else:
+        disk_cache.max_size_bytes = max_size_bytes
+    return disk_cache
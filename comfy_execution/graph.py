@@ -27,6 +27,8 @@ class DynamicPrompt:
         self.ephemeral_prompt = {}
         self.ephemeral_parents = {}
         self.ephemeral_display = {}
+        # Cache key signatures of the nodes, see CacheKeySetInputSignature
+        self.signatures = {}
 
     def get_node(self, node_id):
         if node_id in self.ephemeral_prompt:
@@ -39,6 +41,9 @@ class DynamicPrompt:
         return node_id in self.original_prompt or node_id in self.ephemeral_prompt
 
     def add_ephemeral_node(self, node_id, node_info, parent_id, display_id):
+        if node_id in self.ephemeral_prompt:
+            # Replaced nodes change the signatures of their descendants
+            self.signatures.clear()
         self.ephemeral_prompt[node_id] = node_info
         self.ephemeral_parents[node_id] = parent_id
         self.ephemeral_display[node_id] = display_id
@@ -104,6 +109,15 @@ def get_input_info(
     #     input_type = IO.Combo.io_type
     return input_type, input_category, extra_info
 
+def is_cpu_affine(class_def):
+    """
+    Returns True if the node only does thread safe CPU work and may be dispatched to a worker thread.
+    Output nodes always stay on the executor thread so their ordering is unaffected.
+    """
+    if getattr(class_def, "OUTPUT_NODE", False):
+        return False
+    return getattr(class_def, "DEVICE_AFFINITY", None) == "cpu"
+
 class TopologicalSort:
     def __init__(self, dynprompt):
         self.dynprompt = dynprompt
@@ -196,9 +210,10 @@ class ExecutionList(TopologicalSort):
     ExecutionList implements a topological dissolve of the graph. After a node is staged for execution,
     it can still be returned to the graph after having further dependencies added.
     """
-    def __init__(self, dynprompt, output_cache):
+    def __init__(self, dynprompt, output_cache, dispatch_cpu_nodes=False):
         super().__init__(dynprompt)
         self.output_cache = output_cache
+        self.dispatch_cpu_nodes = dispatch_cpu_nodes
         self.staged_node_id = None
         self.execution_cache = {}
         self.execution_cache_listeners = {}
@@ -284,6 +299,9 @@ class ExecutionList(TopologicalSort):
         def is_async(node_id):
             class_type = self.dynprompt.get_node(node_id)["class_type"]
             class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
+            if self.dispatch_cpu_nodes and is_cpu_affine(class_def):
+                # Gets handed to the CPU worker pool, so start it before blocking on a GPU node
+                return True
             return inspect.iscoroutinefunction(getattr(class_def, class_def.FUNCTION))
 
         for node_id in node_list:
@@ -3,6 +3,8 @@ Job utilities for the /api/jobs endpoint.
 Provides normalization and helper functions for job status tracking.
 """
 
+import base64
+import json
 from typing import Optional
 
 from comfy_api.internal import prune_dict
@@ -190,20 +192,51 @@ def get_outputs_summary(outputs: dict) -> tuple[int, Optional[dict]]:
     return count, preview_output or fallback_preview
 
 
+def get_sort_value(job: dict, sort_by: str) -> int:
+    """Get the value a job is ordered by for the given sort field."""
+    if sort_by == 'execution_duration':
+        start = job.get('execution_start_time', 0)
+        end = job.get('execution_end_time', 0)
+        return end - start if end and start else 0
+    return job.get('create_time') or 0
+
+
+def get_sort_key(job: dict, sort_by: str) -> tuple:
+    """Total ordering of jobs: the sort value, ties broken by job id."""
+    return (get_sort_value(job, sort_by), job['id'])
+
+
 def apply_sorting(jobs: list[dict], sort_by: str, sort_order: str) -> list[dict]:
     """Sort jobs list by specified field and order."""
     reverse = (sort_order == 'desc')
+    return sorted(jobs, key=lambda job: get_sort_key(job, sort_by), reverse=reverse)
+
+
+def encode_cursor(job: dict, sort_by: str) -> str:
+    """Opaque pagination cursor pointing just after the given job."""
+    value, job_id = get_sort_key(job, sort_by)
+    return base64.urlsafe_b64encode(json.dumps([value, job_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    Decode a cursor created by encode_cursor into a (sort value, job id) key.
+    Raises ValueError if the cursor is malformed.
+    """
+    try:
+        value, job_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(value, (int, float)) or not isinstance(job_id, str):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return (value, job_id)
 
-    if sort_by == 'execution_duration':
-        def get_sort_key(job):
-            start = job.get('execution_start_time', 0)
-            end = job.get('execution_end_time', 0)
-            return end - start if end and start else 0
-    else:
-        def get_sort_key(job):
-            return job.get('create_time', 0)
 
-    return sorted(jobs, key=get_sort_key, reverse=reverse)
+def apply_cursor(jobs: list[dict], cursor: tuple, sort_by: str, sort_order: str) -> list[dict]:
+    """Keep only the jobs ordered after the cursor key."""
+    if sort_order == 'desc':
+        return [j for j in jobs if get_sort_key(j, sort_by) < cursor]
+    return [j for j in jobs if get_sort_key(j, sort_by) > cursor]
 
 
 def get_job(prompt_id: str, running: list, queued: list, history: dict) -> Optional[dict]:
@@ -242,7 +275,8 @@ def get_all_jobs(
     sort_by: str = "created_at",
     sort_order: str = "desc",
     limit: Optional[int] = None,
-    offset: int = 0
+    offset: int = 0,
+    cursor: Optional[tuple] = None
 ) -> tuple[list[dict], int]:
     """
     Get all jobs (running, pending, completed) with filtering and sorting.
@@ -257,6 +291,7 @@ def get_all_jobs(
         sort_order: 'asc' or 'desc'
         limit: Maximum number of items to return
         offset: Number of items to skip
+        cursor: Decoded cursor, only return jobs ordered after it
 
     Returns:
         tuple: (jobs_list, total_count)
@@ -289,6 +324,8 @@ def get_all_jobs(
 
     total_count = len(jobs)
 
+    if cursor is not None:
+        jobs = apply_cursor(jobs, cursor, sort_by, sort_order)
     if offset > 0:
         jobs = jobs[offset:]
     if limit is not None:
@@ -0,0 +1,33 @@
+import logging
+
+import folder_paths
+import nodes
+
+
+def get_prompt_model_paths(prompt):
+    """
+    Returns the paths of the model files the loader nodes of a prompt are going to load. Loader
+    nodes list the inputs that name a model file, and the folder it is in, in PREFETCH_MODELS.
+    """
+    paths = []
+    for node in prompt.values():
+        class_def = nodes.NODE_CLASS_MAPPINGS.get(node.get("class_type"))
+        prefetch_models = getattr(class_def, "PREFETCH_MODELS", None)
+        if not prefetch_models:
+            continue
+        inputs = node.get("inputs", {})
+        for input_name, folder_name in prefetch_models.items():
+            value = inputs.get(input_name)
+            if not isinstance(value, str):
+                continue
+            path = folder_paths.get_full_path(folder_name, value)
+            if path is not None and path not in paths:
+                paths.append(path)
+    return paths
+
+
+def prefetch_prompt(prefetcher, prompt, prompt_id=None):
+    try:
+        prefetcher.prefetch(get_prompt_model_paths(prompt), prompt_id=prompt_id)
+    except Exception as e:
+        logging.warning("Failed to prefetch the models of a prompt: {}".format(e))
@@ -0,0 +1,327 @@
+"""
+Sampling of queued prompts in the same batch (--batch-prompts).
+
+When a KSampler runs, the next queued prompts that have a KSampler with the same id, model, sampler
+settings and latent size are sampled in the same batch. Their part of the batch is kept until those
+prompts run and put in the outputs cache when they start, so the sampler and the nodes upstream of it
+are skipped there. Every prompt still runs on its own, with its own messages, history and output nodes.
+
+The inputs of the queued samplers come from the outputs of the running prompt when the upstream nodes
+are the same (same input signature) and are otherwise computed ahead of time, e.g. the text encoders
+of a different prompt.
+"""
+import heapq
+import logging
+
+import torch
+
+import comfy.sample
+import comfy.utils
+import latent_preview
+import nodes
+from comfy_execution.caching import CacheEntry, CacheKeySetInputSignature, Unhashable
+from comfy_execution.graph import DynamicPrompt, ExecutionBlocker
+from comfy_execution.graph_utils import is_link
+from comfy_execution.utils import CurrentNodeContext
+
+BATCHED_NODES = {"KSampler"}
+
+# Inputs that have to be the same for samplers to share a batch, the model is compared separately
+SAMPLER_SETTINGS = ("steps", "cfg", "sampler_name", "scheduler", "denoise")
+
+# Samplers that do not add noise while sampling. The noise the others add comes from one seed for
+# the whole batch, so their results would depend on the other prompts in it.
+DETERMINISTIC_SAMPLERS = {
+    "euler", "euler_cfg_pp", "heun", "heunpp2", "dpm_2", "lms", "dpmpp_2m", "dpmpp_2m_cfg_pp",
+    "ipndm", "ipndm_v", "deis", "res_multistep", "res_multistep_cfg_pp", "gradient_estimation",
+    "gradient_estimation_cfg_pp", "ddim", "uni_pc", "uni_pc_bh2",
+}
+
+# Conditioning options that are batched with the conditioning, all the others must be equal
+BATCHED_COND_OPTIONS = {"pooled_output"}
+
+LATENT_KEYS = {"samples", "batch_index", "downscale_ratio_spacial"}
+
+
+class NotBatchable(Exception):
+    pass
+
+
+class _ResolvedOutputs:
+    # The part of ExecutionList that get_input_data uses
+    def __init__(self, outputs):
+        self.outputs = outputs
+
+    def get_cache(self, from_node_id, to_node_id):
+        return self.outputs.get(from_node_id)
+
+
+def _same(a, b):
+    if a is b:
+        return True
+    if isinstance(a, torch.Tensor) or isinstance(b, torch.Tensor):
+        return isinstance(a, torch.Tensor) and isinstance(b, torch.Tensor) and a.shape == b.shape and torch.equal(a, b)
+    try:
+        return type(a) is type(b) and bool(a == b)
+    except Exception:
+        return False
+
+
+def _cat(tensors, batch_sizes):
+    return torch.cat([comfy.utils.repeat_to_batch_size(t, b) for t, b in zip(tensors, batch_sizes)])
+
+
+def merge_conds(conds, batch_sizes):
+    """
+    Concatenates the conditioning of several prompts along the batch, each repeated to the batch size
+    of its latent. Returns None if they differ in anything other than the tensors that are batched.
+    """
+    if any(len(c) != len(conds[0]) for c in conds):
+        return None
+    merged = []
+    for entries in zip(*conds):
+        tensors = [e[0] for e in entries]
+        if any(t.shape[1:] != tensors[0].shape[1:] for t in tensors):
+            return None
+        options = [e[1] for e in entries]
+        if any(o.keys() != options[0].keys() for o in options):
+            return None
+        merged_options = {}
+        for k, v in options[0].items():
+            values = [o[k] for o in options]
+            if k in BATCHED_COND_OPTIONS and all(isinstance(x, torch.Tensor) and x.shape[1:] == v.shape[1:] for x in values):
+                merged_options[k] = _cat(values, batch_sizes)
+            elif all(_same(v, x) for x in values[1:]):
+                merged_options[k] = v
+            else:
+                return None
+        merged.append([_cat(tensors, batch_sizes), merged_options])
+    return merged
+
+
+def _batchable_latent(latent):
+    return isinstance(latent, dict) and latent.keys() <= LATENT_KEYS and not latent["samples"].is_nested
+
+
+class SamplerBatcher:
+    def __init__(self, max_batch):
+        self.max_batch = max_batch
+        # How far down the queue to look for prompts that can share the batch
+        self.lookahead = max_batch * 2
+        # prompt_id -> {node_id: CacheEntry} sampled while running an earlier prompt
+        self.results = {}
+
+    def restore(self, prompt_id, outputs_cache):
+        """
+        Puts the sampler outputs of prompt_id that were computed ahead of time in the outputs cache,
+        after the cache was set up for the prompt.
+        """
+        results = self.results.pop(prompt_id, None)
+        if results is None:
+            return
+        for node_id, entry in results.items():
+            outputs_cache.set(node_id, entry)
+        logging.debug("Using batched sampler outputs of {} for nodes {}".format(prompt_id, list(results)))
+
+    def discard(self, prompt_ids):
+        """
+        Drops the sampler outputs of prompts that were removed from the queue.
+        """
+        for prompt_id in prompt_ids:
+            self.results.pop(prompt_id, None)
+
+    async def sample(self, server, dynprompt, caches, prompt_id, unique_id, input_data_all):
+        """
+        Runs the sampler unique_id of the running prompt together with the same sampler of the next
+        compatible queued prompts. Returns the output of the node in the format of get_output_data,
+        or None if nothing could be batched with it.
+        """
+        queue = getattr(server, "prompt_queue", None)
+        if queue is None or any(len(v) != 1 for v in input_data_all.values()):
+            return None
+        inputs = {k: v[0] for k, v in input_data_all.items()}
+        if inputs.get("sampler_name") not in DETERMINISTIC_SAMPLERS or not _batchable_latent(inputs.get("latent_image")):
+            return None
+
+        _, queued = queue.get_current_queue_volatile()
+        queued = heapq.nsmallest(self.lookahead, queued)
+        queued_ids = set(item.prompt_id for item in queued)
+        # Drop the results of prompts that were deleted from the queue
+        self.results = {k: v for k, v in self.results.items() if k in queued_ids}
+
+        members = []
+        running = None
+        for item in queued:
+            if len(members) + 1 >= self.max_batch:
+                break
+            if item.prompt_id in self.results or not self._compatible_node(item.prompt, unique_id, dynprompt, inputs):
+                continue
+            if running is None:
+                running = await self._running_outputs(prompt_id, dynprompt, caches)
+            try:
+                item_inputs = await self._resolve_inputs(item, unique_id, running, inputs["model"])
+            except NotBatchable as e:
+                logging.debug("Not batching {} with {}: {}".format(item.prompt_id, prompt_id, e))
+                continue
+            if self._compatible_inputs(inputs, item_inputs):
+                members.append((item.prompt_id, item_inputs))
+
+        if len(members) == 0:
+            return None
+
+        all_inputs = [inputs] + [m[1] for m in members]
+        batch_sizes = [i["latent_image"]["samples"].shape[0] for i in all_inputs]
+        positive = merge_conds([i["positive"] for i in all_inputs], batch_sizes)
+        negative = merge_conds([i["negative"] for i in all_inputs], batch_sizes)
+        if positive is None or negative is None:
+            return None
+
+        logging.info("Sampling {} queued prompts in the batch of {}".format(len(members), prompt_id))
+        outputs = self._sample(prompt_id, unique_id, all_inputs, positive, negative)
+        for (member_prompt_id, _), out in zip(members, outputs[1:]):
+            self.results[member_prompt_id] = {unique_id: CacheEntry(ui=None, outputs=[[out]])}
+        return [[outputs[0]]], {}, False, False
+
+    def _compatible_node(self, prompt, node_id, dynprompt, inputs):
+        node = prompt.get(node_id)
+        if node is None or node.get("class_type") != dynprompt.get_node(node_id)["class_type"]:
+            return False
+        node_inputs = node.get("inputs", {})
+        for k in SAMPLER_SETTINGS:
+            value = node_inputs.get(k)
+            if is_link(value) or value != inputs.get(k):
+                return False
+        return True
+
+    def _compatible_inputs(self, inputs, other):
+        if other["model"] is not inputs["model"]:
+            return False
+        if not _batchable_latent(other["latent_image"]):
+            return False
+        latent, other_latent = inputs["latent_image"], other["latent_image"]
+        if latent["samples"].shape[1:] != other_latent["samples"].shape[1:]:
+            return False
+        return latent.get("downscale_ratio_spacial") == other_latent.get("downscale_ratio_spacial")
+
+    async def _running_outputs(self, prompt_id, dynprompt, caches):
+        # Cached outputs of the running prompt by input signature
+        import execution
+        is_changed_cache = execution.IsChangedCache(prompt_id, dynprompt, caches.outputs)
+        node_ids = list(dynprompt.original_prompt)
+        keys = CacheKeySetInputSignature(dynprompt, node_ids, is_changed_cache)
+        await keys.add_keys(node_ids)
+        running = {}
+        for node_id in node_ids:
+            entry = caches.outputs.get(node_id)
+            if entry is not None:
+                running[keys.get_data_key(node_id)] = entry
+        return running
+
+    async def _resolve_inputs(self, item, node_id, running, model):
+        """
+        Returns the inputs of the sampler node_id of the queued prompt item. The model has to be an
+        output of the running prompt, checked before anything else is evaluated so a queued prompt with
+        another model does not load it. Samplers downstream of nodes that run every time (IS_CHANGED
+        returns NaN) are not batched, their inputs have to come from when the prompt runs.
+        """
+        import execution
+        # The queued prompt is shared with the queue, IsChangedCache writes to its nodes
+        dynprompt = DynamicPrompt({k: dict(v) for k, v in item.prompt.items()})
+        is_changed_cache = execution.IsChangedCache(item.prompt_id, dynprompt, None)
+        keys = CacheKeySetInputSignature(dynprompt, [], is_changed_cache)
+        resolved = {}
+
+        async def evaluate(node_id):
+            if node_id in resolved:
+                return
+            await keys.add_keys([node_id])
+            entry = running.get(keys.get_data_key(node_id))
+            if entry is None:
+                node = dynprompt.get_node(node_id)
+                class_def = nodes.NODE_CLASS_MAPPINGS[node["class_type"]]
+                if getattr(class_def, "OUTPUT_NODE", False) or getattr(class_def, "INPUT_IS_LIST", False):
+                    raise NotBatchable("node {} is an output or list node".format(node_id))
+                for value in node["inputs"].values():
+                    if is_link(value):
+                        await evaluate(value[0])
+                input_data_all, missing_keys, v3_data = execution.get_input_data(node["inputs"], class_def, node_id, _ResolvedOutputs(resolved), dynprompt, item.extra_data)
+                if len(missing_keys) > 0:
+                    raise NotBatchable("node {} is missing inputs".format(node_id))
+                output_data, _, has_subgraph, has_pending_tasks = await execution.get_output_data(item.prompt_id, node_id, class_def(), input_data_all, v3_data=v3_data)
+                if has_subgraph or has_pending_tasks:
+                    raise NotBatchable("node {} expands or is async".format(node_id))
+                entry = CacheEntry(ui=None, outputs=output_data)
+            resolved[node_id] = entry
+
+        def get_input(value):
+            outputs = resolved[value[0]].outputs
+            if value[1] >= len(outputs) or len(outputs[value[1]]) != 1 or isinstance(outputs[value[1]][0], ExecutionBlocker):
+                raise NotBatchable("input from node {} is not a single value".format(value[0]))
+            return outputs[value[1]][0]
+
+        await keys.add_keys([node_id])
+        if isinstance(keys.get_data_key(node_id), Unhashable):
+            raise NotBatchable("a node upstream of the sampler runs every time")
+
+        sampler_node_inputs = dynprompt.get_node(node_id)["inputs"]
+        model_link = sampler_node_inputs.get("model")
+        if not is_link(model_link):
+            raise NotBatchable("the model is not linked")
+        await keys.add_keys([model_link[0]])
+        entry = running.get(keys.get_data_key(model_link[0]))
+        if entry is None:
+            raise NotBatchable("the model is not loaded by the running prompt")
+        resolved[model_link[0]] = entry
+        if get_input(model_link) is not model:
+            raise NotBatchable("the model is not the same")
+
+        sampler_inputs = {}
+        for name, value in sampler_node_inputs.items():
+            if not is_link(value):
+                sampler_inputs[name] = value
+                continue
+            await evaluate(value[0])
+            sampler_inputs[name] = get_input(value)
+        return sampler_inputs
+
+    def _sample(self, prompt_id, unique_id, all_inputs, positive, negative):
+        inputs = all_inputs[0]
+        model = inputs["model"]
+        latent_images = []
+        noise = []
+        for i in all_inputs:
+            latent = i["latent_image"]
+            latent_image = comfy.sample.fix_empty_latent_channels(model, latent["samples"], latent.get("downscale_ratio_spacial", None))
+            latent_images.append(latent_image)
+            # The noise of each prompt comes from its own seed, like when it is sampled alone
+            noise.append(comfy.sample.prepare_noise(latent_image, i["seed"], latent.get("batch_index", None)))
+
+        steps = inputs["steps"]
+        callback = latent_preview.prepare_callback(model, steps)
+        disable_pbar = not comfy.utils.PROGRESS_BAR_ENABLED
+        with CurrentNodeContext(prompt_id, unique_id, 0):
+            nodes.before_node_execution()
+            samples = comfy.sample.sample(model, torch.cat(noise), steps, inputs["cfg"], inputs["sampler_name"], inputs["scheduler"], positive, negative, torch.cat(latent_images),
+                                          denoise=inputs["denoise"], callback=callback, disable_pbar=disable_pbar, seed=inputs["seed"])
+
+        outputs = []
+        for i, s in zip(all_inputs, samples.split([l.shape[0] for l in latent_images])):
+            out = i["latent_image"].copy()
+            out.pop("downscale_ratio_spacial", None)
+            out["samples"] = s
+            outputs.append(out)
+        return outputs
+
+
+# Set with set_batcher (--batch-prompts)
+batcher = None
+
+def set_batcher(sampler_batcher):
+    global batcher
+    batcher = sampler_batcher
+    if sampler_batcher is not None:
+        logging.info("Sampling up to {} queued prompts in the same batch".format(sampler_batcher.max_batch))
+
+def discard_results(prompt_ids):
+    if batcher is not None:
+        batcher.discard(prompt_ids)
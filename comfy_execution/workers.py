@@ -0,0 +1,295 @@
+"""
+Multi-worker prompt execution.
+
+The main process keeps the http server and the PromptQueue. Each worker is a separate ComfyUI
+process started with --worker-connect, pinned to its own device, with its own PromptExecutor and
+CacheSet. A dispatcher thread per worker pulls prompts from the shared queue, preferring prompts
+that use models the worker already has loaded, and relays the worker's websocket messages.
+"""
+import collections
+import logging
+import os
+import queue
+import secrets
+import subprocess
+import sys
+import threading
+from multiprocessing.connection import Client, Listener
+
+import execution
+import folder_paths
+import nodes
+
+AUTHKEY_ENV = "COMFY_WORKER_AUTHKEY"
+
+# How many of the highest priority queue items a worker may look at when routing by cache affinity.
+# Bounded so an item can only be passed over a few times before it gets picked.
+AFFINITY_LOOKAHEAD = 8
+
+# Number of recent prompts whose models are assumed to still be loaded on a worker.
+AFFINITY_HISTORY = 4
+
+def get_prompt_models(prompt):
+    """
+    Returns the set of model files referenced by loader nodes in a prompt.
+    """
+    models = set()
+    for node in prompt.values():
+        for name, value in node.get("inputs", {}).items():
+            if not isinstance(value, str) or not name.endswith("_name"):
+                continue
+            if os.path.splitext(value)[1].lower() in folder_paths.supported_pt_extensions:
+                models.add(value)
+    return models
+
+
+class WorkerHandle:
+    """
+    Main process side of a worker: owns the child process and the dispatcher thread.
+    """
+    def __init__(self, pool, index, device):
+        self.pool = pool
+        self.index = index
+        self.device = device
+        self.process = None
+        self.conn = None
+        self.connected = threading.Event()
+        self.send_lock = threading.Lock()
+        self.restart_lock = threading.Lock()
+        self.running_prompt_id = None
+        self.recent_models = collections.deque(maxlen=AFFINITY_HISTORY)
+
+    def spawn(self):
+        worker_args = [sys.executable, os.path.abspath(sys.argv[0])] + sys.argv[1:]
+        worker_args += ["--worker-connect", "{}:{}:{}".format(self.pool.address[0], self.pool.address[1], self.index)]
+        if self.device is not None:
+            worker_args += ["--cuda-device", str(self.device)]
+        env = os.environ.copy()
+        env[AUTHKEY_ENV] = self.pool.authkey.hex()
+        self.connected.clear()
+        self.process = subprocess.Popen(worker_args, env=env)
+        logging.info("Started prompt worker {} (pid {}) on device {}".format(self.index, self.process.pid, self.device if self.device is not None else "default"))
+
+    def send(self, *msg):
+        with self.send_lock:
+            if self.conn is None:
+                raise OSError("Prompt worker {} is not connected".format(self.index))
+            self.conn.send(msg)
+
+    def restart(self, conn):
+        """
+        Replaces the worker after its connection conn failed. Does nothing if that was already done
+        for conn, so the threads that notice the failure can all call it.
+        """
+        with self.restart_lock:
+            if conn is None or self.conn is not conn:
+                return
+            self.connected.clear()
+            self.conn = None
+            try:
+                conn.close()
+            except OSError:
+                pass
+            if self.process is not None and self.process.poll() is None:
+                self.process.kill()
+            self.spawn()
+
+    def loaded_models(self):
+        models = set()
+        for m in self.recent_models:
+            models.update(m)
+        return models
+
+    def prefers(self, item):
+        loaded = self.loaded_models()
+        if len(loaded) == 0:
+            return False
+        return len(get_prompt_models(item[2]).intersection(loaded)) > 0
+
+    def dispatch_loop(self):
+        server = self.pool.server
+        q = server.prompt_queue
+        while True:
+            self.connected.wait()
+            self.pool.poll_flags()
+            queue_item = q.get(timeout=1.0, preference=self.prefers, lookahead=AFFINITY_LOOKAHEAD)
+            if queue_item is None:
+                continue
+            item, item_id = queue_item
+            self.running_prompt_id = item[1]
+            server.last_prompt_id = item[1]
+            client_id = item[3].get("client_id")
+            sockets_metadata = {}
+            if client_id in server.sockets_metadata:
+                sockets_metadata[client_id] = server.sockets_metadata[client_id]
+            conn = self.conn
+            try:
+                self.send("execute", item, item_id, sockets_metadata)
+                while True:
+                    msg = conn.recv()
+                    if msg[0] == "send_sync":
+                        server.send_sync(*msg[1:])
+                    elif msg[0] == "done":
+                        _, history_result, status, processed_item = msg
+                        q.task_done(item_id, history_result, status=status, process_item=lambda _: processed_item)
+                        break
+            except (EOFError, OSError) as e:
+                logging.error("Prompt worker {} died while running prompt {}: {}".format(self.index, item[1], e))
+                q.task_done(item_id, {},
+                            status=execution.PromptQueue.ExecutionStatus(
+                                status_str='error',
+                                completed=False,
+                                messages=[("execution_error", {"prompt_id": item[1], "exception_message": "Prompt worker process died", "exception_type": "WorkerError"})]),
+                            process_item=lambda prompt: prompt[:5] + prompt[6:])
+                self.restart(conn)
+            finally:
+                self.running_prompt_id = None
+            self.recent_models.append(get_prompt_models(item[2]))
+
+
+class WorkerPool:
+    def __init__(self, server, num_workers, devices=None):
+        self.server = server
+        self.authkey = secrets.token_bytes(32)
+        self.listener = Listener(("127.0.0.1", 0), authkey=self.authkey)
+        self.address = self.listener.address
+        self.flags_lock = threading.Lock()
+        if devices is None or len(devices) == 0:
+            devices = [None]
+        self.workers = [WorkerHandle(self, i, devices[i % len(devices)]) for i in range(num_workers)]
+
+    def start(self):
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+        for worker in self.workers:
+            worker.spawn()
+            threading.Thread(target=worker.dispatch_loop, daemon=True).start()
+
+    def accept_loop(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+                msg = conn.recv()
+            except Exception as e:
+                logging.warning("Rejected prompt worker connection: {}".format(e))
+                continue
+            if msg[0] != "hello" or not (0 <= msg[1] < len(self.workers)):
+                conn.close()
+                continue
+            worker = self.workers[msg[1]]
+            worker.conn = conn
+            worker.connected.set()
+            logging.info("Prompt worker {} ready.".format(worker.index))
+
+    def poll_flags(self):
+        # Flags like free_memory/unload_models apply to every worker.
+        with self.flags_lock:
+            flags = self.server.prompt_queue.get_flags()
+            if len(flags) == 0:
+                return
+            for worker in self.workers:
+                conn = worker.conn
+                if not worker.connected.is_set() or conn is None:
+                    continue
+                try:
+                    worker.send("flags", flags)
+                except (EOFError, OSError) as e:
+                    logging.error("Lost the connection to prompt worker {}: {}".format(worker.index, e))
+                    worker.restart(conn)
+
+    def interrupt(self, prompt_id=None):
+        """
+        Interrupts the worker running prompt_id, or all workers if it is None. Returns True if a
+        worker was interrupted.
+        """
+        interrupted = False
+        for worker in self.workers:
+            if worker.running_prompt_id is None:
+                continue
+            if prompt_id is None or worker.running_prompt_id == prompt_id:
+                try:
+                    worker.send("interrupt")
+                except (EOFError, OSError) as e:
+                    # Its dispatcher thread fails the prompt and restarts it
+                    logging.error("Could not interrupt prompt worker {}: {}".format(worker.index, e))
+                    continue
+                interrupted = True
+        return interrupted
+
+
+class WorkerQueue:
+    """
+    Worker process side stand in for the PromptQueue, fed by the main process.
+    """
+    def __init__(self, conn, server_instance):
+        self.conn = conn
+        self.server = server_instance
+        self.send_lock = threading.Lock()
+        self.items = queue.Queue()
+        self.running = {}
+        self.flags = {}
+        self.flags_lock = threading.Lock()
+
+    def send(self, *msg):
+        with self.send_lock:
+            self.conn.send(msg)
+
+    def receive_loop(self):
+        while True:
+            try:
+                msg = self.conn.recv()
+            except (EOFError, OSError):
+                logging.info("Lost connection to the main process, exiting worker.")
+                os._exit(0)
+            if msg[0] == "execute":
+                _, item, item_id, sockets_metadata = msg
+                self.server.sockets_metadata.update(sockets_metadata)
+                self.items.put((item, item_id))
+            elif msg[0] == "interrupt":
+                nodes.interrupt_processing()
+            elif msg[0] == "flags":
+                with self.flags_lock:
+                    self.flags.update(msg[1])
+                self.items.put(None)
+
+    def get(self, timeout=None):
+        try:
+            queue_item = self.items.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if queue_item is not None:
+            item, item_id = queue_item
+            self.running[item_id] = item
+        return queue_item
+
+    def task_done(self, item_id, history_result, status, process_item=None):
+        item = self.running.pop(item_id)
+        if process_item is not None:
+            item = process_item(item)
+        self.send("done", history_result, status, item)
+
+    def get_flags(self, reset=True):
+        with self.flags_lock:
+            if reset:
+                ret = self.flags
+                self.flags = {}
+                return ret
+            return self.flags.copy()
+
+
+def connect_worker(server_instance, address):
+    """
+    Connects a worker process to the main process and routes the server's outgoing messages
+    through it. Returns a WorkerQueue to run prompt_worker on.
+    """
+    host, port, index = address.rsplit(":", 2)
+    authkey = bytes.fromhex(os.environ[AUTHKEY_ENV])
+    conn = Client((host, int(port)), authkey=authkey)
+    worker_queue = WorkerQueue(conn, server_instance)
+
+    def send_sync(event, data, sid=None):
+        worker_queue.send("send_sync", event, data, sid)
+    server_instance.send_sync = send_sync
+
+    threading.Thread(target=worker_queue.receive_loop, daemon=True).start()
+    worker_queue.send("hello", int(index))
+    return worker_queue
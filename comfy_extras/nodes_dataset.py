@@ -1,12 +1,15 @@
 import logging
+import math
 import os
 import json
+import weakref
 
 import numpy as np
 import torch
 from PIL import Image
 from typing_extensions import override
 
+import comfy.utils
 import folder_paths
 import node_helpers
 from comfy_api.latest import ComfyExtension, io
@@ -944,6 +947,145 @@ class StripWhitespaceNode(TextProcessingNode):
         return text.strip()
 
 
+# ========== Perceptual Hashing ==========
+
+HASH_METHODS = ["ahash", "phash", "dhash"]
+HASH_SIZE = 8  # 8x8 bits, packed into one 64 bit int
+PHASH_DCT_SIZE = 32
+# Largest number of elements of the images stacked into one batch (256MB of float32)
+HASH_BATCH_ELEMENTS = 1 << 26
+
+LUMA_WEIGHTS = (0.299, 0.587, 0.114)
+
+# id(image tensor) -> (weakref to it, {method: hash}), so hashing the same images again (for example
+# with another similarity threshold) skips the ones already hashed. Node outputs are not modified in
+# place, and the tensors are inference tensors that don't count in place modifications anyway.
+_image_hash_cache = {}
+
+
+def _forget_image_hashes(key, ref):
+    entry = _image_hash_cache.get(key)
+    if entry is not None and entry[0] is ref:
+        del _image_hash_cache[key]
+
+
+def _get_cached_hash(image, method):
+    entry = _image_hash_cache.get(id(image))
+    if entry is None or entry[0]() is not image:
+        return None
+    return entry[1].get(method)
+
+
+def _set_cached_hash(image, method, value):
+    key = id(image)
+    entry = _image_hash_cache.get(key)
+    if entry is None or entry[0]() is not image:
+        ref = weakref.ref(image, lambda ref, key=key: _forget_image_hashes(key, ref))
+        entry = (ref, {})
+        _image_hash_cache[key] = entry
+    entry[1][method] = value
+
+
+def _dct_matrix(n):
+    k = torch.arange(n, dtype=torch.float64)[:, None]
+    i = torch.arange(n, dtype=torch.float64)[None, :]
+    return torch.cos(math.pi * (2 * i + 1) * k / (2 * n)).float()
+
+
+def _hash_bits(gray, method):
+    """Hash bits of a batch of grayscale images (B, 1, H, W) as a (B, 64) bool tensor."""
+    if method == "dhash":
+        # Whether each pixel is brighter than its left neighbour
+        small = torch.nn.functional.interpolate(gray, size=(HASH_SIZE, HASH_SIZE + 1), mode="area")
+        bits = small[..., 1:] > small[..., :-1]
+    elif method == "phash":
+        # Whether each of the lowest frequency DCT coefficients is above their median
+        small = torch.nn.functional.interpolate(gray, size=(PHASH_DCT_SIZE, PHASH_DCT_SIZE), mode="area")
+        dct = _dct_matrix(PHASH_DCT_SIZE).to(small)
+        coefficients = (dct @ small @ dct.T)[..., :HASH_SIZE, :HASH_SIZE]
+        median = coefficients.flatten(1).median(dim=1).values
+        bits = coefficients > median[:, None, None, None]
+    else:
+        # Whether each pixel is brighter than the average
+        small = torch.nn.functional.interpolate(gray, size=(HASH_SIZE, HASH_SIZE), mode="area")
+        bits = small > small.mean(dim=(2, 3), keepdim=True)
+    return bits.flatten(1)
+
+
+def _hash_batch(batch, method):
+    """64 bit hashes of a batch of images (B, H, W, C) as a list of ints."""
+    batch = batch.float()
+    if batch.shape[-1] >= 3:
+        gray = batch[..., :3] @ torch.tensor(LUMA_WEIGHTS, device=batch.device)
+    else:
+        gray = batch.mean(dim=-1)
+    bits = _hash_bits(gray.unsqueeze(1), method).cpu().numpy()
+    return np.packbits(bits, axis=1).view(">u8")[:, 0].tolist()
+
+
+def compute_image_hashes(images, method="ahash"):
+    """Perceptual hashes (aHash, pHash or dHash) of a list of image tensors ([H, W, C] or
+    [1, H, W, C]) as 64 bit ints. Images of the same size are hashed in batches."""
+    hashes = [None] * len(images)
+    by_shape = {}
+    for i, image in enumerate(images):
+        cached = _get_cached_hash(image, method)
+        if cached is not None:
+            hashes[i] = cached
+            continue
+        pixels = image[0] if image.dim() == 4 else image
+        by_shape.setdefault(tuple(pixels.shape), []).append((i, pixels))
+
+    for shape, entries in by_shape.items():
+        batch_size = max(1, HASH_BATCH_ELEMENTS // math.prod(shape))
+        for start in range(0, len(entries), batch_size):
+            chunk = entries[start:start + batch_size]
+            batch_hashes = _hash_batch(torch.stack([pixels for _, pixels in chunk]), method)
+            for (i, _), value in zip(chunk, batch_hashes):
+                hashes[i] = value
+                _set_cached_hash(images[i], method, value)
+    return hashes
+
+
+class BKTree:
+    """BK-tree of 64 bit hashes under the Hamming distance, finds the hashes close to a query
+    without comparing it against every hash."""
+
+    def __init__(self):
+        # (hash, value, {distance: child node})
+        self.root = None
+
+    def add(self, hash_value, value):
+        node = (hash_value, value, {})
+        if self.root is None:
+            self.root = node
+            return
+        parent = self.root
+        while True:
+            distance = (parent[0] ^ hash_value).bit_count()
+            child = parent[2].get(distance)
+            if child is None:
+                parent[2][distance] = node
+                return
+            parent = child
+
+    def find(self, hash_value, max_distance):
+        """Returns (value, distance) of a hash within max_distance of hash_value, or None."""
+        if self.root is None:
+            return None
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = (node[0] ^ hash_value).bit_count()
+            if distance <= max_distance:
+                return node[1], distance
+            # Triangle inequality: only children at these distances can be within max_distance
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return None
+
+
 # ========== Group Processing Example Nodes ==========
 
 
@@ -962,52 +1104,39 @@ class ImageDeduplicationNode(ImageProcessingNode):
             max=1.0,
             tooltip="Similarity threshold (0-1). Higher means more similar. Images above this threshold are considered duplicates.",
         ),
+        io.Combo.Input(
+            "hash_method",
+            options=HASH_METHODS,
+            default="ahash",
+            optional=True,
+            tooltip="Perceptual hash to compare: ahash (average), phash (DCT, more robust to edits) or dhash (gradient).",
+        ),
     ]
 
     @classmethod
-    def _group_process(cls, images, similarity_threshold):
+    def _group_process(cls, images, similarity_threshold, hash_method="ahash"):
         """Remove duplicate images using perceptual hashing."""
         if len(images) == 0:
             return []
 
-        # Compute simple perceptual hash for each image
-        def compute_hash(img_tensor):
-            """Compute a simple perceptual hash by resizing to 8x8 and comparing to average."""
-            img = tensor_to_pil(img_tensor)
-            # Resize to 8x8
-            img_small = img.resize((8, 8), Image.Resampling.LANCZOS).convert("L")
-            # Get pixels
-            pixels = list(img_small.getdata())
-            # Compute average
-            avg = sum(pixels) / len(pixels)
-            # Create hash (1 if above average, 0 otherwise)
-            hash_bits = "".join("1" if p > avg else "0" for p in pixels)
-            return hash_bits
-
-        def hamming_distance(hash1, hash2):
-            """Compute Hamming distance between two hash strings."""
-            return sum(c1 != c2 for c1, c2 in zip(hash1, hash2))
-
-        # Compute hashes for all images
-        hashes = [compute_hash(img) for img in images]
-
-        # Find duplicates
+        hashes = compute_image_hashes(images, hash_method)
+
+        # Largest Hamming distance between the 64 bit hashes of two duplicates
+        max_distance = max(d for d in range(65) if 1.0 - (d / 64.0) >= similarity_threshold)
+
+        # Find duplicates among the images kept so far
         keep_indices = []
-        for i in range(len(images)):
-            is_duplicate = False
-            for j in keep_indices:
-                # Compare hashes
-                distance = hamming_distance(hashes[i], hashes[j])
-                similarity = 1.0 - (distance / 64.0)  # 64 bits total
-                if similarity >= similarity_threshold:
-                    is_duplicate = True
-                    logging.info(
-                        f"Image {i} is similar to image {j} (similarity: {similarity:.3f}), skipping"
-                    )
-                    break
-
-            if not is_duplicate:
-                keep_indices.append(i)
+        kept = BKTree()
+        for i, hash_value in enumerate(hashes):
+            match = kept.find(hash_value, max_distance)
+            if match is not None:
+                j, distance = match
+                logging.info(
+                    f"Image {i} is similar to image {j} (similarity: {1.0 - (distance / 64.0):.3f}), skipping"
+                )
+                continue
+            kept.add(hash_value, i)
+            keep_indices.append(i)
 
         # Return only unique images
         unique_images = [images[i] for i in keep_indices]
@@ -1307,6 +1436,224 @@ class MakeTrainingDataset(io.ComfyNode):
         return io.NodeOutput(latents_list, conditioning_list)
 
 
+# ========== Training Dataset Shards ==========
+#
+# Datasets are saved as shard_XXXX.safetensors files next to a metadata.json index. Every tensor of
+# the latent dicts and conditioning lists is stored in the shard, the structure around them (lists,
+# dicts, scalars) is kept as json in the shard metadata with the tensors replaced by their names.
+# A tensor used by several samples of a shard (e.g. one prompt embedding for the whole dataset) is
+# stored once and referenced by all of them.
+# Shards are memory-mapped when loaded, so only the samples a training step uses are read from disk.
+# Datasets saved before this format (shard_XXXX.pkl) can still be loaded.
+
+TRAINING_DATASET_FORMAT = "safetensors"
+TRAINING_DATASET_VERSION = 1
+
+
+class UnsupportedShardValue(Exception):
+    pass
+
+
+def _pack_shard_value(value, tensors, names):
+    """
+    Returns value with its tensors moved to tensors and replaced by references to them. names maps
+    the id of the tensors already in tensors to their name.
+    """
+    if isinstance(value, torch.Tensor):
+        name = names.get(id(value))
+        if name is None:
+            name = names[id(value)] = str(len(tensors))
+            tensors[name] = value
+        return {"__tensor__": name}
+    if isinstance(value, dict):
+        if not all(isinstance(k, str) for k in value):
+            raise UnsupportedShardValue(f"dict with non string keys: {list(value.keys())}")
+        return {"__dict__": {k: _pack_shard_value(v, tensors, names) for k, v in value.items()}}
+    if isinstance(value, tuple):
+        return {"__tuple__": [_pack_shard_value(v, tensors, names) for v in value]}
+    if isinstance(value, list):
+        return [_pack_shard_value(v, tensors, names) for v in value]
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    raise UnsupportedShardValue(f"value of type {type(value).__name__}")
+
+
+def _unpack_shard_value(value, tensors):
+    if isinstance(value, list):
+        return [_unpack_shard_value(v, tensors) for v in value]
+    if isinstance(value, dict):
+        if "__tensor__" in value:
+            return tensors[value["__tensor__"]]
+        if "__tuple__" in value:
+            return tuple(_unpack_shard_value(v, tensors) for v in value["__tuple__"])
+        return {k: _unpack_shard_value(v, tensors) for k, v in value["__dict__"].items()}
+    return value
+
+
+def _pack_shard(latents, conditioning):
+    tensors = {}
+    # The tensors stay referenced by tensors while packing, so their ids are not reused
+    names = {}
+    samples = [
+        {
+            "latent": _pack_shard_value(latent, tensors, names),
+            "conditioning": _pack_shard_value(cond, tensors, names),
+        }
+        for latent, cond in zip(latents, conditioning)
+    ]
+    return samples, tensors
+
+
+def _check_shard_value(value, checked):
+    """
+    Raises UnsupportedShardValue if _pack_shard_value can't store value, without packing it. checked
+    holds the ids of the containers already checked, samples often share their conditioning.
+    """
+    if value is None or isinstance(value, (bool, int, float, str, torch.Tensor)):
+        return
+    if id(value) in checked:
+        return
+    if isinstance(value, dict):
+        if not all(isinstance(k, str) for k in value):
+            raise UnsupportedShardValue(f"dict with non string keys: {list(value.keys())}")
+        values = value.values()
+    elif isinstance(value, (tuple, list)):
+        values = value
+    else:
+        raise UnsupportedShardValue(f"value of type {type(value).__name__}")
+    checked.add(id(value))
+    for v in values:
+        _check_shard_value(v, checked)
+
+
+def _can_save_safetensors_shards(latents, conditioning):
+    try:
+        # The values stay referenced by latents and conditioning, so their ids are not reused
+        checked = set()
+        _check_shard_value(latents, checked)
+        _check_shard_value(conditioning, checked)
+    except UnsupportedShardValue as e:
+        logging.warning(
+            f"The dataset contains a {e} that can not be stored in safetensors shards, saving pickle shards instead."
+        )
+        return False
+    return True
+
+
+def save_safetensors_shards(output_dir, latents, conditioning, shard_size):
+    """Saves the samples to shard_XXXX.safetensors files and returns the index for metadata.json."""
+    num_samples = len(latents)
+    num_shards = (num_samples + shard_size - 1) // shard_size
+    shards = []
+    index = []
+    buckets = {}
+    for shard_idx in range(num_shards):
+        start_idx = shard_idx * shard_size
+        end_idx = min(start_idx + shard_size, num_samples)
+        samples, tensors = _pack_shard(
+            latents[start_idx:end_idx], conditioning[start_idx:end_idx]
+        )
+        # safetensors refuses tensors that share memory, views of one batch would
+        tensors = {k: v.detach().to("cpu", copy=True).contiguous() for k, v in tensors.items()}
+
+        shard_filename = f"shard_{shard_idx:04d}.safetensors"
+        comfy.utils.save_torch_file(
+            tensors,
+            os.path.join(output_dir, shard_filename),
+            metadata={"samples": json.dumps(samples)},
+        )
+        shards.append({"file": shard_filename, "num_samples": end_idx - start_idx})
+
+        for sample_idx in range(start_idx, end_idx):
+            shape = list(latents[sample_idx]["samples"].shape)
+            index.append({"shard": shard_idx, "shape": shape})
+            buckets.setdefault(f"{shape[-2]}x{shape[-1]}", []).append(sample_idx)
+
+        logging.info(
+            f"Saved shard {shard_idx + 1}/{num_shards}: {shard_filename} ({end_idx - start_idx} samples)"
+        )
+
+    return {
+        "format": TRAINING_DATASET_FORMAT,
+        "version": TRAINING_DATASET_VERSION,
+        "shards": shards,
+        "samples": index,
+        "buckets": buckets,
+    }
+
+
+def load_safetensors_shards(dataset_dir, metadata):
+    """Loads the samples of a dataset saved by save_safetensors_shards as memory-mapped tensors."""
+    all_latents = []
+    all_conditioning = []
+    for shard in metadata["shards"]:
+        shard_path = os.path.join(dataset_dir, shard["file"])
+        tensors, shard_metadata = comfy.utils.load_safetensors(shard_path)
+        for sample in json.loads(shard_metadata["samples"]):
+            all_latents.append(_unpack_shard_value(sample["latent"], tensors))
+            all_conditioning.append(_unpack_shard_value(sample["conditioning"], tensors))
+        logging.info(f"Loaded {shard['file']}: {shard['num_samples']} samples")
+    return all_latents, all_conditioning
+
+
+def save_pickle_shards(output_dir, latents, conditioning, shard_size):
+    num_samples = len(latents)
+    num_shards = (num_samples + shard_size - 1) // shard_size  # Ceiling division
+    for shard_idx in range(num_shards):
+        start_idx = shard_idx * shard_size
+        end_idx = min(start_idx + shard_size, num_samples)
+
+        # Get shard data (list of latent dicts and conditioning lists)
+        shard_data = {
+            "latents": latents[start_idx:end_idx],
+            "conditioning": conditioning[start_idx:end_idx],
+        }
+
+        # Save shard
+        shard_filename = f"shard_{shard_idx:04d}.pkl"
+        shard_path = os.path.join(output_dir, shard_filename)
+
+        with open(shard_path, "wb") as f:
+            torch.save(shard_data, f)
+
+        logging.info(
+            f"Saved shard {shard_idx + 1}/{num_shards}: {shard_filename} ({end_idx - start_idx} samples)"
+        )
+
+
+def load_pickle_shards(dataset_dir):
+    # Find all shard files
+    shard_files = sorted(
+        [
+            f
+            for f in os.listdir(dataset_dir)
+            if f.startswith("shard_") and f.endswith(".pkl")
+        ]
+    )
+
+    if not shard_files:
+        raise ValueError(f"No shard files found in {dataset_dir}")
+
+    logging.info(f"Loading {len(shard_files)} shards from {dataset_dir}...")
+
+    # Load all shards
+    all_latents = []  # list[{"samples": tensor}]
+    all_conditioning = []  # list[list[cond]]
+
+    for shard_file in shard_files:
+        shard_path = os.path.join(dataset_dir, shard_file)
+
+        with open(shard_path, "rb") as f:
+            shard_data = torch.load(f)
+
+        all_latents.extend(shard_data["latents"])
+        all_conditioning.extend(shard_data["conditioning"])
+
+        logging.info(f"Loaded {shard_file}: {len(shard_data['latents'])} samples")
+
+    return all_latents, all_conditioning
+
+
 class SaveTrainingDataset(io.ComfyNode):
     """Save encoded training dataset (latents + conditioning) to disk."""
     @classmethod
@@ -1373,33 +1720,17 @@ class SaveTrainingDataset(io.ComfyNode):
         )
 
         # Save data in shards
-        for shard_idx in range(num_shards):
-            start_idx = shard_idx * shard_size
-            end_idx = min(start_idx + shard_size, num_samples)
-
-            # Get shard data (list of latent dicts and conditioning lists)
-            shard_data = {
-                "latents": latents[start_idx:end_idx],
-                "conditioning": conditioning[start_idx:end_idx],
-            }
-
-            # Save shard
-            shard_filename = f"shard_{shard_idx:04d}.pkl"
-            shard_path = os.path.join(output_dir, shard_filename)
-
-            with open(shard_path, "wb") as f:
-                torch.save(shard_data, f)
-
-            logging.info(
-                f"Saved shard {shard_idx + 1}/{num_shards}: {shard_filename} ({end_idx - start_idx} samples)"
-            )
-
-        # Save metadata
         metadata = {
             "num_samples": num_samples,
             "num_shards": num_shards,
             "shard_size": shard_size,
         }
+        if _can_save_safetensors_shards(latents, conditioning):
+            metadata.update(save_safetensors_shards(output_dir, latents, conditioning, shard_size))
+        else:
+            save_pickle_shards(output_dir, latents, conditioning, shard_size)
+
+        # Save metadata
         metadata_path = os.path.join(output_dir, "metadata.json")
         with open(metadata_path, "w") as f:
             json.dump(metadata, f, indent=2)
@@ -1447,34 +1778,17 @@ class LoadTrainingDataset(io.ComfyNode):
         if not os.path.exists(dataset_dir):
             raise ValueError(f"Dataset directory not found: {dataset_dir}")
 
-        # Find all shard files
-        shard_files = sorted(
-            [
-                f
-                for f in os.listdir(dataset_dir)
-                if f.startswith("shard_") and f.endswith(".pkl")
-            ]
-        )
-
-        if not shard_files:
-            raise ValueError(f"No shard files found in {dataset_dir}")
-
-        logging.info(f"Loading {len(shard_files)} shards from {dataset_dir}...")
-
-        # Load all shards
-        all_latents = []  # list[{"samples": tensor}]
-        all_conditioning = []  # list[list[cond]]
+        metadata = {}
+        metadata_path = os.path.join(dataset_dir, "metadata.json")
+        if os.path.exists(metadata_path):
+            with open(metadata_path, "r") as f:
+                metadata = json.load(f)
 
-        for shard_file in shard_files:
-            shard_path = os.path.join(dataset_dir, shard_file)
-
-            with open(shard_path, "rb") as f:
-                shard_data = torch.load(f)
-
-            all_latents.extend(shard_data["latents"])
-            all_conditioning.extend(shard_data["conditioning"])
-
-            logging.info(f"Loaded {shard_file}: {len(shard_data['latents'])} samples")
+        if metadata.get("format") == TRAINING_DATASET_FORMAT:
+            logging.info(f"Loading {len(metadata['shards'])} shards from {dataset_dir}...")
+            all_latents, all_conditioning = load_safetensors_shards(dataset_dir, metadata)
+        else:
+            all_latents, all_conditioning = load_pickle_shards(dataset_dir)
 
         logging.info(
             f"Successfully loaded {len(all_latents)} samples from {dataset_dir}."
@@ -351,6 +351,7 @@ class GrowMask(IO.ComfyNode):
                 IO.Boolean.Input("tapered_corners", default=True),
             ],
             outputs=[IO.Mask.Output()],
+            device_affinity="cpu",
         )
 
     @classmethod
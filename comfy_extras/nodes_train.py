@@ -226,7 +226,7 @@ class TrainSampler(comfy.samplers.Sampler):
         # Convert to absolute indices for fwd_bwd (cond is flattened, use absolute index)
         absolute_indices = [bucket_offset + idx for idx in relative_indices]
 
-        batch_latent = bucket_latent[relative_indices].to(latent_image)  # (actual_batch_size, C, H, W)
+        batch_latent = bucket_latent[relative_indices].to(self.training_dtype).to(latent_image)  # (actual_batch_size, C, H, W)
         batch_noise = noisegen.generate_noise({"samples": batch_latent}).to(
             batch_latent.device
         )
@@ -276,7 +276,7 @@ class TrainSampler(comfy.samplers.Sampler):
         indicies = torch.randperm(dataset_size)[: self.batch_size].tolist()
         total_loss = 0
         for index in indicies:
-            single_latent = self.real_dataset[index].to(latent_image)
+            single_latent = self.real_dataset[index].to(self.training_dtype).to(latent_image)
             batch_noise = noisegen.generate_noise(
                 {"samples": single_latent}
             ).to(single_latent.device)
@@ -489,6 +489,9 @@ def _process_conditioning(positive):
 def _prepare_latents_and_count(latents, dtype, bucket_mode):
     """Convert latents to dtype and compute image counts.
 
+    Bucket and multi-resolution latents are left as they are and converted one batch at a time by
+    the sampler, so memory-mapped datasets (LoadTrainingDataset) are not read into memory at once.
+
     Args:
         latents: Latents (tensor, list of tensors, or bucket list)
         dtype: Target dtype
@@ -499,7 +502,6 @@ def _prepare_latents_and_count(latents, dtype, bucket_mode):
     """
     if bucket_mode:
         # In bucket mode, latents is list of tensors (Bi, C, Hi, Wi)
-        latents = [t.to(dtype) for t in latents]
         num_buckets = len(latents)
         num_images = sum(t.shape[0] for t in latents)
         multi_res = False  # Not using multi_res path in bucket mode
@@ -512,7 +514,6 @@ def _prepare_latents_and_count(latents, dtype, bucket_mode):
     # Non-bucket mode
     if isinstance(latents, list):
         all_shapes = set()
-        latents = [t.to(dtype) for t in latents]
         for latent in latents:
             all_shapes.add(latent.shape)
         logging.debug(f"Latent shapes: {all_shapes}")
@@ -520,7 +521,7 @@ def _prepare_latents_and_count(latents, dtype, bucket_mode):
             multi_res = True
         else:
             multi_res = False
-            latents = torch.cat(latents, dim=0)
+            latents = torch.cat(latents, dim=0).to(dtype)
         num_images = len(latents)
     elif isinstance(latents, torch.Tensor):
         latents = latents.to(dtype)
@@ -812,7 +813,7 @@ def _run_training_loop(
 
     if bucket_mode:
         # Use first bucket's first latent as dummy for guider
-        dummy_latent = latents[0][:1].repeat(num_images, 1, 1, 1)
+        dummy_latent = latents[0][:1].to(train_sampler.training_dtype).repeat(num_images, 1, 1, 1)
         guider.sample(
             noise.generate_noise({"samples": dummy_latent}),
             dummy_latent,
@@ -822,7 +823,7 @@ def _run_training_loop(
         )
     elif multi_res:
         # use first latent as dummy latent if multi_res
-        latents = latents[0].repeat(num_images, 1, 1, 1)
+        latents = latents[0].to(train_sampler.training_dtype).repeat(num_images, 1, 1, 1)
         guider.sample(
             noise.generate_noise({"samples": latents}),
             latents,
@@ -67,8 +67,9 @@ class ImageUpscaleWithModel(io.ComfyNode):
     def execute(cls, upscale_model, image) -> io.NodeOutput:
         device = model_management.get_torch_device()
 
+        memory_tile = (512 * 512 * 3) * image.element_size() * max(upscale_model.scale, 1.0) * 384.0 #The 384.0 is an estimate of how much some of these models take, TODO: make it more accurate
         memory_required = model_management.module_size(upscale_model.model)
-        memory_required += (512 * 512 * 3) * image.element_size() * max(upscale_model.scale, 1.0) * 384.0 #The 384.0 is an estimate of how much some of these models take, TODO: make it more accurate
+        memory_required += memory_tile
         memory_required += image.nelement() * image.element_size()
         model_management.free_memory(memory_required, device)
 
@@ -77,6 +78,7 @@ class ImageUpscaleWithModel(io.ComfyNode):
 
         tile = 512
         overlap = 32
+        tile_batch_size = comfy.utils.get_tile_batch_size(model_management.get_free_memory(device), memory_tile)
 
         oom = True
         try:
@@ -84,9 +86,12 @@ class ImageUpscaleWithModel(io.ComfyNode):
                 try:
                     steps = in_img.shape[0] * comfy.utils.get_tiled_scale_steps(in_img.shape[3], in_img.shape[2], tile_x=tile, tile_y=tile, overlap=overlap)
                     pbar = comfy.utils.ProgressBar(steps)
-                    s = comfy.utils.tiled_scale(in_img, lambda a: upscale_model(a), tile_x=tile, tile_y=tile, overlap=overlap, upscale_amount=upscale_model.scale, pbar=pbar)
+                    s = comfy.utils.tiled_scale(in_img, lambda a: upscale_model(a), tile_x=tile, tile_y=tile, overlap=overlap, upscale_amount=upscale_model.scale, pbar=pbar, tile_batch_size=tile_batch_size)
                     oom = False
                 except model_management.OOM_EXCEPTION as e:
+                    if tile_batch_size > 1:
+                        tile_batch_size //= 2
+                        continue
                     tile //= 2
                     if tile < 128:
                         raise e
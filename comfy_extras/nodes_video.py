@@ -2,13 +2,13 @@ from __future__ import annotations
 
 import os
 import av
-import torch
 import folder_paths
 import json
 from typing import Optional
 from typing_extensions import override
 from fractions import Fraction
 from comfy_api.latest import ComfyExtension, io, ui, Input, InputImpl, Types
+from comfy_api.latest._input_impl.video_types import encode_video_frames
 from comfy.cli_args import args
 
 class SaveWEBM(io.ComfyNode):
@@ -33,7 +33,7 @@ class SaveWEBM(io.ComfyNode):
     @classmethod
     def execute(cls, images, codec, fps, filename_prefix, crf) -> io.NodeOutput:
         full_output_folder, filename, counter, subfolder, filename_prefix = folder_paths.get_save_image_path(
-            filename_prefix, folder_paths.get_output_directory(), images[0].shape[1], images[0].shape[0]
+            filename_prefix, folder_paths.get_output_directory(), images[0].shape[1], images[0].shape[0], count=1, extension="webm"
         )
 
         file = f"{filename}_{counter:05}_.webm"
@@ -55,13 +55,13 @@ class SaveWEBM(io.ComfyNode):
         stream.options = {'crf': str(crf)}
         if codec == "av1":
             stream.options["preset"] = "6"
+        else:
+            stream.options["row-mt"] = "1"
 
-        for frame in images:
-            frame = av.VideoFrame.from_ndarray(torch.clamp(frame[..., :3] * 255, min=0, max=255).to(device=torch.device("cpu"), dtype=torch.uint8).numpy(), format="rgb24")
-            for packet in stream.encode(frame):
-                container.mux(packet)
-        container.mux(stream.encode())
-        container.close()
+        try:
+            encode_video_frames(container, stream, images)
+        finally:
+            container.close()
 
         return io.NodeOutput(ui=ui.PreviewVideo([ui.SavedResult(file, subfolder, io.FolderType.output)]))
 
@@ -91,7 +91,9 @@ class SaveVideo(io.ComfyNode):
             filename_prefix,
             folder_paths.get_output_directory(),
             width,
-            height
+            height,
+            count=1,
+            extension=Types.VideoContainer.get_extension(format),
         )
         saved_metadata = None
         if not args.disable_metadata:
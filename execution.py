@@ -1,4 +1,3 @@
-import copy
 import heapq
 import inspect
 import logging
@@ -9,30 +8,40 @@ import traceback
 from enum import Enum
 from typing import List, Literal, NamedTuple, Optional, Union
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import nullcontext
 
 import torch
 
 import comfy.memory_management
+import comfy.metrics
 import comfy.model_management
+import comfy.model_prefetch
+import comfy.profiler
 from latent_preview import set_preview_method
 import nodes
 from comfy_execution.caching import (
     BasicCache,
+    CacheEntry,
     CacheKeySetID,
     CacheKeySetInputSignature,
+    DiskTieredCache,
     NullCache,
     HierarchicalCache,
     LRUCache,
     RAMPressureCache,
+    get_disk_cache,
 )
 from comfy_execution.graph import (
     DynamicPrompt,
     ExecutionBlocker,
     ExecutionList,
     get_input_info,
+    is_cpu_affine,
 )
+from comfy_execution import sampler_batching
 from comfy_execution.graph_utils import GraphBuilder, is_link
+from comfy_execution.jobs import get_all_jobs
 from comfy_execution.validation import validate_node_input
 from comfy_execution.progress import get_progress_state, reset_progress_state, add_progress_handler, WebUIProgressHandler
 from comfy_execution.utils import CurrentNodeContext
@@ -92,11 +101,6 @@ class IsChangedCache:
         return self.is_changed[node_id]
 
 
-class CacheEntry(NamedTuple):
-    ui: dict
-    outputs: list
-
-
 class CacheType(Enum):
     CLASSIC = 0
     LRU = 1
@@ -120,6 +124,11 @@ class CacheSet:
         else:
             self.init_classic_cache()
 
+        cache_disk = (cache_args or {}).get("disk", 0)
+        if cache_disk > 0 and cache_type != CacheType.NONE:
+            self.init_disk_cache(cache_args.get("disk_directory"), cache_disk)
+            logging.info("Using disk cache with a size limit of {:.1f} GB.".format(cache_disk))
+
         self.all = [self.outputs, self.objects]
 
     # Performs like the old cache -- dump data ASAP
@@ -139,6 +148,11 @@ class CacheSet:
         self.outputs = NullCache()
         self.objects = NullCache()
 
+    # Persistent L2 behind whichever RAM cache is in use
+    def init_disk_cache(self, directory, max_size_gb):
+        disk_cache = get_disk_cache(directory, int(max_size_gb * (1024 ** 3)))
+        self.outputs = DiskTieredCache(self.outputs, disk_cache)
+
     def recursive_debug_dump(self):
         result = {
             "outputs": self.outputs.recursive_debug_dump(),
@@ -227,7 +241,19 @@ async def resolve_map_node_over_list_results(results):
                 raise exc
         return [x.result() if isinstance(x, asyncio.Task) else x for x in results]
 
-async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, func, allow_interrupt=False, execution_block_cb=None, pre_execute_cb=None, v3_data=None):
+async def _run_in_cpu_pool(cpu_pool, f, prompt_id, unique_id, list_index, args):
+    def run():
+        # inference_mode is thread local
+        with torch.inference_mode(), CurrentNodeContext(prompt_id, unique_id, list_index):
+            # The wall time is recorded by execute, only the CPU time of this thread is added here
+            started = comfy.profiler.thread_cpu_start()
+            try:
+                return f(**args)
+            finally:
+                comfy.profiler.thread_cpu_end(started, unique_id)
+    return await asyncio.get_running_loop().run_in_executor(cpu_pool, run)
+
+async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, func, allow_interrupt=False, execution_block_cb=None, pre_execute_cb=None, v3_data=None, cpu_pool=None):
     # check if node wants the lists
     input_is_list = getattr(obj, "INPUT_IS_LIST", False)
 
@@ -288,6 +314,10 @@ async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, f
                     results.append(result)
                 else:
                     results.append(task)
+            elif cpu_pool is not None:
+                # Picked up through the same pending path as async nodes
+                task = asyncio.create_task(_run_in_cpu_pool(cpu_pool, f, prompt_id, unique_id, index, inputs))
+                results.append(task)
             else:
                 with CurrentNodeContext(prompt_id, unique_id, index):
                     result = f(**inputs)
@@ -327,8 +357,8 @@ def merge_result_data(results, obj):
             output.append([o[i] for o in results])
     return output
 
-async def get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=None, pre_execute_cb=None, v3_data=None):
-    return_values = await _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, obj.FUNCTION, allow_interrupt=True, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, v3_data=v3_data)
+async def get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=None, pre_execute_cb=None, v3_data=None, cpu_pool=None):
+    return_values = await _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, obj.FUNCTION, allow_interrupt=True, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, v3_data=v3_data, cpu_pool=cpu_pool)
     has_pending_task = any(isinstance(r, asyncio.Task) and not r.done() for r in return_values)
     if has_pending_task:
         return return_values, {}, False, has_pending_task
@@ -408,7 +438,7 @@ def format_value(x):
     else:
         return str(x)
 
-async def execute(server, dynprompt, caches, current_item, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes, ui_outputs):
+async def execute(server, dynprompt, caches, current_item, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes, ui_outputs, cpu_pool=None):
     unique_id = current_item
     real_node_id = dynprompt.get_real_node_id(unique_id)
     display_node_id = dynprompt.get_display_node_id(unique_id)
@@ -423,6 +453,8 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
             server.send_sync("executed", { "node": unique_id, "display_node": display_node_id, "output": cached_ui.get("output",None), "prompt_id": prompt_id }, server.client_id)
             if cached.ui is not None:
                 ui_outputs[unique_id] = cached.ui
+        comfy.profiler.node_cached(unique_id, class_type)
+        comfy.metrics.CACHE_LOOKUPS.inc(1, "outputs", "hit")
         get_progress_state().finish_progress(unique_id)
         execution_list.cache_update(unique_id, cached)
         return (ExecutionResult.SUCCESS, None, None)
@@ -472,10 +504,14 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
                 server.last_node_id = display_node_id
                 server.send_sync("executing", { "node": unique_id, "display_node": display_node_id, "prompt_id": prompt_id }, server.client_id)
 
+            comfy.metrics.CACHE_LOOKUPS.inc(1, "outputs", "miss")
             obj = caches.objects.get(unique_id)
             if obj is None:
+                comfy.metrics.CACHE_LOOKUPS.inc(1, "objects", "miss")
                 obj = class_def()
                 caches.objects.set(unique_id, obj)
+            else:
+                comfy.metrics.CACHE_LOOKUPS.inc(1, "objects", "hit")
 
             if issubclass(class_def, _ComfyNodeInternal):
                 lazy_status_present = first_real_override(class_def, "check_lazy_status") is not None
@@ -518,14 +554,27 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
                 # TODO - How to handle this with async functions without contextvars (which requires Python 3.12)?
                 GraphBuilder.set_default_prefix(unique_id, call_index, 0)
 
+            if cpu_pool is not None and not is_cpu_affine(class_def):
+                cpu_pool = None
+
             #Do comfy_aimdo mempool chunking here on the per-node level. Multi-model workflows
             #will cause all sorts of incompatible memory shapes to fragment the pytorch alloc
             #that we just want to cull out each model run.
             allocator = comfy.memory_management.aimdo_allocator
             with nullcontext() if allocator is None else torch.cuda.use_mem_pool(torch.cuda.MemPool(allocator.allocator())):
+                # With the CPU pool the executor thread runs other coroutines while it waits
+                started = comfy.profiler.node_start(cpu=cpu_pool is None)
+                start_time = time.perf_counter()
                 try:
-                    output_data, output_ui, has_subgraph, has_pending_tasks = await get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, v3_data=v3_data)
+                    output = None
+                    if sampler_batching.batcher is not None and class_type in sampler_batching.BATCHED_NODES:
+                        output = await sampler_batching.batcher.sample(server, dynprompt, caches, prompt_id, unique_id, input_data_all)
+                    if output is None:
+                        output = await get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, v3_data=v3_data, cpu_pool=cpu_pool)
+                    output_data, output_ui, has_subgraph, has_pending_tasks = output
                 finally:
+                    comfy.profiler.node_end(started, unique_id, class_type)
+                    comfy.metrics.NODE_SECONDS.observe(time.perf_counter() - start_time, class_type)
                     if allocator is not None:
                         comfy.model_management.reset_cast_buffers()
                         torch.cuda.synchronize()
@@ -635,10 +684,14 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
     return (ExecutionResult.SUCCESS, None, None)
 
 class PromptExecutor:
-    def __init__(self, server, cache_type=False, cache_args=None):
+    def __init__(self, server, cache_type=False, cache_args=None, cpu_threads=0):
         self.cache_args = cache_args
         self.cache_type = cache_type
         self.server = server
+        # Worker threads for nodes with DEVICE_AFFINITY = "cpu", lets independent branches overlap
+        self.cpu_pool = None
+        if cpu_threads > 0:
+            self.cpu_pool = ThreadPoolExecutor(max_workers=cpu_threads, thread_name_prefix="cpu_node")
         self.reset()
 
     def reset(self):
@@ -698,67 +751,80 @@ class PromptExecutor:
 
         self.status_messages = []
         self.add_message("execution_start", { "prompt_id": prompt_id}, broadcast=False)
+        comfy.profiler.start(prompt_id)
 
-        with torch.inference_mode():
-            dynamic_prompt = DynamicPrompt(prompt)
-            reset_progress_state(prompt_id, dynamic_prompt)
-            add_progress_handler(WebUIProgressHandler(self.server))
-            is_changed_cache = IsChangedCache(prompt_id, dynamic_prompt, self.caches.outputs)
-            for cache in self.caches.all:
-                await cache.set_prompt(dynamic_prompt, prompt.keys(), is_changed_cache)
-                cache.clean_unused()
-
-            cached_nodes = []
-            for node_id in prompt:
-                if self.caches.outputs.get(node_id) is not None:
-                    cached_nodes.append(node_id)
-
-            comfy.model_management.cleanup_models_gc()
-            self.add_message("execution_cached",
-                          { "nodes": cached_nodes, "prompt_id": prompt_id},
-                          broadcast=False)
-            pending_subgraph_results = {}
-            pending_async_nodes = {} # TODO - Unify this with pending_subgraph_results
-            ui_node_outputs = {}
-            executed = set()
-            execution_list = ExecutionList(dynamic_prompt, self.caches.outputs)
-            current_outputs = self.caches.outputs.all_node_ids()
-            for node_id in list(execute_outputs):
-                execution_list.add_node(node_id)
-
-            while not execution_list.is_empty():
-                node_id, error, ex = await execution_list.stage_node_execution()
-                if error is not None:
-                    self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
-                    break
+        try:
+            with torch.inference_mode():
+                dynamic_prompt = DynamicPrompt(prompt)
+                reset_progress_state(prompt_id, dynamic_prompt)
+                add_progress_handler(WebUIProgressHandler(self.server))
+                is_changed_cache = IsChangedCache(prompt_id, dynamic_prompt, self.caches.outputs)
+                for cache in self.caches.all:
+                    await cache.set_prompt(dynamic_prompt, prompt.keys(), is_changed_cache)
+                    cache.clean_unused()
+                if sampler_batching.batcher is not None:
+                    sampler_batching.batcher.restore(prompt_id, self.caches.outputs)
+
+                cached_nodes = []
+                for node_id in prompt:
+                    if self.caches.outputs.get(node_id) is not None:
+                        cached_nodes.append(node_id)
+                        comfy.profiler.node_cached(node_id, prompt[node_id]["class_type"])
+
+                comfy.model_management.cleanup_models_gc()
+                self.add_message("execution_cached",
+                              { "nodes": cached_nodes, "prompt_id": prompt_id},
+                              broadcast=False)
+                pending_subgraph_results = {}
+                pending_async_nodes = {} # TODO - Unify this with pending_subgraph_results
+                ui_node_outputs = {}
+                executed = set()
+                execution_list = ExecutionList(dynamic_prompt, self.caches.outputs, dispatch_cpu_nodes=self.cpu_pool is not None)
+                current_outputs = self.caches.outputs.all_node_ids()
+                for node_id in list(execute_outputs):
+                    execution_list.add_node(node_id)
+
+                while not execution_list.is_empty():
+                    node_id, error, ex = await execution_list.stage_node_execution()
+                    if error is not None:
+                        self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
+                        break
 
-                assert node_id is not None, "Node ID should not be None at this point"
-                result, error, ex = await execute(self.server, dynamic_prompt, self.caches, node_id, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes, ui_node_outputs)
-                self.success = result != ExecutionResult.FAILURE
-                if result == ExecutionResult.FAILURE:
-                    self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
-                    break
-                elif result == ExecutionResult.PENDING:
-                    execution_list.unstage_node_execution()
-                else: # result == ExecutionResult.SUCCESS:
-                    execution_list.complete_node_execution()
-                self.caches.outputs.poll(ram_headroom=self.cache_args["ram"])
-            else:
-                # Only execute when the while-loop ends without break
-                self.add_message("execution_success", { "prompt_id": prompt_id }, broadcast=False)
-
-            ui_outputs = {}
-            meta_outputs = {}
-            for node_id, ui_info in ui_node_outputs.items():
-                ui_outputs[node_id] = ui_info["output"]
-                meta_outputs[node_id] = ui_info["meta"]
-            self.history_result = {
-                "outputs": ui_outputs,
-                "meta": meta_outputs,
-            }
-            self.server.last_node_id = None
-            if comfy.model_management.DISABLE_SMART_MEMORY:
-                comfy.model_management.unload_all_models()
+                    assert node_id is not None, "Node ID should not be None at this point"
+                    result, error, ex = await execute(self.server, dynamic_prompt, self.caches, node_id, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes, ui_node_outputs, cpu_pool=self.cpu_pool)
+                    self.success = result != ExecutionResult.FAILURE
+                    if result == ExecutionResult.FAILURE:
+                        self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
+                        break
+                    elif result == ExecutionResult.PENDING:
+                        execution_list.unstage_node_execution()
+                    else: # result == ExecutionResult.SUCCESS:
+                        execution_list.complete_node_execution()
+                    self.caches.outputs.poll(ram_headroom=self.cache_args["ram"])
+                else:
+                    # Only execute when the while-loop ends without break
+                    self.add_message("execution_success", { "prompt_id": prompt_id }, broadcast=False)
+
+                ui_outputs = {}
+                meta_outputs = {}
+                for node_id, ui_info in ui_node_outputs.items():
+                    ui_outputs[node_id] = ui_info["output"]
+                    meta_outputs[node_id] = ui_info["meta"]
+                self.history_result = {
+                    "outputs": ui_outputs,
+                    "meta": meta_outputs,
+                }
+                profile = comfy.profiler.finish()
+                if profile is not None:
+                    self.history_result["profile"] = profile
+                comfy.metrics.CACHE_ENTRIES.set(self.caches.outputs.entry_count(), "outputs")
+                comfy.metrics.CACHE_ENTRIES.set(self.caches.objects.entry_count(), "objects")
+                self.server.last_node_id = None
+                if comfy.model_management.DISABLE_SMART_MEMORY:
+                    comfy.model_management.unload_all_models()
+        finally:
+            # Stops profiling when the prompt fails too, so later spans don't go to its profile
+            comfy.profiler.finish()
 
 
 async def validate_inputs(prompt_id, prompt, item, validated):
@@ -1132,35 +1198,133 @@ async def validate_prompt(prompt_id, prompt, partial_execution_list: Union[list[
     return (True, None, list(good_outputs), node_errors)
 
 MAXIMUM_HISTORY_SIZE = 10000
+# Profiles are kept in memory only, for the most recent prompts
+MAXIMUM_PROFILES = 500
+
+class QueueItem(NamedTuple):
+    """
+    A queued prompt. Queue items are shared between the queue, the running list, snapshots and the
+    history without being copied, so neither the item nor the prompt and extra_data it holds may be
+    modified after it is queued.
+    """
+    number: Union[int, float]
+    prompt_id: str
+    prompt: dict
+    extra_data: dict
+    outputs_to_execute: list
+    sensitive: dict
 
 class PromptQueue:
+    """
+    The queued prompts are a heap of [number, sequence, item] entries with an index from prompt_id to
+    entry. Deleting or reprioritizing a prompt marks its entry as removed (item None) instead of searching
+    and reordering the heap, removed entries are skipped when they reach the top and dropped when they
+    outnumber the queued prompts.
+    """
     def __init__(self, server):
         self.server = server
         self.mutex = threading.RLock()
         self.not_empty = threading.Condition(self.mutex)
         self.task_counter = 0
         self.queue = []
+        # prompt_id -> heap entry of the queued prompts
+        self.queued = {}
+        # breaks ties between prompts with the same number in the order they were queued
+        self.sequence = 0
         self.currently_running = {}
+        # (running, queued) tuples returned to readers until the queue changes
+        self.snapshot = None
         self.history = {}
+        self.history_store = None
+        # prompt_id -> comfy.profiler profile
+        self.profiles = {}
         self.flags = {}
 
+    def set_history_store(self, history_store):
+        """
+        Keep the history in history_store (an app.history_store.HistoryStore) instead of in memory.
+        """
+        with self.mutex:
+            self.history_store = history_store
+
+    def _push(self, item):
+        """
+        Queues item, replacing the queued prompt with the same prompt_id. Called with the mutex held.
+        """
+        self._remove(item.prompt_id)
+        entry = [item.number, self.sequence, item]
+        self.sequence += 1
+        self.queued[item.prompt_id] = entry
+        heapq.heappush(self.queue, entry)
+
+    def _remove(self, prompt_id):
+        """
+        Removes the queued prompt prompt_id and returns its item, or None. Called with the mutex held.
+        """
+        entry = self.queued.pop(prompt_id, None)
+        if entry is None:
+            return None
+        item = entry[2]
+        entry[2] = None
+        if len(self.queue) > 2 * len(self.queued) + 64:
+            self.queue = [e for e in self.queue if e[2] is not None]
+            heapq.heapify(self.queue)
+        return item
+
+    def _pop(self):
+        """
+        Removes the first queued prompt and returns its entry. Called with the mutex held.
+        """
+        while len(self.queue) > 0:
+            entry = heapq.heappop(self.queue)
+            if entry[2] is not None:
+                del self.queued[entry[2].prompt_id]
+                return entry
+        return None
+
+    def _changed(self):
+        self.snapshot = None
+        self.server.queue_updated()
+
     def put(self, item):
+        if not isinstance(item, QueueItem):
+            item = QueueItem(*item)
         with self.mutex:
-            heapq.heappush(self.queue, item)
-            self.server.queue_updated()
+            self._push(item)
+            self._changed()
             self.not_empty.notify()
 
-    def get(self, timeout=None):
+    def get(self, timeout=None, preference=None, lookahead=1):
         with self.not_empty:
-            while len(self.queue) == 0:
+            while len(self.queued) == 0:
                 self.not_empty.wait(timeout=timeout)
-                if timeout is not None and len(self.queue) == 0:
+                if timeout is not None and len(self.queued) == 0:
                     return None
-            item = heapq.heappop(self.queue)
+            item = None
+            if preference is not None and lookahead > 1:
+                # Take the first of the next few items the caller prefers (e.g. already has its models loaded)
+                candidates = []
+                while len(candidates) < lookahead and len(self.queued) > 0:
+                    candidates.append(self._pop())
+                try:
+                    for entry in candidates:
+                        if preference(entry[2]):
+                            item = entry[2]
+                            break
+                finally:
+                    for entry in candidates:
+                        if entry[2] is not item:
+                            self.queued[entry[2].prompt_id] = entry
+                            heapq.heappush(self.queue, entry)
+            if item is None:
+                item = self._pop()[2]
+            create_time = item.extra_data.get("create_time")
+            if create_time is not None:
+                comfy.metrics.QUEUE_WAIT_SECONDS.observe(max(0.0, time.time() - create_time / 1000))
             i = self.task_counter
-            self.currently_running[i] = copy.deepcopy(item)
+            self.currently_running[i] = item
             self.task_counter += 1
-            self.server.queue_updated()
+            self._changed()
             return (item, i)
 
     class ExecutionStatus(NamedTuple):
@@ -1172,62 +1336,153 @@ class PromptQueue:
                   status: Optional['PromptQueue.ExecutionStatus'], process_item=None):
         with self.mutex:
             prompt = self.currently_running.pop(item_id)
-            if len(self.history) > MAXIMUM_HISTORY_SIZE:
+            self.snapshot = None
+            if self.history_store is None and len(self.history) > MAXIMUM_HISTORY_SIZE:
                 self.history.pop(next(iter(self.history)))
 
             status_dict: Optional[dict] = None
             if status is not None:
-                status_dict = copy.deepcopy(status._asdict())
+                status_dict = status._asdict()
 
             if process_item is not None:
                 prompt = process_item(prompt)
 
-            self.history[prompt[1]] = {
+            if "profile" in history_result:
+                history_result = history_result.copy()
+                self.profiles[prompt[1]] = history_result.pop("profile")
+                if len(self.profiles) > MAXIMUM_PROFILES:
+                    self.profiles.pop(next(iter(self.profiles)))
+
+            history_item = {
                 "prompt": prompt,
                 "outputs": {},
                 'status': status_dict,
             }
-            self.history[prompt[1]].update(history_result)
-            self.server.queue_updated()
+            history_item.update(history_result)
+            history_store = self.history_store
+            if history_store is None:
+                self.history[prompt[1]] = history_item
+                self.server.queue_updated()
+                return
+
+        # Written without holding the mutex so the queue is not blocked on the database
+        try:
+            history_store.add(prompt[1], history_item)
+        except Exception:
+            logging.exception("Failed to store history for prompt {}".format(prompt[1]))
+        self.server.queue_updated()
 
-    # Note: slow
     def get_current_queue(self):
+        """
+        Returns (running, queued) tuples of queue items. The queued items are in heap order, not sorted.
+        The tuples are shared between callers until the queue changes and must not be modified.
+        """
         with self.mutex:
-            out = []
-            for x in self.currently_running.values():
-                out += [x]
-            return (out, copy.deepcopy(self.queue))
+            if self.snapshot is None:
+                self.snapshot = (tuple(self.currently_running.values()), tuple(e[2] for e in self.queue if e[2] is not None))
+            return self.snapshot
 
-    # read-safe as long as queue items are immutable
+    # Kept for compatibility, snapshots are always safe to read
     def get_current_queue_volatile(self):
-        with self.mutex:
-            running = [x for x in self.currently_running.values()]
-            queued = copy.copy(self.queue)
-            return (running, queued)
+        return self.get_current_queue()
 
     def get_tasks_remaining(self):
         with self.mutex:
-            return len(self.queue) + len(self.currently_running)
+            return len(self.queued) + len(self.currently_running)
+
+    def get_queue_depth(self):
+        """
+        Returns the number of pending and of running prompts.
+        """
+        with self.mutex:
+            return len(self.queued), len(self.currently_running)
+
+    def get_queue_item(self, prompt_id):
+        """
+        Returns the queued item of prompt_id, or None if it is not queued.
+        """
+        with self.mutex:
+            entry = self.queued.get(prompt_id)
+            return None if entry is None else entry[2]
 
     def wipe_queue(self):
         with self.mutex:
+            wiped = list(self.queued)
             self.queue = []
-            self.server.queue_updated()
+            self.queued = {}
+            self._changed()
+        comfy.model_prefetch.cancel_prefetch(wiped)
+        sampler_batching.discard_results(wiped)
 
     def delete_queue_item(self, function):
         with self.mutex:
-            for x in range(len(self.queue)):
-                if function(self.queue[x]):
-                    if len(self.queue) == 1:
-                        self.wipe_queue()
-                    else:
-                        self.queue.pop(x)
-                        heapq.heapify(self.queue)
-                    self.server.queue_updated()
-                    return True
-        return False
+            for entry in self.queue:
+                if entry[2] is not None and function(entry[2]):
+                    prompt_id = entry[2].prompt_id
+                    self._remove(prompt_id)
+                    self._changed()
+                    break
+            else:
+                return False
+        comfy.model_prefetch.cancel_prefetch([prompt_id])
+        sampler_batching.discard_results([prompt_id])
+        return True
+
+    def delete_queue_items(self, prompt_ids):
+        """
+        Removes the queued prompts in prompt_ids. Returns the ids that were queued.
+        """
+        with self.mutex:
+            deleted = [prompt_id for prompt_id in prompt_ids if self._remove(prompt_id) is not None]
+            if len(deleted) > 0:
+                self._changed()
+        comfy.model_prefetch.cancel_prefetch(deleted)
+        sampler_batching.discard_results(deleted)
+        return deleted
+
+    def set_priorities(self, numbers):
+        """
+        Changes the number (lower runs first) of queued prompts, numbers maps prompt_id to the new number.
+        Returns the ids that were queued.
+        """
+        with self.mutex:
+            changed = []
+            for prompt_id, number in numbers.items():
+                entry = self.queued.get(prompt_id)
+                if entry is None:
+                    continue
+                if entry[0] != number:
+                    self._push(entry[2]._replace(number=number))
+                changed.append(prompt_id)
+            if len(changed) > 0:
+                self._changed()
+            return changed
+
+    def move_to_front(self, prompt_ids):
+        """
+        Moves queued prompts ahead of all the others, keeping the order of prompt_ids. Returns the ids
+        that were queued.
+        """
+        with self.mutex:
+            prompt_ids = [prompt_id for prompt_id in dict.fromkeys(prompt_ids) if prompt_id in self.queued]
+            if len(prompt_ids) == 0:
+                return []
+            while self.queue[0][2] is None:
+                heapq.heappop(self.queue)
+            first = self.queue[0][0]
+            return self.set_priorities({prompt_id: first - len(prompt_ids) + i for i, prompt_id in enumerate(prompt_ids)})
 
     def get_history(self, prompt_id=None, max_items=None, offset=-1, map_function=None):
+        if self.history_store is not None:
+            if prompt_id is None:
+                out = self.history_store.get_items(max_items=max_items, offset=offset)
+            else:
+                p = self.history_store.get(prompt_id)
+                out = {} if p is None else {prompt_id: p}
+            if map_function is not None:
+                out = {k: map_function(p) for k, p in out.items()}
+            return out
+
         with self.mutex:
             if prompt_id is None:
                 out = {}
@@ -1246,21 +1501,37 @@ class PromptQueue:
                 return out
             elif prompt_id in self.history:
                 p = self.history[prompt_id]
-                if map_function is None:
-                    p = copy.deepcopy(p)
-                else:
+                if map_function is not None:
                     p = map_function(p)
                 return {prompt_id: p}
             else:
                 return {}
 
+    def get_jobs(self, running, queued, **kwargs):
+        """
+        Lists jobs for /api/jobs, see comfy_execution.jobs.get_all_jobs for the arguments.
+        """
+        if self.history_store is not None:
+            return self.history_store.get_jobs(running, queued, **kwargs)
+        return get_all_jobs(running, queued, self.get_history(), **kwargs)
+
     def wipe_history(self):
         with self.mutex:
+            if self.history_store is not None:
+                self.history_store.wipe()
             self.history = {}
+            self.profiles = {}
 
     def delete_history_item(self, id_to_delete):
         with self.mutex:
+            if self.history_store is not None:
+                self.history_store.delete(id_to_delete)
             self.history.pop(id_to_delete, None)
+            self.profiles.pop(id_to_delete, None)
+
+    def get_profile(self, prompt_id):
+        with self.mutex:
+            return self.profiles.get(prompt_id)
 
     def set_flag(self, name, data):
         with self.mutex:
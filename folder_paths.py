@@ -2,8 +2,12 @@ from __future__ import annotations
 
 import os
 import time
+import hashlib
+import json
 import mimetypes
 import logging
+import threading
+import contextlib
 from typing import Literal, List
 from collections.abc import Collection
 
@@ -56,6 +60,7 @@ output_directory = os.path.join(base_path, "output")
 temp_directory = os.path.join(base_path, "temp")
 input_directory = os.path.join(base_path, "input")
 user_directory = os.path.join(base_path, "user")
+cache_directory = os.path.join(base_path, "cache")
 
 filename_list_cache: dict[str, tuple[list[str], dict[str, float], float]] = {}
 
@@ -89,6 +94,51 @@ class CacheHelper:
 
 cache_helper = CacheHelper()
 
+class DependencyTracker:
+    """
+    Records the model folders and directories that are read inside track() blocks, with a
+    fingerprint taken when they are first read. Used to invalidate cached node definitions when
+    the folders their INPUT_TYPES list change. Reading the paths of a model folder with
+    get_folder_paths records a "paths" dependency, the folder is then listed by the caller in a
+    way that isn't tracked so it never matches its previous fingerprint.
+    """
+    def __init__(self):
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def track(self, fingerprints: dict | None = None):
+        """
+        Yields a dict of the dependencies read in the block to their fingerprint. Fingerprints are
+        memoized in fingerprints, if given, so they are only computed once across blocks.
+        """
+        stack = self.local.__dict__.setdefault("stack", [])
+        dependencies = {}
+        stack.append((dependencies, {} if fingerprints is None else fingerprints))
+        try:
+            yield dependencies
+        finally:
+            stack.pop()
+
+    def add(self, kind: Literal["folder", "directory", "paths"], name: str) -> None:
+        stack = getattr(self.local, "stack", None)
+        if not stack:
+            return
+        dependencies, fingerprints = stack[-1]
+        dependency = (kind, name)
+        if dependency in dependencies:
+            return
+        # Fingerprinting a folder lists it, which must not record it a second time
+        dependencies[dependency] = None
+        if dependency not in fingerprints:
+            fingerprints[dependency] = get_dependency_fingerprint(dependency)
+        dependencies[dependency] = fingerprints[dependency]
+
+dependency_tracker = DependencyTracker()
+
+# utils.model_index.ModelIndex, set with set_model_index (--model-index)
+model_index = None
+model_index_list_cache: dict[str, tuple[tuple, list[str]]] = {}
+
 extension_mimetypes_cache = {
     "webp" : "image",
     "fbx" : "model",
@@ -119,6 +169,7 @@ def set_input_directory(input_dir: str) -> None:
 
 def get_output_directory() -> str:
     global output_directory
+    dependency_tracker.add("directory", output_directory)
     return output_directory
 
 def get_temp_directory() -> str:
@@ -127,6 +178,7 @@ def get_temp_directory() -> str:
 
 def get_input_directory() -> str:
     global input_directory
+    dependency_tracker.add("directory", input_directory)
     return input_directory
 
 def get_user_directory() -> str:
@@ -136,6 +188,14 @@ def set_user_directory(user_dir: str) -> None:
     global user_directory
     user_directory = user_dir
 
+def get_cache_directory() -> str:
+    global cache_directory
+    return cache_directory
+
+def set_cache_directory(cache_dir: str) -> None:
+    global cache_directory
+    cache_directory = cache_dir
+
 
 # System User Protection - Protects system directories from HTTP endpoint access
 # System Users are internal-only users that cannot be accessed via HTTP endpoints.
@@ -296,8 +356,17 @@ def add_model_folder_path(folder_name: str, full_folder_path: str, is_default: b
     else:
         folder_names_and_paths[folder_name] = ([full_folder_path], set())
 
+def set_model_index(index) -> None:
+    """
+    Serve get_filename_list and get_full_path from index instead of walking the model folders.
+    """
+    global model_index
+    model_index = index
+    model_index_list_cache.clear()
+
 def get_folder_paths(folder_name: str) -> list[str]:
     folder_name = map_legacy(folder_name)
+    dependency_tracker.add("paths", folder_name)
     return folder_names_and_paths[folder_name][0][:]
 
 def recursive_search(directory: str, excluded_dir_names: list[str] | None=None) -> tuple[list[str], dict[str, float]]:
@@ -356,6 +425,11 @@ def get_full_path(folder_name: str, filename: str) -> str | None:
         return None
     folders = folder_names_and_paths[folder_name]
     filename = os.path.relpath(os.path.join("/", filename), "/")
+    if model_index is not None:
+        for x in folders[0]:
+            if model_index.get(x).contains(filename):
+                return os.path.join(x, filename)
+    # Not indexed (yet), e.g. written moments ago or a case insensitive match
     for x in folders[0]:
         full_path = os.path.join(x, filename)
         if os.path.isfile(full_path):
@@ -415,8 +489,26 @@ def cached_filename_list_(folder_name: str) -> tuple[list[str], dict[str, float]
 
     return out
 
+def model_index_filename_list_(folder_name: str) -> list[str]:
+    folders = folder_names_and_paths[folder_name]
+    indexes = [model_index.get(x) for x in folders[0]]
+    key = (tuple((x.root, x.version) for x in indexes), tuple(sorted(folders[1])))
+    cached = model_index_list_cache.get(folder_name)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    output_list = set()
+    for x in indexes:
+        output_list.update(filter_files_extensions(x.get_file_names(), folders[1]))
+    out = sorted(output_list)
+    model_index_list_cache[folder_name] = (key, out)
+    return out
+
 def get_filename_list(folder_name: str) -> list[str]:
     folder_name = map_legacy(folder_name)
+    dependency_tracker.add("folder", folder_name)
+    if model_index is not None:
+        return list(model_index_filename_list_(folder_name))
     out = cached_filename_list_(folder_name)
     if out is None:
         out = get_filename_list_(folder_name)
@@ -425,16 +517,198 @@ def get_filename_list(folder_name: str) -> list[str]:
     cache_helper.set(folder_name, out)
     return list(out[0])
 
-def get_save_image_path(filename_prefix: str, output_dir: str, image_width=0, image_height=0) -> tuple[str, str, int, str, str]:
-    def map_filename(filename: str) -> tuple[int, str]:
-        prefix_len = len(os.path.basename(filename_prefix))
-        prefix = filename[:prefix_len + 1]
+def get_dependency_fingerprint(dependency: tuple[str, str]):
+    """
+    Value that changes when the contents of a dependency recorded by dependency_tracker change:
+    the model folder's file list for "folder" and the directory's mtime for "directory". "paths"
+    gets a new value every time.
+    """
+    kind, name = dependency
+    if kind == "paths":
+        return object()
+    if kind == "directory":
+        try:
+            return os.stat(name).st_mtime_ns
+        except OSError:
+            return None
+
+    if name not in folder_names_and_paths:
+        return None
+    paths, extensions = folder_names_and_paths[name]
+    if model_index is not None:
+        return tuple((x, model_index.get(x).version) for x in paths), tuple(sorted(extensions))
+    # Rebuilds the cached list if one of its directories changed, its timestamp identifies it
+    get_filename_list(name)
+    return tuple(paths), tuple(sorted(extensions)), filename_list_cache[name][2]
+
+def _save_counter_prefix(filename: str) -> str:
+    return os.path.normcase(filename)
+
+def scan_save_counter(full_output_folder: str, filename: str) -> int:
+    """
+    Returns the highest counter of the files of filename ({filename}_{counter}_...) in the folder, or 0.
+    """
+    prefix_len = len(filename)
+
+    def map_filename(name: str) -> tuple[int, str]:
+        prefix = name[:prefix_len + 1]
         try:
-            digits = int(filename[prefix_len + 1:].split('_')[0])
+            digits = int(name[prefix_len + 1:].split('_')[0])
         except:
             digits = 0
         return digits, prefix
 
+    try:
+        return max(filter(lambda a: os.path.normcase(a[1][:-1]) == _save_counter_prefix(filename) and a[1][-1] == "_", map(map_filename, os.listdir(full_output_folder))))[0]
+    except ValueError:
+        return 0
+
+class SaveCounterIndex:
+    """
+    Next free counter of the files saved by get_save_image_path, per folder and filename prefix, so
+    saving doesn't list the whole output folder every time. A prefix is seeded by one scan of its
+    folder and counters are handed out from there on, the files are never listed again.
+
+    The counters of a folder are kept in a small file in the cache directory, updated under an
+    O_EXCL lock file, so prompt workers and other processes with the same base directory saving to
+    the same folder get distinct counters. Counters keep increasing when files are deleted.
+
+    When the caller gives the extension of its files, the files of the counters are checked to not
+    exist before they are handed out, so files that were copied in or saved by another instance are
+    not overwritten.
+    """
+    LOCK_STALE_SECONDS = 30.0
+    # Prefixes kept per folder, the least recently used are dropped and their folder scanned again
+    MAX_PREFIXES = 256
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # state file path -> (stat of the file when read or written, {prefix: next counter})
+        self.loaded: dict[str, tuple[tuple[int, int] | None, dict[str, int]]] = {}
+
+    def state_path(self, full_output_folder: str) -> str:
+        key = os.path.normcase(os.path.abspath(full_output_folder)).encode("utf-8", "surrogatepass")
+        return os.path.join(get_cache_directory(), "save_counters", hashlib.sha256(key).hexdigest()[:32] + ".json")
+
+    @contextlib.contextmanager
+    def file_lock(self, path: str):
+        lock_path = path + ".lock"
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) > self.LOCK_STALE_SECONDS:
+                        # Left behind by a process that died holding it
+                        os.remove(lock_path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                time.sleep(0.001)
+        try:
+            yield
+        finally:
+            os.close(fd)
+            os.remove(lock_path)
+
+    def _stat(self, path: str) -> tuple[int, int] | None:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _read(self, path: str) -> dict[str, int]:
+        stamp = self._stat(path)
+        loaded = self.loaded.get(path)
+        if loaded is not None and loaded[0] == stamp:
+            return loaded[1]
+        counters = {}
+        if stamp is not None:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    counters = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Rebuilding the save counters in {path}: {e}")
+        self.loaded[path] = (stamp, counters)
+        return counters
+
+    def _write(self, path: str, counters: dict[str, int]) -> None:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(counters, f)
+        os.replace(tmp_path, path)
+        self.loaded[path] = (self._stat(path), counters)
+
+    def _taken(self, full_output_folder: str, filename: str, counter: int, count: int, extension: str) -> int | None:
+        """
+        Returns the last of the counters counter to counter + count - 1 whose file exists, or None.
+        The i-th file is {filename}_{counter + i:05}_.{extension} with %batch_num% replaced by i.
+        """
+        for i in reversed(range(count)):
+            name = f"{filename.replace('%batch_num%', str(i))}_{counter + i:05}_.{extension}"
+            if os.path.exists(os.path.join(full_output_folder, name)):
+                return counter + i
+        return None
+
+    def reserve(self, full_output_folder: str, filename: str, count: int, extension: str | None = None) -> int:
+        """
+        Returns the first of count consecutive counters for files of filename in the folder. With
+        extension, counters whose file already exists are skipped.
+        """
+        path = self.state_path(full_output_folder)
+        prefix = _save_counter_prefix(filename)
+        with self.lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with self.file_lock(path):
+                counters = dict(self._read(path))
+                counter = counters.pop(prefix, None)
+                if counter is None:
+                    counter = scan_save_counter(full_output_folder, filename) + 1
+                while extension is not None:
+                    taken = self._taken(full_output_folder, filename, counter, count, extension)
+                    if taken is None:
+                        break
+                    counter = taken + 1
+                # Most recently used last
+                counters[prefix] = counter + count
+                while len(counters) > self.MAX_PREFIXES:
+                    counters.pop(next(iter(counters)))
+                self._write(path, counters)
+        return counter
+
+    def forget(self, full_output_folder: str, filename: str) -> int | None:
+        """
+        Drops the counter of filename in the folder, so the folder is scanned again the next time,
+        and returns it. For callers that save files without saying how many counters they use.
+        """
+        path = self.state_path(full_output_folder)
+        prefix = _save_counter_prefix(filename)
+        with self.lock:
+            if not os.path.exists(path):
+                return None
+            with self.file_lock(path):
+                counters = self._read(path)
+                if prefix not in counters:
+                    return None
+                counters = dict(counters)
+                counter = counters.pop(prefix)
+                self._write(path, counters)
+                return counter
+
+save_counters = SaveCounterIndex()
+
+def get_save_image_path(filename_prefix: str, output_dir: str, image_width=0, image_height=0, count: int | None = None, extension: str | None = None) -> tuple[str, str, int, str, str]:
+    """
+    Returns the folder, the filename, the first free counter, the subfolder and the filename prefix
+    with its variables replaced for saving files {filename}_{counter:05}_.ext under output_dir.
+
+    count is the number of files (counters) the caller saves. With it, counters are handed out from
+    save_counters without listing the folder. Without it, the folder is listed to find the counter.
+    extension is the extension of the files ({filename}_{counter:05}_.{extension}), counters whose
+    file already exists are then skipped.
+    """
     def compute_vars(input: str, image_width: int, image_height: int) -> str:
         input = input.replace("%width%", str(image_width))
         input = input.replace("%height%", str(image_height))
@@ -463,13 +737,14 @@ def get_save_image_path(filename_prefix: str, output_dir: str, image_width=0, im
         logging.error(err)
         raise Exception(err)
 
-    try:
-        counter = max(filter(lambda a: os.path.normcase(a[1][:-1]) == os.path.normcase(filename) and a[1][-1] == "_", map(map_filename, os.listdir(full_output_folder))))[0] + 1
-    except ValueError:
-        counter = 1
-    except FileNotFoundError:
-        os.makedirs(full_output_folder, exist_ok=True)
-        counter = 1
+    os.makedirs(full_output_folder, exist_ok=True)
+    if count is not None:
+        counter = save_counters.reserve(full_output_folder, filename, max(count, 1), extension)
+    else:
+        # Any number of files may be saved from here, the next reservation has to scan the folder.
+        # Counters handed out before may belong to files that are still being written.
+        reserved = save_counters.forget(full_output_folder, filename)
+        counter = max(scan_save_counter(full_output_folder, filename) + 1, reserved or 0)
     return full_output_folder, filename, counter, subfolder, filename_prefix
 
 def get_input_subfolders() -> list[str]:
@@ -83,7 +83,7 @@ def apply_custom_paths():
         for config_path in itertools.chain(*args.extra_model_paths_config):
             utils.extra_config.load_extra_path_config(config_path)
 
-    # --output-directory, --input-directory, --user-directory
+    # --output-directory, --input-directory, --user-directory, --cache-directory
     if args.output_directory:
         output_dir = os.path.abspath(args.output_directory)
         logging.info(f"Setting output directory to: {output_dir}")
@@ -107,6 +107,17 @@ def apply_custom_paths():
         logging.info(f"Setting user directory to: {user_dir}")
         folder_paths.set_user_directory(user_dir)
 
+    if args.cache_directory:
+        cache_dir = os.path.abspath(args.cache_directory)
+        logging.info(f"Setting cache directory to: {cache_dir}")
+        folder_paths.set_cache_directory(cache_dir)
+
+    if args.model_index is not None:
+        from utils.model_index import ModelIndex
+        logging.info(f"Indexing model folders ({args.model_index})")
+        folder_paths.set_model_index(ModelIndex(state_file=os.path.join(folder_paths.get_cache_directory(), "model_index.json"),
+                                                watch=args.model_index, poll_interval=args.model_index_poll_interval))
+
 
 def execute_prestartup_script():
     if args.disable_all_custom_nodes and len(args.whitelist_custom_nodes) == 0:
@@ -175,8 +186,19 @@ if 'torch' in sys.modules:
 
 
 import comfy.utils
+comfy.utils.safetensors_header_cache.set_directory(os.path.join(folder_paths.get_cache_directory(), "safetensors_headers"))
+if args.prefetch_models > 0:
+    import comfy.model_prefetch
+    comfy.model_prefetch.set_prefetcher(comfy.model_prefetch.ModelPrefetcher(args.prefetch_models))
+if args.patched_weight_cache_size > 0:
+    import comfy.patched_weight_cache
+    comfy.patched_weight_cache.set_cache(comfy.patched_weight_cache.PatchedWeightCache(int(args.patched_weight_cache_size * 1024 * 1024)))
+if args.batch_prompts > 1 and not args.cache_none:
+    import comfy_execution.sampler_batching
+    comfy_execution.sampler_batching.set_batcher(comfy_execution.sampler_batching.SamplerBatcher(args.batch_prompts))
 
 import execution
+import comfy_execution.workers
 import server
 from protocol import BinaryEventTypes
 import nodes
@@ -186,6 +208,7 @@ import app.logger
 import hook_breaker_ac10a0
 
 import comfy.memory_management
+import comfy.metrics
 import comfy.model_patcher
 
 import comfy_aimdo.control
@@ -237,7 +260,7 @@ def prompt_worker(q, server_instance):
     elif args.cache_none:
         cache_type = execution.CacheType.NONE
 
-    e = execution.PromptExecutor(server_instance, cache_type=cache_type, cache_args={ "lru" : args.cache_lru, "ram" : args.cache_ram } )
+    e = execution.PromptExecutor(server_instance, cache_type=cache_type, cache_args={ "lru" : args.cache_lru, "ram" : args.cache_ram, "disk" : args.cache_disk, "disk_directory" : os.path.join(folder_paths.get_cache_directory(), "outputs") }, cpu_threads=args.parallel_cpu_nodes)
     last_gc_collect = 0
     need_gc = False
     gc_collect_interval = 10.0
@@ -274,6 +297,8 @@ def prompt_worker(q, server_instance):
 
             current_time = time.perf_counter()
             execution_time = current_time - execution_start_time
+            comfy.metrics.PROMPTS.inc(1, 'success' if e.success else 'error')
+            comfy.metrics.PROMPT_SECONDS.observe(execution_time)
 
             # Log Time in a more readable way after 10 minutes
             if execution_time > 600:
@@ -351,13 +376,17 @@ def cleanup_temp():
         shutil.rmtree(temp_dir, ignore_errors=True)
 
 
-def setup_database():
+def setup_database(prompt_queue):
     try:
-        from app.database.db import init_db, dependencies_available
+        from app.database.db import init_db, dependencies_available, can_create_session
         if dependencies_available():
             init_db()
             if not args.disable_assets_autoscan:
                 seed_assets(["models"], enable_logging=True)
+            # An in memory sqlite database is per connection so it can't be shared with the prompt worker thread
+            if not args.disable_persistent_history and can_create_session() and not args.database_url.endswith(":memory:"):
+                from app.history_store import HistoryStore
+                prompt_queue.set_history_store(HistoryStore())
     except Exception as e:
         logging.error(f"Failed to initialize database. Please ensure you have installed the latest requirements. If the error persists, please report this as in future the database will be required: {e}")
 
@@ -371,7 +400,8 @@ def start_comfyui(asyncio_loop=None):
         temp_dir = os.path.join(os.path.abspath(args.temp_directory), "temp")
         logging.info(f"Setting temp directory to: {temp_dir}")
         folder_paths.set_temp_directory(temp_dir)
-    cleanup_temp()
+    if args.worker_connect is None:
+        cleanup_temp()
 
     if args.windows_standalone_build:
         try:
@@ -385,7 +415,7 @@ def start_comfyui(asyncio_loop=None):
         asyncio.set_event_loop(asyncio_loop)
     prompt_server = server.PromptServer(asyncio_loop)
 
-    if args.enable_manager and not args.disable_manager_ui:
+    if args.enable_manager and not args.disable_manager_ui and args.worker_connect is None:
         comfyui_manager.start()
 
     hook_breaker_ac10a0.save_functions()
@@ -396,12 +426,22 @@ def start_comfyui(asyncio_loop=None):
     hook_breaker_ac10a0.restore_functions()
 
     cuda_malloc_warning()
-    setup_database()
+    if args.worker_connect is None:
+        setup_database(prompt_server.prompt_queue)
 
     prompt_server.add_routes()
     hijack_progress(prompt_server)
 
-    threading.Thread(target=prompt_worker, daemon=True, args=(prompt_server.prompt_queue, prompt_server,)).start()
+    if args.worker_connect is not None:
+        # Worker process: prompts come from the main process, messages go back to it.
+        worker_queue = comfy_execution.workers.connect_worker(prompt_server, args.worker_connect)
+        threading.Thread(target=prompt_worker, daemon=True, args=(worker_queue, prompt_server,)).start()
+        return asyncio_loop, prompt_server, None
+    elif args.workers > 1:
+        prompt_server.worker_pool = comfy_execution.workers.WorkerPool(prompt_server, args.workers, devices=args.worker_devices)
+        prompt_server.worker_pool.start()
+    else:
+        threading.Thread(target=prompt_worker, daemon=True, args=(prompt_server.prompt_queue, prompt_server,)).start()
 
     if args.quick_test_for_ci:
         exit(0)
@@ -435,6 +475,9 @@ if __name__ == "__main__":
         logging.warning("WARNING: You are using a python version older than 3.10, please upgrade to a newer one. 3.12 and above is recommended.")
 
     event_loop, _, start_all_func = start_comfyui()
+    if args.worker_connect is not None:
+        # Exits when the main process goes away
+        threading.Event().wait()
     try:
         x = start_all_func()
         app.logger.print_startup_warnings()
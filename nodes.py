@@ -25,6 +25,7 @@ sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "co
 import comfy.diffusers_load
 import comfy.samplers
 import comfy.sample
+import comfy.image_writer
 import comfy.sd
 import comfy.utils
 import comfy.controlnet
@@ -494,7 +495,7 @@ class SaveLatent:
     CATEGORY = "_for_testing"
 
     def save(self, samples, filename_prefix="ComfyUI", prompt=None, extra_pnginfo=None):
-        full_output_folder, filename, counter, subfolder, filename_prefix = folder_paths.get_save_image_path(filename_prefix, self.output_dir)
+        full_output_folder, filename, counter, subfolder, filename_prefix = folder_paths.get_save_image_path(filename_prefix, self.output_dir, count=1, extension="latent")
 
         # support save metadata for latent sharing
         prompt_info = ""
@@ -596,6 +597,7 @@ class CheckpointLoaderSimple:
                        "The CLIP model used for encoding text prompts.",
                        "The VAE model used for encoding and decoding images to and from latent space.")
     FUNCTION = "load_checkpoint"
+    PREFETCH_MODELS = {"ckpt_name": "checkpoints"}
 
     CATEGORY = "loaders"
     DESCRIPTION = "Loads a diffusion model checkpoint, diffusion models are used to denoise latents."
@@ -685,6 +687,7 @@ class LoraLoader:
     RETURN_TYPES = ("MODEL", "CLIP")
     OUTPUT_TOOLTIPS = ("The modified diffusion model.", "The modified CLIP model.")
     FUNCTION = "load_lora"
+    PREFETCH_MODELS = {"lora_name": "loras"}
 
     CATEGORY = "loaders"
     DESCRIPTION = "LoRAs are used to modify diffusion and CLIP models, altering the way in which latents are denoised such as applying styles. Multiple LoRA nodes can be linked together."
@@ -806,6 +809,7 @@ class VAELoader:
         return {"required": { "vae_name": (s.vae_list(s), )}}
     RETURN_TYPES = ("VAE",)
     FUNCTION = "load_vae"
+    PREFETCH_MODELS = {"vae_name": "vae"}
 
     CATEGORY = "loaders"
 
@@ -834,6 +838,7 @@ class ControlNetLoader:
 
     RETURN_TYPES = ("CONTROL_NET",)
     FUNCTION = "load_controlnet"
+    PREFETCH_MODELS = {"control_net_name": "controlnet"}
 
     CATEGORY = "loaders"
     SEARCH_ALIASES = ["controlnet", "control net", "cn", "load controlnet", "controlnet loader"]
@@ -952,6 +957,7 @@ class UNETLoader:
                              }}
     RETURN_TYPES = ("MODEL",)
     FUNCTION = "load_unet"
+    PREFETCH_MODELS = {"unet_name": "diffusion_models"}
 
     CATEGORY = "advanced/loaders"
 
@@ -980,6 +986,7 @@ class CLIPLoader:
                              }}
     RETURN_TYPES = ("CLIP",)
     FUNCTION = "load_clip"
+    PREFETCH_MODELS = {"clip_name": "text_encoders"}
 
     CATEGORY = "advanced/loaders"
 
@@ -1008,6 +1015,7 @@ class DualCLIPLoader:
                              }}
     RETURN_TYPES = ("CLIP",)
     FUNCTION = "load_clip"
+    PREFETCH_MODELS = {"clip_name1": "text_encoders", "clip_name2": "text_encoders"}
 
     CATEGORY = "advanced/loaders"
 
@@ -1033,6 +1041,7 @@ class CLIPVisionLoader:
                              }}
     RETURN_TYPES = ("CLIP_VISION",)
     FUNCTION = "load_clip"
+    PREFETCH_MODELS = {"clip_name": "clip_vision"}
 
     CATEGORY = "loaders"
 
@@ -1653,23 +1662,22 @@ class SaveImage:
 
     def save_images(self, images, filename_prefix="ComfyUI", prompt=None, extra_pnginfo=None):
         filename_prefix += self.prefix_append
-        full_output_folder, filename, counter, subfolder, filename_prefix = folder_paths.get_save_image_path(filename_prefix, self.output_dir, images[0].shape[1], images[0].shape[0])
-        results = list()
-        for (batch_number, image) in enumerate(images):
-            i = 255. * image.cpu().numpy()
-            img = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
-            metadata = None
-            if not args.disable_metadata:
-                metadata = PngInfo()
-                if prompt is not None:
-                    metadata.add_text("prompt", json.dumps(prompt))
-                if extra_pnginfo is not None:
-                    for x in extra_pnginfo:
-                        metadata.add_text(x, json.dumps(extra_pnginfo[x]))
+        full_output_folder, filename, counter, subfolder, filename_prefix = folder_paths.get_save_image_path(filename_prefix, self.output_dir, images[0].shape[1], images[0].shape[0], count=len(images), extension="png")
+        metadata = None
+        if not args.disable_metadata:
+            metadata = PngInfo()
+            if prompt is not None:
+                metadata.add_text("prompt", json.dumps(prompt))
+            if extra_pnginfo is not None:
+                for x in extra_pnginfo:
+                    metadata.add_text(x, json.dumps(extra_pnginfo[x]))
 
+        results = list()
+        paths = list()
+        for batch_number in range(len(images)):
             filename_with_batch_num = filename.replace("%batch_num%", str(batch_number))
             file = f"{filename_with_batch_num}_{counter:05}_.png"
-            img.save(os.path.join(full_output_folder, file), pnginfo=metadata, compress_level=self.compress_level)
+            paths.append(os.path.join(full_output_folder, file))
             results.append({
                 "filename": file,
                 "subfolder": subfolder,
@@ -1677,6 +1685,7 @@ class SaveImage:
             })
             counter += 1
 
+        comfy.image_writer.get_writer().save(comfy.image_writer.to_uint8(images), paths, pnginfo=metadata, compress_level=self.compress_level)
         return { "ui": { "images": results } }
 
 class PreviewImage(SaveImage):
@@ -1710,6 +1719,7 @@ class LoadImage:
 
     RETURN_TYPES = ("IMAGE", "MASK")
     FUNCTION = "load_image"
+    DEVICE_AFFINITY = "cpu"
     def load_image(self, image):
         image_path = folder_paths.get_annotated_filepath(image)
 
@@ -1790,6 +1800,7 @@ class LoadImageMask:
 
     RETURN_TYPES = ("MASK",)
     FUNCTION = "load_image"
+    DEVICE_AFFINITY = "cpu"
     def load_image(self, image, channel):
         image_path = folder_paths.get_annotated_filepath(image)
         i = node_helpers.pillow(Image.open, image_path)
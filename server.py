@@ -1,13 +1,16 @@
 import os
 import sys
 import asyncio
+import collections
+import functools
 import traceback
 import time
+import math
 
 import nodes
 import folder_paths
 import execution
-from comfy_execution.jobs import JobStatus, get_job, get_all_jobs
+from comfy_execution.jobs import JobStatus, get_job, encode_cursor, decode_cursor
 import uuid
 import urllib
 import json
@@ -28,6 +31,11 @@ import mimetypes
 from comfy.cli_args import args
 import comfy.utils
 import comfy.model_management
+import comfy.image_writer
+import comfy.metrics
+import comfy.model_prefetch
+import comfy.profiler
+from comfy_execution.prefetch import prefetch_prompt
 from comfy_api import feature_flags
 import node_helpers
 from comfyui_version import __version__
@@ -40,6 +48,8 @@ from app.user_manager import UserManager
 from app.model_manager import ModelFileManager
 from app.custom_node_manager import CustomNodeManager
 from app.subgraph_manager import SubgraphManager
+from app.object_info_cache import ObjectInfoCache
+from app.view_cache import RenditionCache, get_rendition_key, render_preview, render_channel
 from typing import Optional, Union
 from api_server.routes.internal.internal_routes import InternalRoutes
 from protocol import BinaryEventTypes
@@ -62,6 +72,80 @@ async def send_socket_catch_exception(function, message):
     except (aiohttp.ClientError, aiohttp.ClientPayloadError, ConnectionResetError, BrokenPipeError, ConnectionError) as err:
         logging.warning("send error: {}".format(err))
 
+# Messages queued for a websocket client before it is considered too slow and disconnected
+CLIENT_QUEUE_DEPTH = 1000
+
+
+class ClientSender:
+    """
+    Sends the messages of one websocket client from its own queue, so a slow client does not hold up
+    the others. Messages queued with the same coalesce key replace each other and only the latest is
+    sent (previews, progress state). A client whose queue grows past max_depth anyway is disconnected,
+    it gets the current state again when it reconnects.
+    """
+    def __init__(self, ws, max_depth=CLIENT_QUEUE_DEPTH):
+        self.ws = ws
+        self.max_depth = max_depth
+        # [message, binary, coalesce key], the message is None once it was replaced by a newer one
+        self.queue = collections.deque()
+        self.latest = {}
+        self.superseded = 0
+        self.closed = False
+        self.ready = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    def __len__(self):
+        return len(self.queue) - self.superseded
+
+    def put(self, message, binary=False, coalesce_key=None):
+        if self.closed:
+            return
+        entry = [message, binary, coalesce_key]
+        if coalesce_key is not None:
+            previous = self.latest.get(coalesce_key)
+            if previous is not None:
+                previous[0] = None
+                self.superseded += 1
+                comfy.metrics.WEBSOCKET_DROPPED.inc(1, "coalesced")
+            self.latest[coalesce_key] = entry
+        self.queue.append(entry)
+        if len(self.queue) > self.max_depth and self.superseded > 0:
+            self.queue = collections.deque(e for e in self.queue if e[0] is not None)
+            self.superseded = 0
+        if len(self.queue) > self.max_depth:
+            logging.warning("Disconnecting websocket client with {} unsent messages".format(len(self.queue)))
+            comfy.metrics.WEBSOCKET_DROPPED.inc(len(self.queue), "overflow")
+            self.close()
+            asyncio.create_task(self.ws.close())
+            return
+        self.ready.set()
+
+    async def run(self):
+        while True:
+            if len(self.queue) == 0:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+            entry = self.queue.popleft()
+            message, binary, coalesce_key = entry
+            if message is None:
+                self.superseded -= 1
+                continue
+            if coalesce_key is not None and self.latest.get(coalesce_key) is entry:
+                del self.latest[coalesce_key]
+            if binary:
+                await send_socket_catch_exception(self.ws.send_bytes, message)
+            else:
+                await send_socket_catch_exception(self.ws.send_str, message)
+
+    def close(self):
+        self.closed = True
+        self.queue.clear()
+        self.latest.clear()
+        self.superseded = 0
+        self.task.cancel()
+
+
 # Track deprecated paths that have been warned about to only warn once per file
 _deprecated_paths_warned = set()
 
@@ -92,7 +176,7 @@ async def compress_body(request: web.Request, handler):
         return response
     if response.content_type not in ["application/json", "text/plain"]:
         return response
-    if response.body and "gzip" in accept_encoding:
+    if response.body and "gzip" in accept_encoding and "Content-Encoding" not in response.headers:
         response.enable_compression()
     return response
 
@@ -231,6 +315,8 @@ class PromptServer():
         self.app = web.Application(client_max_size=max_upload_size, middlewares=middlewares)
         self.sockets = dict()
         self.sockets_metadata = dict()
+        # sid -> ClientSender
+        self.socket_senders = dict()
         self.web_root = (
             FrontendManager.init_frontend(args.front_end_version)
             if args.front_end_root is None
@@ -242,6 +328,12 @@ class PromptServer():
         self.routes = routes
         self.last_node_id = None
         self.client_id = None
+        # Set when prompts run on separate worker processes (--workers)
+        self.worker_pool = None
+        self.queue_response = None
+        self.view_cache = None
+        if args.view_cache_size > 0:
+            self.view_cache = RenditionCache(os.path.join(folder_paths.get_cache_directory(), "view"), int(args.view_cache_size * 1024 * 1024))
 
         self.on_prompt_handlers = []
 
@@ -253,11 +345,16 @@ class PromptServer():
             if sid:
                 # Reusing existing session, remove old
                 self.sockets.pop(sid, None)
+                old_sender = self.socket_senders.pop(sid, None)
+                if old_sender is not None:
+                    old_sender.close()
             else:
                 sid = uuid.uuid4().hex
 
             # Store WebSocket for backward compatibility
             self.sockets[sid] = ws
+            sender = ClientSender(ws)
+            self.socket_senders[sid] = sender
             # Store metadata separately
             self.sockets_metadata[sid] = {"feature_flags": {}}
 
@@ -301,8 +398,11 @@ class PromptServer():
                         except Exception as e:
                             logging.error(f"Error processing WebSocket message: {e}")
             finally:
-                self.sockets.pop(sid, None)
-                self.sockets_metadata.pop(sid, None)
+                sender.close()
+                if self.sockets.get(sid) is ws:
+                    self.sockets.pop(sid, None)
+                    self.sockets_metadata.pop(sid, None)
+                    self.socket_senders.pop(sid, None)
             return ws
 
         @routes.get("/")
@@ -502,63 +602,33 @@ class PromptServer():
                 filename = os.path.basename(filename)
                 file = os.path.join(output_dir, filename)
 
-                if os.path.isfile(file):
-                    if 'preview' in request.rel_url.query:
-                        with Image.open(file) as img:
-                            preview_info = request.rel_url.query['preview'].split(';')
-                            image_format = preview_info[0]
-                            if image_format not in ['webp', 'jpeg'] or 'a' in request.rel_url.query.get('channel', ''):
-                                image_format = 'webp'
-
-                            quality = 90
-                            if preview_info[-1].isdigit():
-                                quality = int(preview_info[-1])
-
-                            buffer = BytesIO()
-                            if image_format in ['jpeg'] or request.rel_url.query.get('channel', '') == 'rgb':
-                                img = img.convert("RGB")
-                            img.save(buffer, format=image_format, quality=quality)
-                            buffer.seek(0)
-
-                            return web.Response(body=buffer.read(), content_type=f'image/{image_format}',
-                                                headers={"Content-Disposition": f"filename=\"{filename}\""})
+                # Saved with --async-image-save and still being written
+                pending_write = comfy.image_writer.get_writer().get_pending(file)
+                if pending_write is not None:
+                    await asyncio.wait([asyncio.wrap_future(pending_write)])
 
+                if os.path.isfile(file):
                     if 'channel' not in request.rel_url.query:
                         channel = 'rgba'
                     else:
                         channel = request.rel_url.query["channel"]
 
-                    if channel == 'rgb':
-                        with Image.open(file) as img:
-                            if img.mode == "RGBA":
-                                r, g, b, a = img.split()
-                                new_img = Image.merge('RGB', (r, g, b))
-                            else:
-                                new_img = img.convert("RGB")
-
-                            buffer = BytesIO()
-                            new_img.save(buffer, format='PNG')
-                            buffer.seek(0)
-
-                            return web.Response(body=buffer.read(), content_type='image/png',
-                                                headers={"Content-Disposition": f"filename=\"{filename}\""})
-
-                    elif channel == 'a':
-                        with Image.open(file) as img:
-                            if img.mode == "RGBA":
-                                _, _, _, a = img.split()
-                            else:
-                                a = Image.new('L', img.size, 255)
-
-                            # alpha img
-                            alpha_img = Image.new('RGBA', img.size)
-                            alpha_img.putalpha(a)
-                            alpha_buffer = BytesIO()
-                            alpha_img.save(alpha_buffer, format='PNG')
-                            alpha_buffer.seek(0)
-
-                            return web.Response(body=alpha_buffer.read(), content_type='image/png',
-                                                headers={"Content-Disposition": f"filename=\"{filename}\""})
+                    if 'preview' in request.rel_url.query:
+                        preview_info = request.rel_url.query['preview'].split(';')
+                        image_format = preview_info[0]
+                        if image_format not in ['webp', 'jpeg'] or 'a' in request.rel_url.query.get('channel', ''):
+                            image_format = 'webp'
+
+                        quality = 90
+                        if preview_info[-1].isdigit():
+                            quality = int(preview_info[-1])
+
+                        return await self.send_rendition(request, file, filename, image_format, quality, channel,
+                                                         render_preview, file, image_format, quality, channel)
+
+                    if channel in ('rgb', 'a'):
+                        return await self.send_rendition(request, file, filename, 'png', 0, channel,
+                                                         render_channel, file, channel)
                     else:
                         # Get content type from mimetype, defaulting to 'application/octet-stream'
                         content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
@@ -645,6 +715,11 @@ class PromptServer():
         async def get_features(request):
             return web.json_response(feature_flags.get_server_features())
 
+        @routes.get("/metrics")
+        async def get_metrics(request):
+            self.update_metrics()
+            return web.Response(text=comfy.metrics.render(), content_type="text/plain", charset="utf-8", headers={"Cache-Control": "no-store"})
+
         @routes.get("/prompt")
         async def get_prompt(request):
             return web.json_response(self.get_queue_info())
@@ -689,28 +764,29 @@ class PromptServer():
             info['search_aliases'] = getattr(obj_class, 'SEARCH_ALIASES', [])
             return info
 
+        self.object_info_cache = ObjectInfoCache(node_info)
+
         @routes.get("/object_info")
         async def get_object_info(request):
             try:
                 seed_assets(["models"])
             except Exception as e:
                 logging.error(f"Failed to seed assets: {e}")
-            with folder_paths.cache_helper:
-                out = {}
-                for x in nodes.NODE_CLASS_MAPPINGS:
-                    try:
-                        out[x] = node_info(x)
-                    except Exception:
-                        logging.error(f"[ERROR] An error occurred while retrieving information for the '{x}' node.")
-                        logging.error(traceback.format_exc())
-                return web.json_response(out)
+            body, etag = self.object_info_cache.get_document()
+            headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+            if etag in [e.strip().removeprefix("W/") for e in request.headers.get("If-None-Match", "").split(",")]:
+                return web.Response(status=304, headers=headers)
+            if "gzip" in request.headers.get("Accept-Encoding", ""):
+                headers["Content-Encoding"] = "gzip"
+                body = self.object_info_cache.get_gzip_document()
+            return web.Response(body=body, content_type='application/json', headers=headers)
 
         @routes.get("/object_info/{node_class}")
         async def get_object_info_node(request):
             node_class = request.match_info.get("node_class", None)
             out = {}
             if (node_class is not None) and (node_class in nodes.NODE_CLASS_MAPPINGS):
-                out[node_class] = node_info(node_class)
+                out[node_class] = self.object_info_cache.get(node_class)
             return web.json_response(out)
 
         @routes.get("/api/jobs")
@@ -724,6 +800,7 @@ class PromptServer():
                 sort_order: Sort direction: asc, desc (default)
                 limit: Max items to return (positive integer)
                 offset: Items to skip (non-negative integer, default 0)
+                cursor: Return the items after this one, from pagination.next_cursor of the previous page
             """
             query = request.rel_url.query
 
@@ -783,23 +860,36 @@ class PromptServer():
                         status=400
                     )
 
+            cursor = None
+            if 'cursor' in query:
+                try:
+                    cursor = decode_cursor(query.get('cursor'))
+                except ValueError:
+                    return web.json_response(
+                        {"error": "cursor is invalid"},
+                        status=400
+                    )
+
             running, queued = self.prompt_queue.get_current_queue_volatile()
-            history = self.prompt_queue.get_history()
 
             running = _remove_sensitive_from_queue(running)
             queued = _remove_sensitive_from_queue(queued)
 
-            jobs, total = get_all_jobs(
-                running, queued, history,
+            # Fetch one extra item to know if there is a next page
+            jobs, total = self.prompt_queue.get_jobs(
+                running, queued,
                 status_filter=status_filter,
                 workflow_id=workflow_id,
                 sort_by=sort_by,
                 sort_order=sort_order,
-                limit=limit,
-                offset=offset
+                limit=limit + 1 if limit is not None else None,
+                offset=offset,
+                cursor=cursor
             )
 
-            has_more = (offset + len(jobs)) < total
+            has_more = limit is not None and len(jobs) > limit
+            if has_more:
+                jobs = jobs[:limit]
 
             return web.json_response({
                 'jobs': jobs,
@@ -807,7 +897,8 @@ class PromptServer():
                     'offset': offset,
                     'limit': limit,
                     'total': total,
-                    'has_more': has_more
+                    'has_more': has_more,
+                    'next_cursor': encode_cursor(jobs[-1], sort_by) if has_more else None
                 }
             })
 
@@ -821,11 +912,13 @@ class PromptServer():
                     status=400
                 )
 
-            running, queued = self.prompt_queue.get_current_queue_volatile()
+            running, _ = self.prompt_queue.get_current_queue_volatile()
             history = self.prompt_queue.get_history(prompt_id=job_id)
+            # Looked up by id instead of searching the whole queue
+            item = self.prompt_queue.get_queue_item(job_id)
 
             running = _remove_sensitive_from_queue(running)
-            queued = _remove_sensitive_from_queue(queued)
+            queued = _remove_sensitive_from_queue([] if item is None else [item])
 
             job = get_job(job_id, running, queued, history)
             if job is None:
@@ -836,6 +929,22 @@ class PromptServer():
 
             return web.json_response(job)
 
+        @routes.get("/api/jobs/{job_id}/profile")
+        async def get_job_profile(request):
+            """Get the timings of a finished job. Returns a summary with the time of every node,
+            or the full trace as Chrome trace event JSON with ?format=chrome."""
+            job_id = request.match_info.get("job_id", None)
+            profile = self.prompt_queue.get_profile(job_id)
+            if profile is None:
+                return web.json_response(
+                    {"error": "Profile not found"},
+                    status=404
+                )
+
+            if request.rel_url.query.get("format", None) == "chrome":
+                return web.json_response(comfy.profiler.chrome_trace(profile))
+            return web.json_response({k: v for k, v in profile.items() if k not in ("events", "thread")})
+
         @routes.get("/history")
         async def get_history(request):
             max_items = request.rel_url.query.get("max_items", None)
@@ -848,20 +957,28 @@ class PromptServer():
             else:
                 offset = -1
 
-            return web.json_response(self.prompt_queue.get_history(max_items=max_items, offset=offset))
+            # The history can be read from the database, keep it off the event loop
+            loop = asyncio.get_running_loop()
+            history = await loop.run_in_executor(None, functools.partial(self.prompt_queue.get_history, max_items=max_items, offset=offset))
+            return web.json_response(history)
 
         @routes.get("/history/{prompt_id}")
         async def get_history_prompt_id(request):
             prompt_id = request.match_info.get("prompt_id", None)
-            return web.json_response(self.prompt_queue.get_history(prompt_id=prompt_id))
+            loop = asyncio.get_running_loop()
+            history = await loop.run_in_executor(None, functools.partial(self.prompt_queue.get_history, prompt_id=prompt_id))
+            return web.json_response(history)
 
         @routes.get("/queue")
         async def get_queue(request):
-            queue_info = {}
             current_queue = self.prompt_queue.get_current_queue_volatile()
-            queue_info['queue_running'] = _remove_sensitive_from_queue(current_queue[0])
-            queue_info['queue_pending'] = _remove_sensitive_from_queue(current_queue[1])
-            return web.json_response(queue_info)
+            # The snapshot only changes with the queue, reuse the serialized response between polls
+            if self.queue_response is None or self.queue_response[0] is not current_queue:
+                queue_info = {}
+                queue_info['queue_running'] = _remove_sensitive_from_queue(current_queue[0])
+                queue_info['queue_pending'] = _remove_sensitive_from_queue(current_queue[1])
+                self.queue_response = (current_queue, json.dumps(queue_info))
+            return web.Response(text=self.queue_response[1], content_type='application/json')
 
         @routes.post("/prompt")
         async def post_prompt(request):
@@ -901,7 +1018,9 @@ class PromptServer():
                         if sensitive_val in extra_data:
                             sensitive[sensitive_val] = extra_data.pop(sensitive_val)
                     extra_data["create_time"] = int(time.time() * 1000)  # timestamp in milliseconds
-                    self.prompt_queue.put((number, prompt_id, prompt, extra_data, outputs_to_execute, sensitive))
+                    self.prompt_queue.put(execution.QueueItem(number, prompt_id, prompt, extra_data, outputs_to_execute, sensitive))
+                    if comfy.model_prefetch.prefetcher is not None:
+                        prefetch_prompt(comfy.model_prefetch.prefetcher, prompt, prompt_id)
                     response = {"prompt_id": prompt_id, "number": number, "node_errors": valid[3]}
                     return web.json_response(response)
                 else:
@@ -918,17 +1037,44 @@ class PromptServer():
 
         @routes.post("/queue")
         async def post_queue(request):
+            """
+            Changes the queue, the keys are applied in this order:
+            clear: true to remove every queued prompt
+            delete: list of prompt ids to remove
+            priority: {prompt_id: number}, prompts with a lower number run first
+            front: list of prompt ids to run before the other queued prompts, in that order
+            Returns the ids each operation applied to, prompts that are not queued are ignored.
+            """
             json_data =  await request.json()
-            if "clear" in json_data:
-                if json_data["clear"]:
-                    self.prompt_queue.wipe_queue()
-            if "delete" in json_data:
-                to_delete = json_data['delete']
-                for id_to_delete in to_delete:
-                    delete_func = lambda a: a[1] == id_to_delete
-                    self.prompt_queue.delete_queue_item(delete_func)
 
-            return web.Response(status=200)
+            def prompt_ids(key):
+                if not isinstance(json_data[key], list):
+                    raise TypeError("{} must be a list of prompt ids".format(key))
+                return [str(x) for x in json_data[key]]
+
+            # Everything is validated before any operation is applied
+            try:
+                delete = prompt_ids("delete") if "delete" in json_data else None
+                priority = None
+                if "priority" in json_data:
+                    priority = {str(k): float(v) for k, v in json_data["priority"].items()}
+                    if not all(math.isfinite(v) for v in priority.values()):
+                        raise ValueError("priorities must be finite numbers")
+                front = prompt_ids("front") if "front" in json_data else None
+            except (AttributeError, TypeError, ValueError) as e:
+                return web.json_response({"error": "Invalid queue operation: {}".format(e)}, status=400)
+
+            result = {}
+            if json_data.get("clear", False):
+                self.prompt_queue.wipe_queue()
+            if delete is not None:
+                result["deleted"] = self.prompt_queue.delete_queue_items(delete)
+            if priority is not None:
+                result["priority"] = self.prompt_queue.set_priorities(priority)
+            if front is not None:
+                result["front"] = self.prompt_queue.move_to_front(front)
+
+            return web.json_response(result)
 
         @routes.post("/interrupt")
         async def post_interrupt(request):
@@ -952,13 +1098,19 @@ class PromptServer():
                         break
 
                 if should_interrupt:
-                    nodes.interrupt_processing()
+                    if self.worker_pool is not None:
+                        self.worker_pool.interrupt(prompt_id)
+                    else:
+                        nodes.interrupt_processing()
                 else:
                     logging.info(f"Prompt {prompt_id} is not currently running, skipping interrupt")
             else:
                 # No prompt_id provided, do a global interrupt
                 logging.info("Global interrupt (no prompt_id specified)")
-                nodes.interrupt_processing()
+                if self.worker_pool is not None:
+                    self.worker_pool.interrupt()
+                else:
+                    nodes.interrupt_processing()
 
             return web.Response(status=200)
 
@@ -1052,6 +1204,44 @@ class PromptServer():
             web.static('/', self.web_root),
         ])
 
+    async def send_rendition(self, request, file, filename, image_format, quality, channel, render, *args):
+        """
+        Serves a preview or channel extract of file, rendered off the event loop and cached on disk
+        by its rendition key, which is also used as the ETag.
+        """
+        stat = os.stat(file)
+        key = get_rendition_key(file, stat, image_format, quality, channel)
+        etag = f'"{key}"'
+        headers = {"Content-Disposition": f"filename=\"{filename}\"", "ETag": etag}
+
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match is not None:
+            etags = [e.strip().removeprefix("W/") for e in if_none_match.split(",")]
+            if etag in etags or "*" in etags:
+                return web.Response(status=304, headers=headers)
+
+        loop = asyncio.get_running_loop()
+        if self.view_cache is not None:
+            data = await loop.run_in_executor(None, self.view_cache.get_or_render, key, render, *args)
+        else:
+            data = await loop.run_in_executor(None, render, *args)
+        return web.Response(body=data, content_type=f'image/{image_format}', headers=headers)
+
+    def update_metrics(self):
+        # Gauges that are read when /metrics is scraped
+        pending, running = self.prompt_queue.get_queue_depth()
+        comfy.metrics.QUEUE_PENDING.set(pending)
+        comfy.metrics.QUEUE_RUNNING.set(running)
+        comfy.metrics.WEBSOCKET_BACKLOG.set(self.messages.qsize() + sum(len(sender) for sender in self.get_senders()))
+        comfy.metrics.PINNED_MEMORY_BYTES.set(comfy.model_management.TOTAL_PINNED_MEMORY)
+        loaded_models = [m.model for m in list(comfy.model_management.current_loaded_models)]
+        loaded_models = [m for m in loaded_models if m is not None]
+        comfy.metrics.LOADED_MODELS.set(len(loaded_models))
+        comfy.metrics.LOADED_MODEL_BYTES.set(sum(m.loaded_size() for m in loaded_models))
+        device = comfy.model_management.get_torch_device()
+        comfy.metrics.DEVICE_MEMORY_BYTES.set(comfy.model_management.get_total_memory(device), "total")
+        comfy.metrics.DEVICE_MEMORY_BYTES.set(comfy.model_management.get_free_memory(device), "free")
+
     def get_queue_info(self):
         prompt_info = {}
         exec_info = {}
@@ -1139,27 +1329,32 @@ class PromptServer():
         combined_data.extend(metadata_json)
         combined_data.extend(image_bytes)
 
-        await self.send_bytes(BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA, combined_data, sid=sid)
+        coalesce_key = (BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA, metadata.get("prompt_id"), metadata.get("node_id"))
+        await self.send_bytes(BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA, combined_data, sid=sid, coalesce_key=coalesce_key)
+
+    def get_senders(self, sid=None):
+        if sid is None:
+            return list(self.socket_senders.values())
+        sender = self.socket_senders.get(sid)
+        return [] if sender is None else [sender]
 
-    async def send_bytes(self, event, data, sid=None):
+    async def send_bytes(self, event, data, sid=None, coalesce_key=None):
         message = self.encode_bytes(event, data)
+        if coalesce_key is None and event == BinaryEventTypes.PREVIEW_IMAGE:
+            coalesce_key = (event,)
 
-        if sid is None:
-            sockets = list(self.sockets.values())
-            for ws in sockets:
-                await send_socket_catch_exception(ws.send_bytes, message)
-        elif sid in self.sockets:
-            await send_socket_catch_exception(self.sockets[sid].send_bytes, message)
+        for sender in self.get_senders(sid):
+            sender.put(message, binary=True, coalesce_key=coalesce_key)
 
     async def send_json(self, event, data, sid=None):
-        message = {"type": event, "data": data}
-
-        if sid is None:
-            sockets = list(self.sockets.values())
-            for ws in sockets:
-                await send_socket_catch_exception(ws.send_json, message)
-        elif sid in self.sockets:
-            await send_socket_catch_exception(self.sockets[sid].send_json, message)
+        # Serialized once for all the clients
+        message = json.dumps({"type": event, "data": data})
+        coalesce_key = None
+        if event == "progress_state":
+            coalesce_key = (event, data.get("prompt_id"))
+
+        for sender in self.get_senders(sid):
+            sender.put(message, coalesce_key=coalesce_key)
 
     def send_sync(self, event, data, sid=None):
         self.loop.call_soon_threadsafe(
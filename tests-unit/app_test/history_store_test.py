@@ -0,0 +1,126 @@
+import pytest
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import app.database.db as db
+import app.history_store
+from app.history_store import HistoryStore
+from comfy_execution.jobs import JobStatus, decode_cursor, encode_cursor
+from execution import PromptQueue
+
+
+class FakeServer:
+    def queue_updated(self):
+        pass
+
+
+@pytest.fixture
+def history_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(args, "database_url", "sqlite:///{}".format(tmp_path / "comfyui.db"))
+    monkeypatch.setattr(db, "Session", None)
+    db.init_db()
+    return HistoryStore()
+
+
+def make_item(i, status_str="success", create_time=None):
+    extra_data = {"create_time": 1000 + i if create_time is None else create_time}
+    prompt = (i, "prompt-{}".format(i), {"1": {"class_type": "SaveImage", "inputs": {}}}, extra_data, ["1"])
+    messages = [
+        ("execution_start", {"prompt_id": prompt[1], "timestamp": 5000 + i}),
+        ("execution_success" if status_str == "success" else "execution_error", {"prompt_id": prompt[1], "timestamp": 5000 + 2 * i}),
+    ]
+    return {
+        "prompt": prompt,
+        "outputs": {"1": {"images": [{"filename": "{}.png".format(i), "type": "output"}]}},
+        "status": {"status_str": status_str, "completed": status_str == "success", "messages": messages},
+        "meta": {"1": {"node_id": "1"}},
+    }
+
+
+def test_roundtrip_survives_restart(history_store):
+    history_store.add("prompt-1", make_item(1))
+    # A new store on the same database sees the item
+    item = HistoryStore().get("prompt-1")
+    assert item["prompt"] == make_item(1)["prompt"]
+    assert item["outputs"] == make_item(1)["outputs"]
+    assert item["status"]["status_str"] == "success"
+    assert item["meta"] == {"1": {"node_id": "1"}}
+    assert HistoryStore().get("missing") is None
+
+
+def test_get_items_offsets(history_store):
+    for i in range(5):
+        history_store.add("prompt-{}".format(i), make_item(i))
+    assert list(history_store.get_items()) == ["prompt-{}".format(i) for i in range(5)]
+    assert list(history_store.get_items(max_items=2)) == ["prompt-3", "prompt-4"]
+    assert list(history_store.get_items(max_items=2, offset=1)) == ["prompt-1", "prompt-2"]
+    assert history_store.get_items(offset=5) == {}
+
+
+def test_get_items_default_limit(history_store, monkeypatch):
+    monkeypatch.setattr(app.history_store, "DEFAULT_MAX_ITEMS", 3)
+    for i in range(5):
+        history_store.add("prompt-{}".format(i), make_item(i))
+    items = history_store.get_items()
+    assert list(items) == ["prompt-2", "prompt-3", "prompt-4"]
+    assert items["prompt-4"]["outputs"] == make_item(4)["outputs"]
+
+
+def test_delete_wipe_and_trim(history_store):
+    history_store.max_items = 3
+    for i in range(5):
+        history_store.add("prompt-{}".format(i), make_item(i))
+    assert list(history_store.get_items()) == ["prompt-2", "prompt-3", "prompt-4"]
+    history_store.delete("prompt-3")
+    assert list(history_store.get_items()) == ["prompt-2", "prompt-4"]
+    history_store.wipe()
+    assert history_store.get_items() == {}
+
+
+def test_get_jobs_cursor_pagination(history_store):
+    for i in range(7):
+        history_store.add("prompt-{}".format(i), make_item(i, status_str="success" if i % 2 == 0 else "error"))
+    queued = [(10, "queued", {}, {"create_time": 2000}, [])]
+
+    jobs, total = history_store.get_jobs([], queued, limit=3)
+    assert total == 8
+    assert [j["id"] for j in jobs] == ["queued", "prompt-6", "prompt-5"]
+    assert jobs[1]["status"] == JobStatus.COMPLETED
+    assert jobs[2]["status"] == JobStatus.FAILED
+    assert jobs[1]["preview_output"]["filename"] == "6.png"
+    assert "outputs" not in jobs[1]
+
+    seen = []
+    cursor = None
+    while True:
+        jobs, _ = history_store.get_jobs([], queued, limit=3, cursor=cursor)
+        seen += [j["id"] for j in jobs]
+        if len(jobs) < 3:
+            break
+        cursor = decode_cursor(encode_cursor(jobs[-1], "created_at"))
+    assert seen == ["queued"] + ["prompt-{}".format(i) for i in reversed(range(7))]
+
+    jobs, total = history_store.get_jobs([], queued, status_filter=[JobStatus.FAILED], sort_order="asc")
+    assert total == 3
+    assert [j["id"] for j in jobs] == ["prompt-1", "prompt-3", "prompt-5"]
+
+    jobs, _ = history_store.get_jobs([], queued, sort_by="execution_duration", limit=2, offset=1)
+    assert [j["id"] for j in jobs] == ["prompt-5", "prompt-4"]
+
+
+def test_prompt_queue_uses_history_store(history_store):
+    q = PromptQueue(FakeServer())
+    q.set_history_store(history_store)
+    q.put((0, "prompt-0", {}, {"create_time": 1000}, [], {}))
+    _, item_id = q.get()
+    q.task_done(item_id, {"outputs": {}, "meta": {}}, status=PromptQueue.ExecutionStatus("success", True, []),
+                process_item=lambda prompt: prompt[:5])
+    assert q.history == {}
+    assert q.get_history(prompt_id="prompt-0")["prompt-0"]["status"]["status_str"] == "success"
+    jobs, total = q.get_jobs([], [], limit=10)
+    assert total == 1 and jobs[0]["id"] == "prompt-0"
+    q.delete_history_item("prompt-0")
+    assert q.get_history() == {}
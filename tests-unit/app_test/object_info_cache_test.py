@@ -0,0 +1,108 @@
+import gzip
+import json
+import os
+from unittest.mock import patch
+
+import pytest
+
+import folder_paths
+import nodes
+from app.object_info_cache import ObjectInfoCache
+
+
+class ListsInput:
+    @classmethod
+    def INPUT_TYPES(s):
+        input_dir = folder_paths.get_input_directory()
+        return {"required": {"image": (sorted(os.listdir(input_dir)),)}}
+
+
+class ListsModels:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"ckpt_name": (folder_paths.get_filename_list("test_models"),)}}
+
+
+class Static:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {}}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    input_dir = tmp_path / "input"
+    model_dir = tmp_path / "models"
+    input_dir.mkdir()
+    model_dir.mkdir()
+    calls = []
+
+    def node_info(node_class):
+        calls.append(node_class)
+        return {"input": nodes.NODE_CLASS_MAPPINGS[node_class].INPUT_TYPES()}
+
+    node_classes = {"ListsInput": ListsInput, "ListsModels": ListsModels, "Static": Static}
+    with patch.object(nodes, "NODE_CLASS_MAPPINGS", node_classes), \
+            patch.object(folder_paths, "input_directory", str(input_dir)), \
+            patch.dict(folder_paths.folder_names_and_paths, {"test_models": ([str(model_dir)], {".safetensors"})}):
+        yield ObjectInfoCache(node_info), calls, input_dir, model_dir
+
+
+def test_document_reused_until_a_dependency_changes(cache):
+    object_info, calls, input_dir, model_dir = cache
+    body, etag = object_info.get_document()
+    assert sorted(calls) == ["ListsInput", "ListsModels", "Static"]
+
+    calls.clear()
+    assert object_info.get_document() == (body, etag)
+    assert calls == []
+
+    (input_dir / "new.png").write_bytes(b"")
+    os.utime(input_dir, ns=(0, os.stat(input_dir).st_mtime_ns + 10**9))
+    new_body, new_etag = object_info.get_document()
+    assert calls == ["ListsInput"]
+    assert new_etag != etag and b"new.png" in new_body
+
+    calls.clear()
+    (model_dir / "model.safetensors").write_bytes(b"")
+    os.utime(model_dir, ns=(0, os.stat(model_dir).st_mtime_ns + 10**9))
+    assert b"model.safetensors" in object_info.get_document()[0]
+    assert calls == ["ListsModels"]
+
+
+def test_walked_folder_rebuilt_every_time(tmp_path):
+    diffusers_dir = tmp_path / "diffusers"
+    diffusers_dir.mkdir()
+    calls = []
+
+    def node_info(node_class):
+        calls.append(node_class)
+        return {"input": nodes.NODE_CLASS_MAPPINGS[node_class].INPUT_TYPES()}
+
+    node_classes = {"DiffusersLoader": nodes.DiffusersLoader, "Static": Static}
+    with patch.object(nodes, "NODE_CLASS_MAPPINGS", node_classes), \
+            patch.dict(folder_paths.folder_names_and_paths, {"diffusers": ([str(diffusers_dir)], {"folder"})}):
+        object_info = ObjectInfoCache(node_info)
+        object_info.get_document()
+        assert sorted(calls) == ["DiffusersLoader", "Static"]
+
+        calls.clear()
+        (diffusers_dir / "model" / "nested").mkdir(parents=True)
+        (diffusers_dir / "model" / "nested" / "model_index.json").write_text("{}")
+        body, _ = object_info.get_document()
+        assert calls == ["DiffusersLoader"]
+        assert json.loads(body)["DiffusersLoader"]["input"]["required"]["model_path"][0] == [os.path.join("model", "nested")]
+
+
+def test_get_node_uses_cache(cache):
+    object_info, calls, _, _ = cache
+    object_info.get_document()
+    calls.clear()
+    assert object_info.get("Static") == {"input": {"required": {}}}
+    assert calls == []
+
+
+def test_gzip_document(cache):
+    object_info, _, _, _ = cache
+    body, _ = object_info.get_document()
+    assert gzip.decompress(object_info.get_gzip_document()) == body
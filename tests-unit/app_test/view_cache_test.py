@@ -0,0 +1,59 @@
+import os
+
+from PIL import Image
+
+from app.view_cache import RenditionCache, get_rendition_key, render_channel, render_preview
+
+
+def make_image(tmp_path, name="image.png"):
+    path = str(tmp_path / name)
+    Image.new("RGBA", (16, 16), (255, 0, 0, 128)).save(path)
+    return path
+
+
+def test_rendition_key_changes_with_file_and_options(tmp_path):
+    path = make_image(tmp_path)
+    stat = os.stat(path)
+    key = get_rendition_key(path, stat, "webp", 90, "rgba")
+    assert key == get_rendition_key(path, stat, "webp", 90, "rgba")
+    assert key != get_rendition_key(path, stat, "webp", 80, "rgba")
+    assert key != get_rendition_key(path, stat, "jpeg", 90, "rgba")
+    assert key != get_rendition_key(path, stat, "webp", 90, "rgb")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert key != get_rendition_key(path, os.stat(path), "webp", 90, "rgba")
+
+
+def test_get_or_render_caches_on_disk(tmp_path):
+    path = make_image(tmp_path)
+    cache = RenditionCache(str(tmp_path / "cache"), 1024 * 1024)
+    calls = []
+
+    def render(*args):
+        calls.append(args)
+        return render_preview(*args)
+
+    key = get_rendition_key(path, os.stat(path), "webp", 90, "rgba")
+    data = cache.get_or_render(key, render, path, "webp", 90, "rgba")
+    assert cache.get_or_render(key, render, path, "webp", 90, "rgba") == data
+    assert len(calls) == 1
+    # A new instance finds the renditions left by the previous one
+    assert RenditionCache(str(tmp_path / "cache"), 1024 * 1024).get(key) == data
+
+
+def test_eviction_by_size(tmp_path):
+    cache = RenditionCache(str(tmp_path / "cache"), 250)
+    for i in range(3):
+        cache.set("{:02x}".format(i) * 32, bytes(100))
+    assert cache.get("00" * 32) is None
+    assert cache.get("01" * 32) == bytes(100)
+    assert cache.get("02" * 32) == bytes(100)
+    assert cache.total_size == 200
+
+
+def test_render_channel(tmp_path):
+    from io import BytesIO
+    path = make_image(tmp_path)
+    with Image.open(BytesIO(render_channel(path, "rgb"))) as img:
+        assert img.mode == "RGB"
+    with Image.open(BytesIO(render_channel(path, "a"))) as img:
+        assert img.getpixel((0, 0))[3] == 128
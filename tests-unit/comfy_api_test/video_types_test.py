@@ -6,9 +6,11 @@ import av
 import io
 from fractions import Fraction
 from comfy_api.input_impl.video_types import VideoFromFile, VideoFromComponents
+from comfy_api.latest._input_impl.video_types import encode_video_frames
 from comfy_api.util.video_types import VideoComponents
 from comfy_api.input.basic_types import AudioInput
 from av.error import InvalidDataError
+from unittest.mock import MagicMock, patch
 
 EPSILON = 0.0001
 
@@ -41,7 +43,7 @@ def video_components(sample_images, sample_audio):
     )
 
 
-def create_test_video(width=4, height=4, frames=3, fps=30):
+def create_test_video(width=4, height=4, frames=3, fps=30, step=85):
     """Helper to create a temporary video file"""
     tmp = tempfile.NamedTemporaryFile(suffix=".mp4", delete=False)
     with av.open(tmp.name, mode="w") as container:
@@ -52,7 +54,7 @@ def create_test_video(width=4, height=4, frames=3, fps=30):
 
         for i in range(frames):
             frame = av.VideoFrame.from_ndarray(
-                torch.ones(height, width, 3, dtype=torch.uint8).numpy() * (i * 85),
+                torch.ones(height, width, 3, dtype=torch.uint8).numpy() * (i * step),
                 format="rgb24",
             )
             frame = frame.reformat(format="yuv420p")
@@ -237,3 +239,99 @@ def test_duration_consistency(video_components):
     manual_duration = float(components.images.shape[0] / components.frame_rate)
 
     assert duration == pytest.approx(manual_duration)
+
+
+def frame_values(images):
+    """Mean value of each frame, the test videos fill frame i with i * step"""
+    return [round(float(image.float().mean())) for image in images]
+
+
+@pytest.fixture
+def long_video_file():
+    """4x4 video with 30 frames at 30fps, step 8 keeps the values in uint8 range"""
+    file_path = create_test_video(frames=30, step=8)
+    yield file_path
+    os.unlink(file_path)
+
+
+def test_video_from_file_get_components(simple_video_file):
+    """All frames decoded into one float tensor"""
+    components = VideoFromFile(simple_video_file).get_components()
+    assert components.images.shape == (3, 4, 4, 3)
+    assert components.images.dtype == torch.float32
+    values = frame_values(components.images * 255)
+    assert values[0] < values[1] < values[2]
+    assert components.frame_rate == Fraction(30)
+
+
+def test_video_from_file_get_components_uint8(simple_video_file):
+    """Frames can be kept as uint8"""
+    images = VideoFromFile(simple_video_file).get_components(dtype=torch.uint8).images
+    assert images.dtype == torch.uint8
+    float_images = VideoFromFile(simple_video_file).get_components().images
+    assert torch.equal(images.float() / 255.0, float_images)
+
+
+def test_video_from_file_frame_range(long_video_file):
+    """Frame range and stride select the same frames as slicing the full video"""
+    video = VideoFromFile(long_video_file)
+    full = video.get_components().images
+    components = video.get_components(start_frame=10, end_frame=25, stride=4)
+    assert torch.equal(components.images, full[10:25:4])
+    assert components.frame_rate == Fraction(30, 4)
+
+
+def test_video_from_file_invalid_frame_range(simple_video_file):
+    with pytest.raises(ValueError, match="Invalid frame range"):
+        VideoFromFile(simple_video_file).get_components(start_frame=2, end_frame=1)
+
+
+@pytest.mark.parametrize("threaded", [False, True])
+def test_video_from_file_iter_frames(long_video_file, threaded):
+    """Chunks concatenate to the same frames as get_components"""
+    video = VideoFromFile(long_video_file)
+    full = video.get_components().images
+    chunks = list(video.iter_frames(chunk_size=8, start_frame=3, threaded=threaded))
+    assert [chunk.shape[0] for chunk in chunks] == [8, 8, 8, 3]
+    assert torch.equal(torch.cat(chunks), full[3:])
+
+
+def test_video_from_file_iter_frames_stop_early(long_video_file):
+    """Closing the iterator stops the decode thread"""
+    frames = VideoFromFile(long_video_file).iter_frames(chunk_size=2, threaded=True)
+    assert next(frames).shape[0] == 2
+    frames.close()
+
+
+def test_video_from_components_iter_frames(video_components):
+    """Default implementation slices the component images"""
+    video = VideoFromComponents(video_components)
+    chunks = list(video.iter_frames(chunk_size=2))
+    assert torch.equal(torch.cat(chunks), video_components.images)
+    assert list(video.iter_frames(chunk_size=2, dtype=torch.uint8))[0].dtype == torch.uint8
+
+
+def test_video_from_components_save_to_all_frames(tmp_path):
+    """Every frame is encoded when there are more frames than one conversion batch"""
+    images = torch.linspace(0, 1, 40)[:, None, None, None].expand(40, 16, 16, 3).contiguous()
+    video = VideoFromComponents(VideoComponents(images=images, frame_rate=Fraction(30)))
+    path = str(tmp_path / "out.mp4")
+    video.save_to(path)
+    decoded = VideoFromFile(path).get_components().images
+    assert decoded.shape == (40, 16, 16, 3)
+    values = frame_values(decoded * 255)
+    assert values == sorted(values)
+
+
+def test_encode_video_frames_raises_encoder_errors(tmp_path):
+    """Errors of the encoder thread are raised by the caller"""
+    with av.open(str(tmp_path / "out.mp4"), mode="w") as output:
+        stream = output.add_stream("h264", rate=30)
+        stream.width = 16
+        stream.height = 16
+        stream.pix_fmt = "yuv420p"
+        mock_av = MagicMock()
+        mock_av.VideoFrame.from_ndarray.side_effect = RuntimeError("encode failed")
+        with patch("comfy_api.latest._input_impl.video_types.av", mock_av):
+            with pytest.raises(RuntimeError, match="encode failed"):
+                encode_video_frames(output, stream, torch.rand(40, 16, 16, 3), batch_size=4)
@@ -0,0 +1,72 @@
+import random
+
+import pytest
+import torch
+from unittest.mock import patch, MagicMock
+
+# Mock nodes module to prevent CUDA initialization during import
+mock_nodes = MagicMock()
+mock_nodes.MAX_RESOLUTION = 16384
+
+# Mock server module for PromptServer
+mock_server = MagicMock()
+
+with patch.dict('sys.modules', {'nodes': mock_nodes, 'server': mock_server}):
+    from comfy_extras.nodes_dataset import (
+        BKTree,
+        ImageDeduplicationNode,
+        compute_image_hashes,
+    )
+
+
+def make_image(seed, height=64, width=64):
+    generator = torch.Generator().manual_seed(seed)
+    return torch.rand(1, height, width, 3, generator=generator)
+
+
+@pytest.mark.parametrize("method", ["ahash", "phash", "dhash"])
+def test_hashes_are_64_bit_ints(method):
+    images = [make_image(i) for i in range(4)] + [make_image(0, 32, 48)]
+    hashes = compute_image_hashes(images, method)
+    assert all(isinstance(h, int) and 0 <= h < 2 ** 64 for h in hashes)
+    assert len(set(hashes[:4])) == 4
+    assert compute_image_hashes([images[0].clone()], method) == hashes[:1]
+
+
+def test_ahash_bits():
+    image = torch.zeros(1, 8, 8, 3)
+    image[:, :4] = 1.0  # top half bright
+    assert compute_image_hashes([image], "ahash") == [0xFFFFFFFF00000000]
+
+
+def test_hashes_are_cached_per_tensor():
+    image = make_image(0)
+    first = compute_image_hashes([image], "ahash")
+    with patch("comfy_extras.nodes_dataset._hash_batch") as hash_batch:
+        assert compute_image_hashes([image], "ahash") == first
+        hash_batch.assert_not_called()
+    assert compute_image_hashes([image * 0.0], "ahash") != first
+
+
+def test_bk_tree_matches_brute_force():
+    rng = random.Random(0)
+    hashes = [rng.getrandbits(64) for _ in range(500)]
+    # Near duplicates of some of them
+    hashes += [h ^ (1 << rng.randrange(64)) for h in hashes[:50]]
+    tree = BKTree()
+    for i, h in enumerate(hashes[:300]):
+        tree.add(h, i)
+    for h in hashes[300:]:
+        for max_distance in (0, 1, 3, 10):
+            expected = any((h ^ other).bit_count() <= max_distance for other in hashes[:300])
+            match = tree.find(h, max_distance)
+            assert (match is not None) == expected
+            if match is not None:
+                assert (hashes[match[0]] ^ h).bit_count() == match[1] <= max_distance
+
+
+def test_deduplication_keeps_first_of_duplicates():
+    images = [make_image(0), make_image(1), make_image(0), make_image(1) * 0.999, make_image(2)]
+    result = ImageDeduplicationNode._group_process(images, 0.95)
+    assert len(result) == 3
+    assert result[0] is images[0] and result[1] is images[1] and result[2] is images[4]
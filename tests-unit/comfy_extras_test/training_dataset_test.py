@@ -0,0 +1,111 @@
+import json
+import os
+
+import pytest
+import torch
+from unittest.mock import patch, MagicMock
+
+import comfy.utils
+import folder_paths
+
+# Mock nodes module to prevent CUDA initialization during import
+mock_nodes = MagicMock()
+mock_nodes.MAX_RESOLUTION = 16384
+
+# Mock server module for PromptServer
+mock_server = MagicMock()
+
+with patch.dict('sys.modules', {'nodes': mock_nodes, 'server': mock_server}):
+    from comfy_extras.nodes_dataset import (
+        LoadTrainingDataset,
+        SaveTrainingDataset,
+        load_safetensors_shards,
+        save_safetensors_shards,
+    )
+
+
+def make_dataset(num_samples):
+    latents = [{"samples": torch.randn(1, 4, 8 + 8 * (i % 2), 8)} for i in range(num_samples)]
+    conditioning = [
+        [[torch.randn(1, 77, 32), {"pooled_output": torch.randn(1, 32), "guidance": 3.5, "area": (8, 8, 0, 0)}]]
+        for _ in range(num_samples)
+    ]
+    return latents, conditioning
+
+
+def assert_same(a, b):
+    if isinstance(a, torch.Tensor):
+        assert torch.equal(a, b)
+    elif isinstance(a, dict):
+        assert a.keys() == b.keys()
+        for k in a:
+            assert_same(a[k], b[k])
+    elif isinstance(a, (list, tuple)):
+        assert type(a) is type(b) and len(a) == len(b)
+        for x, y in zip(a, b):
+            assert_same(x, y)
+    else:
+        assert a == b
+
+
+@pytest.fixture
+def output_dir(tmp_path):
+    old = folder_paths.get_output_directory()
+    folder_paths.set_output_directory(str(tmp_path))
+    yield tmp_path
+    folder_paths.set_output_directory(old)
+
+
+def test_shards_round_trip(tmp_path):
+    latents, conditioning = make_dataset(5)
+    index = save_safetensors_shards(str(tmp_path), latents, conditioning, shard_size=2)
+    assert [shard["num_samples"] for shard in index["shards"]] == [2, 2, 1]
+    assert index["buckets"] == {"8x8": [0, 2, 4], "16x8": [1, 3]}
+    assert index["samples"][1] == {"shard": 0, "shape": [1, 4, 16, 8]}
+
+    loaded_latents, loaded_conditioning = load_safetensors_shards(str(tmp_path), index)
+    assert_same(latents, loaded_latents)
+    assert_same(conditioning, loaded_conditioning)
+
+
+def test_views_of_one_batch_are_saved(tmp_path):
+    batch = torch.randn(3, 4, 8, 8)
+    latents = [{"samples": batch[i:i + 1]} for i in range(3)]
+    conditioning = [[[batch[i, 0], {}]] for i in range(3)]
+    index = save_safetensors_shards(str(tmp_path), latents, conditioning, shard_size=3)
+    loaded_latents, loaded_conditioning = load_safetensors_shards(str(tmp_path), index)
+    assert_same(latents, loaded_latents)
+    assert_same(conditioning, loaded_conditioning)
+
+
+def test_shared_conditioning_is_stored_once(tmp_path):
+    cond = [[torch.randn(1, 77, 32), {"pooled_output": torch.randn(1, 32)}]]
+    latents = [{"samples": torch.randn(1, 4, 8, 8)} for _ in range(4)]
+    index = save_safetensors_shards(str(tmp_path), latents, [cond] * 4, shard_size=4)
+    shard = comfy.utils.load_torch_file(str(tmp_path / index["shards"][0]["file"]))
+    # 4 latents and the 2 tensors of the shared conditioning
+    assert len(shard) == 6
+    loaded_latents, loaded_conditioning = load_safetensors_shards(str(tmp_path), index)
+    assert_same(latents, loaded_latents)
+    assert_same([cond] * 4, loaded_conditioning)
+
+
+def test_save_and_load_nodes(output_dir):
+    latents, conditioning = make_dataset(3)
+    SaveTrainingDataset.execute(latents, conditioning, ["dataset"], [2])
+    with open(os.path.join(output_dir, "dataset", "metadata.json")) as f:
+        metadata = json.load(f)
+    assert metadata["format"] == "safetensors"
+    assert metadata["num_samples"] == 3
+    assert sorted(os.listdir(output_dir / "dataset")) == ["metadata.json", "shard_0000.safetensors", "shard_0001.safetensors"]
+
+    result = LoadTrainingDataset.execute("dataset")
+    assert_same(latents, result[0])
+    assert_same(conditioning, result[1])
+
+
+def test_unsupported_conditioning_saves_pickle_shards(output_dir):
+    latents, conditioning = make_dataset(2)
+    conditioning[1][0][1]["hooks"] = object()
+    SaveTrainingDataset.execute(latents, conditioning, ["dataset"], [10])
+    assert sorted(os.listdir(output_dir / "dataset")) == ["metadata.json", "shard_0000.pkl"]
@@ -1,6 +1,7 @@
 ### 🗻 This file is created through the spirit of Mount Fuji at its peak
 # TODO(yoland): clean up this after I get back down
 import sys
+import json
 import pytest
 import os
 import tempfile
@@ -115,6 +116,51 @@ def test_get_save_image_path(temp_dir):
         assert subfolder == ""
         assert filename_prefix == "test"
 
+def test_get_save_image_path_reserves_counters(temp_dir):
+    output_dir = os.path.join(temp_dir, "output")
+    os.makedirs(output_dir)
+    for name in ["test_00007_.png", "test_00003_.png", "other_00020_.png"]:
+        open(os.path.join(output_dir, name), "w").close()
+    with patch("folder_paths.cache_directory", os.path.join(temp_dir, "cache")):
+        assert folder_paths.get_save_image_path("test", output_dir, count=4)[2] == 8
+        with patch("os.listdir", side_effect=AssertionError("listed the folder")):
+            # Handed out without listing the folder, also by another index (process)
+            assert folder_paths.get_save_image_path("test", output_dir, count=1)[2] == 12
+            assert folder_paths.SaveCounterIndex().reserve(output_dir, "test", 1) == 13
+            assert folder_paths.get_save_image_path("test", output_dir, count=1)[2] == 14
+        assert folder_paths.get_save_image_path("other", output_dir, count=1)[2] == 21
+
+        # Without count the folder is listed and the next reservation scans it again
+        assert folder_paths.get_save_image_path("test", output_dir)[2] == 15
+        for i in range(15, 18):
+            open(os.path.join(output_dir, f"test_{i:05}_.png"), "w").close()
+        assert folder_paths.get_save_image_path("test", output_dir, count=1)[2] == 18
+        assert not any(name.endswith(".lock") for name in os.listdir(os.path.join(temp_dir, "cache", "save_counters")))
+
+def test_reserved_counters_skip_existing_files(temp_dir):
+    output_dir = os.path.join(temp_dir, "output")
+    os.makedirs(output_dir)
+    with patch("folder_paths.cache_directory", os.path.join(temp_dir, "cache")):
+        assert folder_paths.get_save_image_path("test", output_dir, count=1, extension="png")[2] == 1
+        # Copied in or saved by another instance without going through the counters
+        for i in (2, 4):
+            open(os.path.join(output_dir, f"test_{i:05}_.png"), "w").close()
+        assert folder_paths.get_save_image_path("test", output_dir, count=2, extension="png")[2] == 5
+        # Only the files of the given extension are checked
+        open(os.path.join(output_dir, "test_00007_.png"), "w").close()
+        assert folder_paths.get_save_image_path("test", output_dir, count=1, extension="webp")[2] == 7
+
+def test_save_counters_are_bounded(temp_dir):
+    output_dir = os.path.join(temp_dir, "output")
+    os.makedirs(output_dir)
+    index = folder_paths.SaveCounterIndex()
+    index.MAX_PREFIXES = 3
+    with patch("folder_paths.cache_directory", os.path.join(temp_dir, "cache")):
+        for prefix in ("a", "b", "a", "c", "d"):
+            index.reserve(output_dir, prefix, 1)
+        with open(index.state_path(output_dir)) as f:
+            assert list(json.load(f)) == [folder_paths._save_counter_prefix(p) for p in ("a", "c", "d")]
+
 
 def test_base_path_changes(set_base_dir):
     test_dir = os.path.abspath("/test/dir")
@@ -0,0 +1,51 @@
+import os
+import threading
+
+import numpy as np
+import torch
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+from comfy.image_writer import ImageWriter, to_uint8
+
+
+def test_to_uint8_matches_per_image_conversion():
+    images = torch.rand(3, 8, 8, 3) * 1.2 - 0.1
+    expected = [np.clip(255. * image.numpy(), 0, 255).astype(np.uint8) for image in images]
+    converted = to_uint8(images)
+    assert converted.dtype == np.uint8
+    for a, b in zip(converted, expected):
+        assert np.array_equal(a, b)
+
+
+def test_save_writes_images_with_metadata(tmp_path):
+    writer = ImageWriter(2)
+    images = to_uint8(torch.rand(4, 8, 8, 3))
+    paths = [os.path.join(tmp_path, "image_{}.png".format(i)) for i in range(4)]
+    metadata = PngInfo()
+    metadata.add_text("prompt", "{}")
+    writer.save(images, paths, pnginfo=metadata, compress_level=1)
+    for image, path in zip(images, paths):
+        with Image.open(path) as img:
+            assert img.text["prompt"] == "{}"
+            assert np.array_equal(np.array(img), image)
+    assert len(os.listdir(tmp_path)) == 4
+    assert not any(name.endswith(".tmp") for name in os.listdir(tmp_path))
+
+
+def test_asynchronous_save_returns_before_writing(tmp_path):
+    class BlockedWriter(ImageWriter):
+        def write_file(self, path, image, pnginfo=None, compress_level=4):
+            release.wait()
+            super().write_file(path, image, pnginfo, compress_level)
+
+    release = threading.Event()
+    writer = BlockedWriter(1, asynchronous=True)
+    path = os.path.join(tmp_path, "image.png")
+    writer.save(to_uint8(torch.rand(1, 8, 8, 3)), [path])
+    pending = writer.get_pending(path)
+    assert pending is not None and not os.path.exists(path)
+    release.set()
+    writer.wait()
+    assert os.path.isfile(path)
+    assert writer.get_pending(path) is None
@@ -0,0 +1,63 @@
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.lora
+from comfy.weight_adapter import LoRAAdapter
+
+
+def lora(out_dim, in_dim, rank, alpha=None, dora_scale=None, conv=False):
+    up = torch.randn(out_dim, rank, 1, 1) if conv else torch.randn(out_dim, rank)
+    down = torch.randn(rank, in_dim, 3, 3) if conv else torch.randn(rank, in_dim)
+    return LoRAAdapter(set(), (up, down, alpha, None, dora_scale, None))
+
+
+def make_patches():
+    torch.manual_seed(0)
+    weights = {
+        "a.weight": torch.randn(32, 16),
+        "b.weight": torch.randn(32, 16),
+        "c.weight": torch.randn(32, 16),
+        "conv.weight": torch.randn(8, 4, 3, 3),
+        "dora.weight": torch.randn(32, 16),
+    }
+    patches = {
+        "a.weight": [(1.0, lora(32, 16, 4, alpha=2.0), 1.0, None, None)],
+        # Two loras and a diff, applied in order
+        "b.weight": [
+            (0.5, lora(32, 16, 4), 1.0, None, None),
+            (1.0, (torch.randn(32, 16),), 1.0, None, None),
+            (0.8, lora(32, 16, 8, alpha=4.0), 1.0, None, None),
+        ],
+        "c.weight": [(0.7, lora(32, 16, 4), 0.5, None, None)],
+        "conv.weight": [(1.0, lora(8, 4, 2, conv=True), 1.0, None, None)],
+        "dora.weight": [(1.0, lora(32, 16, 4, dora_scale=torch.rand(32, 1) + 0.5), 1.0, None, None)],
+    }
+    return patches, weights
+
+
+def test_batched_matches_per_key():
+    patches, weights = make_patches()
+    expected = {k: comfy.lora.calculate_weight(patches[k], w.clone(), k) for k, w in weights.items()}
+    batched = comfy.lora.calculate_weights_batched(patches, {k: w.clone() for k, w in weights.items()})
+    assert batched.keys() == expected.keys()
+    for k in expected:
+        torch.testing.assert_close(batched[k], expected[k], rtol=1e-5, atol=1e-5)
+
+
+def test_same_shapes_share_one_bmm(monkeypatch):
+    patches, weights = make_patches()
+    calls = []
+    bmm = torch.bmm
+
+    def counting_bmm(a, b):
+        calls.append(a.shape[0])
+        return bmm(a, b)
+
+    monkeypatch.setattr(torch, "bmm", counting_bmm)
+    comfy.lora.calculate_weights_batched(patches, weights)
+    # The a and b rank 4 loras are batched, b rank 8 and the conv lora on their own, the c (strength_model)
+    # and dora patches go through calculate_weight
+    assert sorted(calls) == [1, 1, 2]
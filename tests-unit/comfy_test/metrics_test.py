@@ -0,0 +1,46 @@
+import pytest
+
+from comfy import metrics
+
+
+def test_counter_and_gauge_render():
+    registry = []
+    requests = metrics.Counter("test_requests_total", "Requests.", ("method",), registry=registry)
+    depth = metrics.Gauge("test_depth", "Depth.", registry=registry)
+    requests.inc(1, "GET")
+    requests.inc(2, "GET")
+    requests.inc(1, 'PO"ST')
+    depth.set(3)
+    assert requests.get("GET") == 3
+    assert metrics.render(registry) == "\n".join([
+        "# HELP test_requests_total Requests.",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{method="GET"} 3',
+        'test_requests_total{method="PO\\"ST"} 1',
+        "# HELP test_depth Depth.",
+        "# TYPE test_depth gauge",
+        "test_depth 3",
+    ]) + "\n"
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = []
+    seconds = metrics.Histogram("test_seconds", "Seconds.", ("class_type",), buckets=(0.1, 1.0), registry=registry)
+    for value in (0.05, 0.1, 0.5, 2.0):
+        seconds.observe(value, "KSampler")
+    assert seconds.get("KSampler") == (4, 2.65)
+    assert metrics.render(registry).splitlines()[2:] == [
+        'test_seconds_bucket{class_type="KSampler",le="0.1"} 2',
+        'test_seconds_bucket{class_type="KSampler",le="1"} 3',
+        'test_seconds_bucket{class_type="KSampler",le="+Inf"} 4',
+        'test_seconds_sum{class_type="KSampler"} 2.65',
+        'test_seconds_count{class_type="KSampler"} 4',
+    ]
+
+
+def test_labels_and_counters_are_checked():
+    counter = metrics.Counter("test_total", "Total.", ("cache", "result"), registry=None)
+    with pytest.raises(ValueError):
+        counter.inc(1, "outputs")
+    with pytest.raises(ValueError):
+        counter.inc(-1, "outputs", "hit")
@@ -0,0 +1,60 @@
+import os
+import threading
+
+from comfy.model_prefetch import ModelPrefetcher
+
+
+def write_file(path, size=1024 * 1024):
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+    return str(path)
+
+
+def test_prefetch_reads_file_once(tmp_path):
+    path = write_file(tmp_path / "model.safetensors")
+    prefetcher = ModelPrefetcher(num_threads=1)
+    prefetcher.prefetch([path])
+    prefetcher.executor.shutdown(wait=True)
+    assert path in prefetcher.recent
+    assert prefetcher.pending == {}
+    assert prefetcher.pending_bytes == 0
+
+
+def test_missing_files_are_skipped(tmp_path):
+    prefetcher = ModelPrefetcher(num_threads=1)
+    prefetcher.prefetch([str(tmp_path / "missing.safetensors")])
+    assert prefetcher.pending == {}
+
+
+def test_wait_drops_prefetch_that_has_not_started(tmp_path):
+    first = write_file(tmp_path / "first.safetensors")
+    second = write_file(tmp_path / "second.safetensors")
+    prefetcher = ModelPrefetcher(num_threads=1)
+    # Keep the only reader thread busy so the second file stays queued
+    blocker = threading.Event()
+    prefetcher.executor.submit(blocker.wait)
+    prefetcher.prefetch([first, second])
+    prefetcher.wait(second)
+    assert second not in prefetcher.pending
+    blocker.set()
+    prefetcher.executor.shutdown(wait=True)
+    assert first in prefetcher.recent
+    assert second not in prefetcher.recent
+    assert prefetcher.pending_bytes == 0
+
+
+def test_cancel(tmp_path):
+    paths = [write_file(tmp_path / "{}.safetensors".format(i)) for i in range(3)]
+    prefetcher = ModelPrefetcher(num_threads=1)
+    blocker = threading.Event()
+    prefetcher.executor.submit(blocker.wait)
+    prefetcher.prefetch(paths, prompt_id="a")
+    prefetcher.prefetch(paths[:1], prompt_id="b")
+    prefetcher.cancel(["a"])
+    # Still wanted by the other queued prompt
+    assert list(prefetcher.pending) == paths[:1]
+    blocker.set()
+    prefetcher.executor.shutdown(wait=True)
+    assert prefetcher.pending == {}
+    assert prefetcher.pending_bytes == 0
+    assert list(prefetcher.recent) == paths[:1]
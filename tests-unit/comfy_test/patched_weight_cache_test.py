@@ -0,0 +1,102 @@
+import gc
+
+import torch
+
+from comfy.patched_weight_cache import PatchedWeightCache
+
+
+class Model:
+    pass
+
+
+def lora_patch(up, down, strength=1.0):
+    return (strength, ("lora", (up, down, None, None, None, None)), 1.0, None, None)
+
+
+WEIGHT = torch.zeros(4, 4)
+
+
+def get_key(cache, model, patches, key="weight", weight=None):
+    weight = weight if weight is not None else WEIGHT
+    return cache.get_key(model, key, weight, patches, "cpu", torch.float32)
+
+
+def test_key_is_stable_for_same_patches():
+    cache = PatchedWeightCache(1024 * 1024)
+    model = Model()
+    up, down = torch.randn(4, 2), torch.randn(2, 4)
+    first = get_key(cache, model, [lora_patch(up, down)])
+    second = get_key(cache, model, [lora_patch(up, down)])
+    assert first[0] == second[0]
+    assert get_key(cache, model, [lora_patch(up, down, 0.5)])[0] != first[0]
+    assert get_key(cache, model, [lora_patch(up.clone(), down)])[0] != first[0]
+    assert get_key(cache, Model(), [lora_patch(up, down)])[0] != first[0]
+    up.add_(1.0)
+    assert get_key(cache, model, [lora_patch(up, down)])[0] != first[0]
+
+
+def test_key_changes_with_base_weight():
+    cache = PatchedWeightCache(1024 * 1024)
+    model = Model()
+    patches = [lora_patch(torch.randn(4, 2), torch.randn(2, 4))]
+    weight = torch.zeros(4, 4)
+    first = get_key(cache, model, patches, weight=weight)
+    assert get_key(cache, model, patches, weight=weight)[0] == first[0]
+    # Replaced by another tensor or modified in place
+    assert get_key(cache, model, patches, weight=torch.zeros(4, 4))[0] != first[0]
+    weight.add_(1.0)
+    assert get_key(cache, model, patches, weight=weight)[0] != first[0]
+    with torch.inference_mode():
+        inference_weight = torch.zeros(4, 4)
+    assert get_key(cache, model, patches, weight=inference_weight)[0] == get_key(cache, model, patches, weight=inference_weight)[0]
+
+
+def test_get_returns_copy():
+    cache = PatchedWeightCache(1024 * 1024)
+    model = Model()
+    cache_key = get_key(cache, model, [lora_patch(torch.randn(4, 2), torch.randn(2, 4))])
+    assert cache.get(cache_key, None) is None
+    weight = torch.randn(4, 4)
+    cache.put(cache_key, weight)
+    cached = cache.get(cache_key, None)
+    assert torch.equal(cached, weight)
+    cached.zero_()
+    assert torch.equal(cache.get(cache_key, None), weight)
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_least_recently_used_is_evicted():
+    weight = torch.randn(4, 4)
+    cache = PatchedWeightCache(2 * weight.numel() * weight.element_size())
+    model = Model()
+    patches = [lora_patch(torch.randn(4, 2), torch.randn(2, 4))]
+    keys = [get_key(cache, model, patches, key="weight{}".format(i)) for i in range(3)]
+    cache.put(keys[0], weight)
+    cache.put(keys[1], weight)
+    assert cache.get(keys[0], None) is not None
+    cache.put(keys[2], weight)
+    assert cache.get(keys[1], None) is None
+    assert cache.get(keys[0], None) is not None
+    assert cache.get(keys[2], None) is not None
+    assert cache.size == cache.max_bytes
+
+
+def test_entry_is_dropped_when_patch_is_freed():
+    cache = PatchedWeightCache(1024 * 1024)
+    model = Model()
+    up, down = torch.randn(4, 2), torch.randn(2, 4)
+    cache_key = get_key(cache, model, [lora_patch(up, down)])
+    cache.put(cache_key, torch.randn(4, 4))
+    del cache_key, up
+    gc.collect()
+    assert len(cache.entries) == 0
+    assert cache.size == 0
+
+
+def test_function_patches_are_not_cached():
+    cache = PatchedWeightCache(1024 * 1024)
+    patch = lora_patch(torch.randn(4, 2), torch.randn(2, 4))
+    patches = [patch[:4] + (lambda w: w,)]
+    assert get_key(cache, Model(), patches) is None
+    nested = [(1.0, [torch.zeros(4, 4), lora_patch(torch.randn(4, 2), torch.randn(2, 4))], 1.0, None, None)]
+    assert get_key(cache, Model(), nested) is None
@@ -0,0 +1,96 @@
+import json
+import threading
+
+import pytest
+
+import comfy.profiler
+
+
+@pytest.fixture(autouse=True)
+def profiler_enabled(monkeypatch):
+    monkeypatch.setattr(comfy.profiler, "enabled", True)
+    yield
+    comfy.profiler.current = None
+
+
+def test_nothing_is_recorded_outside_of_a_prompt():
+    assert comfy.profiler.span("sample", "sampler") is comfy.profiler.span("load", "model_load")
+    assert comfy.profiler.node_start() is None
+    callback = lambda x: None
+    assert comfy.profiler.wrap_step_callback(callback, 10) is callback
+    assert comfy.profiler.finish() is None
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setattr(comfy.profiler, "enabled", False)
+    comfy.profiler.start("prompt")
+    assert comfy.profiler.current is None
+
+
+def test_profile():
+    comfy.profiler.start("prompt")
+    comfy.profiler.node_cached("1", "CheckpointLoaderSimple")
+    started = comfy.profiler.node_start()
+    with comfy.profiler.span("load_models_gpu", "model_load", {"models": 1}):
+        pass
+    steps = []
+    callback = comfy.profiler.wrap_step_callback(lambda x: steps.append(x["i"]), 2)
+    with comfy.profiler.span("sample", "sampler"):
+        for i in range(2):
+            with comfy.profiler.span("calc_cond_batch", "model"):
+                pass
+            callback({"i": i})
+    comfy.profiler.node_end(started, "2", "KSampler")
+    thread = threading.Thread(target=lambda: comfy.profiler.node_end(comfy.profiler.node_start(), "3", None))
+    thread.start()
+    thread.join()
+    profile = comfy.profiler.finish()
+
+    assert comfy.profiler.current is None
+    assert steps == [0, 1]
+    assert profile["prompt_id"] == "prompt"
+    assert profile["cache"] == {"hits": 1, "misses": 2}
+    assert profile["nodes"]["1"]["cached"] and profile["nodes"]["1"]["wall_ms"] == 0
+    assert not profile["nodes"]["2"]["cached"] and profile["nodes"]["2"]["class_type"] == "KSampler"
+    assert profile["nodes"]["2"]["wall_ms"] >= profile["totals"]["sampler"]["total_ms"]
+    assert {k: v["count"] for k, v in profile["totals"].items()} == {"model_load": 1, "model": 2, "sampler_step": 2, "sampler": 1, "node": 2}
+    # Relayed from worker processes and served as json
+    assert json.loads(json.dumps(profile)) == profile
+
+
+def test_chrome_trace():
+    comfy.profiler.start("prompt")
+    with comfy.profiler.span("sample", "sampler", {"steps": 20}):
+        pass
+    thread = threading.Thread(target=lambda: comfy.profiler.node_end(comfy.profiler.node_start(), "3", "SaveImage"))
+    thread.start()
+    thread.join()
+    trace = comfy.profiler.chrome_trace(comfy.profiler.finish())
+
+    spans = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+    assert [(e["name"], e["tid"]) for e in spans] == [("sample", 0), ("SaveImage", 1)]
+    assert spans[0]["args"] == {"steps": 20}
+    assert all(e["ts"] >= 0 and e["dur"] >= 0 for e in spans)
+    names = {e["tid"]: e["args"]["name"] for e in trace["traceEvents"] if e["name"] == "thread_name"}
+    assert names == {0: "executor", 1: "thread 1"}
+
+
+def test_node_run_in_another_thread():
+    comfy.profiler.start("prompt")
+    started = comfy.profiler.node_start(cpu=False)
+
+    def run():
+        cpu_started = comfy.profiler.thread_cpu_start()
+        sum(range(100000))
+        comfy.profiler.thread_cpu_end(cpu_started, "1")
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    comfy.profiler.node_end(started, "1", "ImageScale")
+    profile = comfy.profiler.finish()
+    # Recorded once, with the CPU time of the thread that ran it
+    assert profile["totals"]["node"]["count"] == 1
+    assert profile["nodes"]["1"]["class_type"] == "ImageScale"
+    assert 0 < profile["nodes"]["1"]["cpu_ms"]
+    assert profile["nodes"]["1"]["wall_ms"] >= profile["totals"]["node"]["total_ms"]
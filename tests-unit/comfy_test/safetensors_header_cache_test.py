@@ -0,0 +1,99 @@
+import json
+import os
+
+import safetensors.torch
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.model_detection
+import comfy.sd
+import comfy.utils
+from comfy.utils import SafetensorsHeaderCache
+
+
+def save_model(path, **metadata):
+    safetensors.torch.save_file({"a.weight": torch.zeros(4, 3), "b.bias": torch.zeros(5, dtype=torch.float16)}, path, metadata=metadata or None)
+
+
+def test_header_parsed_and_cached(tmp_path):
+    path = str(tmp_path / "model.safetensors")
+    save_model(path, title="test")
+    cache = SafetensorsHeaderCache()
+    header_size, header = cache.get(path)
+    assert header["a.weight"]["shape"] == [4, 3]
+    assert header["b.bias"]["dtype"] == "F16"
+    assert header["__metadata__"] == {"title": "test"}
+    assert cache.get(path) == (header_size, header)
+
+
+def test_header_invalidated_when_file_changes(tmp_path):
+    path = str(tmp_path / "model.safetensors")
+    save_model(path, title="old")
+    cache = SafetensorsHeaderCache()
+    cache.set_detection(path, "type", "old")
+    assert cache.get(path)[1]["__metadata__"] == {"title": "old"}
+
+    save_model(path, title="new, longer")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.get(path)[1]["__metadata__"] == {"title": "new, longer"}
+    assert cache.get_detection(path, "type") is None
+
+
+def test_persisted_entries(tmp_path):
+    path = str(tmp_path / "model.safetensors")
+    save_model(path)
+    cache = SafetensorsHeaderCache()
+    cache.set_directory(str(tmp_path / "headers"))
+    cache.set_detection(path, "type", {"model_config": "SD15"})
+
+    restored = SafetensorsHeaderCache()
+    restored.set_directory(str(tmp_path / "headers"))
+    assert restored.get_detection(path, "type") == {"model_config": "SD15"}
+    assert restored.get(path) == cache.get(path)
+
+
+def test_detection_of_other_version_ignored(tmp_path):
+    path = str(tmp_path / "model.safetensors")
+    save_model(path)
+    cache = SafetensorsHeaderCache()
+    cache.set_detection(path, "type", "SD15", version="a")
+    assert cache.get_detection(path, "type", version="a") == "SD15"
+    assert cache.get_detection(path, "type", version="b") is None
+    assert cache.get_detection(path, "type") is None
+
+
+def test_meta_state_dict_and_header_bytes(tmp_path):
+    path = str(tmp_path / "model.safetensors")
+    save_model(path, title="test")
+    sd, metadata = comfy.utils.load_safetensors_meta(path)
+    assert sd["a.weight"].device.type == "meta"
+    assert sd["a.weight"].shape == (4, 3)
+    assert sd["b.bias"].dtype == torch.float16
+    assert metadata == {"title": "test"}
+
+    assert json.loads(comfy.utils.safetensors_header(path))["__metadata__"] == {"title": "test"}
+    assert comfy.utils.safetensors_header(path, max_size=8) is None
+
+
+def test_unet_config_detection_cached(tmp_path, monkeypatch):
+    path = str(tmp_path / "model.safetensors")
+    save_model(path)
+    sd, metadata = comfy.utils.load_safetensors_meta(path)
+    unet_config = {"image_model": "test", "axes_dims": (16, 24, 24), "blocks": [1, 2], "dtype": torch.float32, "extra": {"a": None}}
+    detected = []
+
+    def detect_unet_config(state_dict, prefix, metadata=None):
+        detected.append(prefix)
+        return dict(unet_config)
+
+    monkeypatch.setattr(comfy.utils, "safetensors_header_cache", SafetensorsHeaderCache())
+    monkeypatch.setattr(comfy.model_detection, "detect_unet_config", detect_unet_config)
+    monkeypatch.setattr(comfy.model_detection, "model_config_from_unet_config", lambda config, state_dict: {"unet_config": config})
+    for _ in range(2):
+        model_config = comfy.sd.model_config_from_unet_cached(path, sd, "", metadata=metadata)
+        assert model_config["unet_config"] == unet_config
+    assert detected == [""]
@@ -0,0 +1,96 @@
+import itertools
+
+import pytest
+import torch
+
+import comfy.utils
+
+
+class Progress:
+    def __init__(self):
+        self.current = 0
+
+    def update(self, value):
+        self.current += value
+
+
+def upscale(a):
+    return torch.nn.functional.interpolate(a, scale_factor=2, mode="nearest").sin()
+
+
+def reference_tiled_scale(samples, function, tile, overlap, upscale_amount):
+    # One tile at a time with a mask per tile, as tiled_scale_multidim used to run
+    output = torch.empty([samples.shape[0], samples.shape[1]] + [s * upscale_amount for s in samples.shape[2:]])
+    for b in range(samples.shape[0]):
+        s = samples[b:b+1]
+        out = torch.zeros_like(output[b:b+1])
+        out_div = torch.zeros_like(output[b:b+1])
+        positions = [range(0, s.shape[d+2] - overlap, tile[d] - overlap) if s.shape[d+2] > tile[d] else [0] for d in range(len(tile))]
+        for it in itertools.product(*positions):
+            s_in = s
+            upscaled = []
+            for d in range(len(tile)):
+                pos = max(0, min(s.shape[d + 2] - overlap, it[d]))
+                s_in = s_in.narrow(d + 2, pos, min(tile[d], s.shape[d + 2] - pos))
+                upscaled.append(pos * upscale_amount)
+            ps = function(s_in)
+            mask = torch.ones_like(ps)
+            for d in range(2, len(tile) + 2):
+                feather = overlap * upscale_amount
+                if feather >= mask.shape[d]:
+                    continue
+                for t in range(feather):
+                    a = (t + 1) / feather
+                    mask.narrow(d, t, 1).mul_(a)
+                    mask.narrow(d, mask.shape[d] - 1 - t, 1).mul_(a)
+            o = out
+            o_d = out_div
+            for d in range(len(tile)):
+                o = o.narrow(d + 2, upscaled[d], mask.shape[d + 2])
+                o_d = o_d.narrow(d + 2, upscaled[d], mask.shape[d + 2])
+            o.add_(ps * mask)
+            o_d.add_(mask)
+        output[b:b+1] = out / out_div
+    return output
+
+
+@pytest.mark.parametrize("tile_batch_size", [1, 3, 64])
+def test_batched_tiles_match_single_tiles(tile_batch_size):
+    samples = torch.rand(2, 3, 45, 70)
+    calls = []
+
+    def function(a):
+        calls.append(a.shape[0])
+        return upscale(a)
+
+    expected = reference_tiled_scale(samples, upscale, (16, 24), 4, 2)
+    pbar = Progress()
+    output = comfy.utils.tiled_scale(samples, function, tile_x=24, tile_y=16, overlap=4, upscale_amount=2, pbar=pbar, tile_batch_size=tile_batch_size)
+    assert torch.allclose(output, expected, atol=1e-6)
+    steps = samples.shape[0] * comfy.utils.get_tiled_scale_steps(70, 45, 24, 16, 4)
+    assert sum(calls) == steps
+    assert pbar.current == steps
+    assert max(calls) <= tile_batch_size
+    if tile_batch_size > 1:
+        assert len(calls) < steps
+
+
+def test_single_tile_is_batched():
+    samples = torch.rand(5, 3, 8, 8)
+    calls = []
+
+    def function(a):
+        calls.append(a.shape[0])
+        return upscale(a)
+
+    pbar = Progress()
+    output = comfy.utils.tiled_scale(samples, function, tile_x=16, tile_y=16, overlap=4, upscale_amount=2, pbar=pbar, tile_batch_size=2)
+    assert torch.equal(output, upscale(samples))
+    assert pbar.current == 5
+    assert calls == [2, 2, 1]
+
+
+def test_tile_batch_size_from_memory():
+    assert comfy.utils.get_tile_batch_size(100, 30) == 3
+    assert comfy.utils.get_tile_batch_size(10, 30) == 1
+    assert comfy.utils.get_tile_batch_size(10 ** 12, 30) == comfy.utils.MAX_TILE_BATCH
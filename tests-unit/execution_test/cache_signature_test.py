@@ -0,0 +1,92 @@
+import asyncio
+import math
+
+import pytest
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import nodes
+from comfy_execution.caching import CacheKeySetInputSignature, Unhashable
+from comfy_execution.graph import DynamicPrompt
+
+
+class Node:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {}}
+
+
+class FakeIsChangedCache:
+    def __init__(self, values=None):
+        self.values = values or {}
+        self.calls = 0
+
+    async def get(self, node_id):
+        self.calls += 1
+        return self.values.get(node_id, False)
+
+
+@pytest.fixture(autouse=True)
+def node_class(monkeypatch):
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "TestSignatureNode", Node)
+
+
+def node(**inputs):
+    return {"class_type": "TestSignatureNode", "inputs": inputs}
+
+
+def keys_for(prompt, is_changed_cache=None, dynprompt=None):
+    dynprompt = dynprompt or DynamicPrompt(prompt)
+    keys = CacheKeySetInputSignature(dynprompt, list(prompt), is_changed_cache or FakeIsChangedCache())
+    asyncio.run(keys.add_keys(list(prompt)))
+    return keys
+
+
+def test_keys_depend_on_inputs_and_ancestry_not_ids():
+    a = keys_for({"1": node(seed=1), "2": node(x=["1", 0], cfg=7.0), "3": node(steps=4)})
+    b = keys_for({"10": node(seed=1), "20": node(cfg=7.0, x=["10", 0]), "30": node(steps=4)})
+    c = keys_for({"1": node(seed=2), "2": node(x=["1", 0], cfg=7.0), "3": node(steps=4)})
+
+    assert isinstance(a.get_data_key("2"), bytes) and len(a.get_data_key("2")) == 16
+    assert a.get_data_key("2") == b.get_data_key("20")
+    assert a.get_data_key("2") != c.get_data_key("2")
+    assert a.get_data_key("3") == c.get_data_key("3")
+    # The output socket is part of the link
+    d = keys_for({"1": node(seed=1), "2": node(x=["1", 1], cfg=7.0)})
+    assert a.get_data_key("2") != d.get_data_key("2")
+
+
+def test_uncacheable_nodes_and_their_descendants():
+    prompt = {"1": node(seed=1), "2": node(x=["1", 0]), "3": node(steps=4)}
+    a = keys_for(prompt, FakeIsChangedCache({"1": math.nan}))
+    b = keys_for(prompt, FakeIsChangedCache({"1": math.nan}))
+    assert isinstance(a.get_data_key("1"), Unhashable)
+    assert isinstance(a.get_data_key("2"), Unhashable)
+    assert a.get_data_key("2") != b.get_data_key("2")
+    assert a.get_data_key("3") == b.get_data_key("3")
+
+    missing = keys_for({"2": node(x=["1", 0])})
+    assert isinstance(missing.get_data_key("2"), Unhashable)
+
+
+def test_signatures_are_shared_per_prompt():
+    prompt = {"1": node(seed=1), "2": node(x=["1", 0]), "3": node(x=["2", 0], y=["1", 0])}
+    dynprompt = DynamicPrompt(prompt)
+    is_changed_cache = FakeIsChangedCache()
+    first = keys_for(prompt, is_changed_cache, dynprompt)
+    assert is_changed_cache.calls == 3
+    second = keys_for(prompt, is_changed_cache, dynprompt)
+    assert is_changed_cache.calls == 3
+    assert first.get_data_key("3") == second.get_data_key("3")
+
+
+def test_deep_graphs_do_not_recurse():
+    prompt = {"0": node(seed=0)}
+    for i in range(1, 5000):
+        prompt[str(i)] = node(x=[str(i - 1), 0])
+    keys = CacheKeySetInputSignature(DynamicPrompt(prompt), [], FakeIsChangedCache())
+    asyncio.run(keys.add_keys(["4999"]))
+    assert isinstance(keys.get_data_key("4999"), bytes)
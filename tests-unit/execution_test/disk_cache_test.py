@@ -0,0 +1,92 @@
+import importlib.util
+import math
+import os
+from unittest.mock import patch
+
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import nodes
+from comfy_execution.caching import DiskCache, node_code_version, stable_key_digest, to_hashable
+
+
+def test_digest_is_order_independent_for_frozensets():
+    a = to_hashable(["KSampler", {"seed": 1, "cfg": 7.0, "sampler": "euler"}])
+    b = to_hashable(["KSampler", {"sampler": "euler", "cfg": 7.0, "seed": 1}])
+    assert stable_key_digest(a) == stable_key_digest(b)
+    c = to_hashable(["KSampler", {"seed": 2, "cfg": 7.0, "sampler": "euler"}])
+    assert stable_key_digest(a) != stable_key_digest(c)
+
+
+def test_digest_rejects_unstable_keys():
+    assert stable_key_digest(to_hashable(["Node", float("NaN")])) is None
+    assert stable_key_digest(to_hashable(["Node", object()])) is None
+
+
+def test_digest_changes_with_node_code(tmp_path):
+    module_path = tmp_path / "custom_node.py"
+    module_path.write_text("class CustomNode:\n    pass\n")
+    spec = importlib.util.spec_from_file_location("disk_cache_test_custom_node", module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    key = to_hashable(["CustomNode", {"seed": 1}])
+
+    with patch.dict("sys.modules", {spec.name: module}), patch.dict(nodes.NODE_CLASS_MAPPINGS, {"CustomNode": module.CustomNode}):
+        version = node_code_version()
+        assert node_code_version() == version
+        os.utime(module_path, ns=(0, os.stat(module_path).st_mtime_ns + 10**9))
+        updated = node_code_version()
+    assert updated != version
+    assert stable_key_digest(key, version) != stable_key_digest(key, updated)
+
+
+def test_roundtrip(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024 ** 3)
+    cond = torch.randn(1, 77, 768)
+    pooled = torch.randn(1, 768)
+    latent = torch.zeros(2, 4, 8, 8, dtype=torch.float16)
+    outputs = [[[[cond, {"pooled_output": pooled, "strength": 0.5}]]], [{"samples": latent}], [(1, "a", None, math.pi)]]
+    assert cache.set("abc", {"text": ["hello"]}, outputs)
+    cache.flush()
+
+    reloaded = DiskCache(str(tmp_path), 1024 ** 3)
+    assert reloaded.contains("abc")
+    ui, loaded = reloaded.get("abc")
+    assert ui == {"text": ["hello"]}
+    assert torch.equal(loaded[0][0][0][0], cond)
+    assert torch.equal(loaded[0][0][0][1]["pooled_output"], pooled)
+    assert loaded[0][0][0][1]["strength"] == 0.5
+    assert loaded[1][0]["samples"].dtype == torch.float16
+    assert loaded[2][0] == (1, "a", None, math.pi)
+
+    # Copy on write, modifying the loaded tensor must not touch the file
+    loaded[0][0][0][0].zero_()
+    _, again = reloaded.get("abc")
+    assert torch.equal(again[0][0][0][0], cond)
+
+
+def test_unpersistable_values_are_skipped(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024 ** 3)
+    assert not cache.set("model", None, [[object()]])
+    if torch.cuda.is_available():
+        assert not cache.set("gpu", None, [[torch.zeros(1, device="cuda")]])
+    cache.flush()
+    assert not cache.contains("model")
+
+
+def test_lru_eviction(tmp_path):
+    entry_size = 4096 * 4
+    cache = DiskCache(str(tmp_path), int(entry_size * 2.5))
+    for name in ("a", "b"):
+        cache.set(name, None, [[torch.zeros(4096)]])
+        cache.flush()
+    assert cache.get("a") is not None  # a is now the most recently used
+    cache.set("c", None, [[torch.zeros(4096)]])
+    cache.flush()
+    assert cache.contains("a")
+    assert not cache.contains("b")
+    assert cache.contains("c")
+    assert len([f for f in os.listdir(tmp_path) if f.endswith(".safetensors")]) == 2
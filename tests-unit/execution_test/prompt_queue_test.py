@@ -0,0 +1,111 @@
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+from execution import PromptQueue, QueueItem
+from comfy_execution.workers import get_prompt_models
+
+
+class FakeServer:
+    def queue_updated(self):
+        pass
+
+
+def make_item(number, ckpt):
+    prompt = {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": ckpt}},
+        "2": {"class_type": "CLIPTextEncode", "inputs": {"text": "a photo.safetensors", "clip": ["1", 1]}},
+    }
+    return (number, "prompt-{}".format(number), prompt, {}, ["2"], {})
+
+
+def test_get_prompt_models():
+    assert get_prompt_models(make_item(0, "sd15.safetensors")[2]) == {"sd15.safetensors"}
+
+
+def test_get_in_priority_order():
+    q = PromptQueue(FakeServer())
+    for i in (2, 0, 1):
+        q.put(make_item(i, "a.safetensors"))
+    assert [q.get()[0][0] for _ in range(3)] == [0, 1, 2]
+
+
+def test_get_with_preference():
+    q = PromptQueue(FakeServer())
+    q.put(make_item(0, "a.safetensors"))
+    q.put(make_item(1, "b.safetensors"))
+    q.put(make_item(2, "b.safetensors"))
+    prefers_b = lambda item: "b.safetensors" in get_prompt_models(item[2])
+    item, _ = q.get(preference=prefers_b, lookahead=8)
+    assert item[0] == 1
+    # Outside the lookahead window the head of the queue wins
+    item, _ = q.get(preference=prefers_b, lookahead=1)
+    assert item[0] == 0
+    item, _ = q.get(preference=prefers_b, lookahead=8)
+    assert item[0] == 2
+    assert q.get(timeout=0) is None
+
+
+def test_snapshot_shared_until_queue_changes():
+    q = PromptQueue(FakeServer())
+    q.put(make_item(0, "a.safetensors"))
+    q.put(make_item(1, "a.safetensors"))
+    snapshot = q.get_current_queue()
+    assert q.get_current_queue() is snapshot
+    assert isinstance(snapshot[1][0], QueueItem)
+    item, item_id = q.get()
+    running, queued = q.get_current_queue()
+    assert running == (item,) and len(queued) == 1
+    # Reads share the prompt graph with the queue instead of copying it
+    assert running[0].prompt is item.prompt
+    q.task_done(item_id, {}, None, process_item=lambda prompt: prompt[:5])
+    assert q.get_current_queue()[0] == ()
+
+
+def test_profile_is_kept_apart_from_history():
+    q = PromptQueue(FakeServer())
+    q.put(make_item(0, "a.safetensors"))
+    item, item_id = q.get()
+    history_result = {"outputs": {}, "meta": {}, "profile": {"prompt_id": item[1], "nodes": {}}}
+    q.task_done(item_id, history_result, None)
+    assert q.get_profile(item[1]) == {"prompt_id": item[1], "nodes": {}}
+    assert "profile" not in q.get_history(item[1])[item[1]]
+    assert "profile" in history_result
+    q.delete_history_item(item[1])
+    assert q.get_profile(item[1]) is None
+
+
+def test_bulk_delete_and_lookup():
+    q = PromptQueue(FakeServer())
+    for i in range(200):
+        q.put(make_item(i, "a.safetensors"))
+    assert q.get_queue_item("prompt-5")[0] == 5
+    deleted = q.delete_queue_items(["prompt-{}".format(i) for i in range(200) if i % 4 != 0] + ["missing"])
+    assert len(deleted) == 150 and "missing" not in deleted
+    assert q.get_queue_item("prompt-5") is None
+    assert q.get_queue_depth() == (50, 0)
+    # Removed entries are dropped from the heap once they outnumber the queued prompts
+    assert len(q.queue) < 200
+    assert sorted(item[0] for item in q.get_current_queue()[1]) == list(range(0, 200, 4))
+    assert [q.get()[0][0] for _ in range(50)] == list(range(0, 200, 4))
+    assert q.get(timeout=0) is None
+
+
+def test_priority_and_move_to_front():
+    q = PromptQueue(FakeServer())
+    for i in range(5):
+        q.put(make_item(i, "a.safetensors"))
+    assert q.set_priorities({"prompt-0": 10, "missing": 0}) == ["prompt-0"]
+    assert q.get_queue_item("prompt-0")[0] == 10
+    assert q.move_to_front(["prompt-4", "prompt-3", "missing"]) == ["prompt-4", "prompt-3"]
+    assert q.get_current_queue()[1][0][1] == "prompt-4"
+    assert [q.get()[0][1] for _ in range(5)] == ["prompt-4", "prompt-3", "prompt-1", "prompt-2", "prompt-0"]
+
+
+def test_same_number_runs_in_queue_order():
+    q = PromptQueue(FakeServer())
+    for name in ("c", "a", "b"):
+        q.put((0, name, {}, {}, [], {}))
+    assert [q.get()[0][1] for _ in range(3)] == ["c", "a", "b"]
@@ -0,0 +1,198 @@
+import asyncio
+
+import pytest
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.sample
+import latent_preview
+from execution import CacheSet, IsChangedCache, PromptQueue, QueueItem
+from comfy_execution.caching import CacheEntry
+from comfy_execution.graph import DynamicPrompt
+from comfy_execution.sampler_batching import SamplerBatcher, merge_conds
+
+
+class FakeServer:
+    def __init__(self):
+        self.prompt_queue = PromptQueue(self)
+
+    def queue_updated(self):
+        pass
+
+
+class FakeClip:
+    def tokenize(self, text):
+        return text
+
+    def encode_from_tokens_scheduled(self, tokens):
+        value = float(len(tokens))
+        return [[torch.full((1, 77, 8), value), {"pooled_output": torch.full((1, 8), value)}]]
+
+
+def make_prompt(text, seed, sampler_name="euler", steps=4):
+    return {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "model.safetensors"}},
+        "2": {"class_type": "CLIPTextEncode", "inputs": {"text": text, "clip": ["1", 1]}},
+        "3": {"class_type": "CLIPTextEncode", "inputs": {"text": "blurry", "clip": ["1", 1]}},
+        "4": {"class_type": "EmptyLatentImage", "inputs": {"width": 64, "height": 64, "batch_size": 1}},
+        "5": {"class_type": "KSampler", "inputs": {
+            "model": ["1", 0], "seed": seed, "steps": steps, "cfg": 7.0, "sampler_name": sampler_name, "scheduler": "normal",
+            "positive": ["2", 0], "negative": ["3", 0], "latent_image": ["4", 0], "denoise": 1.0,
+        }},
+    }
+
+
+@pytest.fixture
+def sampled(monkeypatch):
+    calls = []
+
+    def sample(model, noise, steps, cfg, sampler_name, scheduler, positive, negative, latent_image, **kwargs):
+        calls.append({"noise": noise, "positive": positive, "negative": negative})
+        return latent_image + noise
+
+    monkeypatch.setattr(comfy.sample, "sample", sample)
+    monkeypatch.setattr(comfy.sample, "fix_empty_latent_channels", lambda model, latent_image, downscale_ratio_spacial=None: latent_image)
+    monkeypatch.setattr(latent_preview, "prepare_callback", lambda model, steps: None)
+    return calls
+
+
+async def run_sampler(server, batcher, prompt, prompt_id="a"):
+    # Sets up the caches like the executor does when it reaches the sampler of prompt
+    caches = CacheSet()
+    dynprompt = DynamicPrompt(prompt)
+    await caches.outputs.set_prompt(dynprompt, prompt.keys(), IsChangedCache(prompt_id, dynprompt, caches.outputs))
+    model = object()
+    clip = FakeClip()
+    positive = clip.encode_from_tokens_scheduled(prompt["2"]["inputs"]["text"])
+    negative = clip.encode_from_tokens_scheduled("blurry")
+    latent = {"samples": torch.zeros(1, 4, 8, 8), "downscale_ratio_spacial": 8}
+    caches.outputs.set("1", CacheEntry(ui=None, outputs=[[model], [clip], [None]]))
+    caches.outputs.set("2", CacheEntry(ui=None, outputs=[[positive]]))
+    caches.outputs.set("3", CacheEntry(ui=None, outputs=[[negative]]))
+    caches.outputs.set("4", CacheEntry(ui=None, outputs=[[latent]]))
+    inputs = dict(prompt["5"]["inputs"], model=model, positive=positive, negative=negative, latent_image=latent)
+    input_data_all = {k: [v] for k, v in inputs.items()}
+    return await batcher.sample(server, dynprompt, caches, prompt_id, "5", input_data_all)
+
+
+def queue(server, *prompts):
+    for i, (prompt_id, prompt) in enumerate(prompts):
+        server.prompt_queue.put(QueueItem(i, prompt_id, prompt, {}, ["5"], {}))
+
+
+def test_queued_prompts_are_sampled_in_one_batch(sampled):
+    server = FakeServer()
+    batcher = SamplerBatcher(4)
+    queue(server, ("b", make_prompt("a cat", 2)), ("c", make_prompt("a dog", 3)))
+    output = asyncio.run(run_sampler(server, batcher, make_prompt("a photo", 1)))
+
+    assert len(sampled) == 1
+    positive = sampled[0]["positive"]
+    assert positive[0][0][:, 0, 0].tolist() == [7.0, 5.0, 5.0]
+    assert positive[0][1]["pooled_output"].shape == (3, 8)
+    assert sampled[0]["negative"][0][0].shape == (3, 77, 8)
+
+    output_data, output_ui, has_subgraph, has_pending_tasks = output
+    latent = torch.zeros(1, 4, 8, 8)
+    assert torch.equal(output_data[0][0]["samples"], comfy.sample.prepare_noise(latent, 1))
+    assert "downscale_ratio_spacial" not in output_data[0][0]
+    assert set(batcher.results) == {"b", "c"}
+    # Every prompt gets the noise of its own seed
+    assert torch.equal(batcher.results["b"]["5"].outputs[0][0]["samples"], comfy.sample.prepare_noise(latent, 2))
+    assert torch.equal(batcher.results["c"]["5"].outputs[0][0]["samples"], comfy.sample.prepare_noise(latent, 3))
+
+
+def test_incompatible_prompts_are_not_batched(sampled):
+    server = FakeServer()
+    batcher = SamplerBatcher(4)
+    queue(server, ("b", make_prompt("a cat", 2, steps=8)), ("c", make_prompt("a dog", 3, sampler_name="euler_ancestral")))
+    assert asyncio.run(run_sampler(server, batcher, make_prompt("a photo", 1))) is None
+    assert asyncio.run(run_sampler(server, batcher, make_prompt("a photo", 1, sampler_name="euler_ancestral"))) is None
+    assert len(sampled) == 0
+    assert batcher.results == {}
+
+
+def test_prompt_with_another_model_is_not_evaluated(sampled, monkeypatch):
+    import execution
+    evaluated = []
+    get_output_data = execution.get_output_data
+
+    async def recording_get_output_data(prompt_id, unique_id, *args, **kwargs):
+        evaluated.append((prompt_id, unique_id))
+        return await get_output_data(prompt_id, unique_id, *args, **kwargs)
+
+    monkeypatch.setattr(execution, "get_output_data", recording_get_output_data)
+    other = make_prompt("a cat", 2)
+    other["1"]["inputs"]["ckpt_name"] = "other.safetensors"
+    server = FakeServer()
+    batcher = SamplerBatcher(4)
+    queue(server, ("b", other))
+    assert asyncio.run(run_sampler(server, batcher, make_prompt("a photo", 1))) is None
+    # The checkpoint of the queued prompt is not loaded, and neither are its text encoders
+    assert evaluated == []
+    assert len(sampled) == 0
+
+
+def test_batch_size_is_limited(sampled):
+    server = FakeServer()
+    batcher = SamplerBatcher(2)
+    queue(server, ("b", make_prompt("a cat", 2)), ("c", make_prompt("a dog", 3)))
+    asyncio.run(run_sampler(server, batcher, make_prompt("a photo", 1)))
+    assert set(batcher.results) == {"b"}
+
+
+def test_restore_puts_results_in_the_cache(sampled):
+    server = FakeServer()
+    batcher = SamplerBatcher(4)
+    prompt = make_prompt("a cat", 2)
+    queue(server, ("b", prompt))
+    asyncio.run(run_sampler(server, batcher, make_prompt("a photo", 1)))
+
+    async def start_prompt():
+        caches = CacheSet()
+        dynprompt = DynamicPrompt(prompt)
+        await caches.outputs.set_prompt(dynprompt, prompt.keys(), IsChangedCache("b", dynprompt, caches.outputs))
+        batcher.restore("b", caches.outputs)
+        return caches.outputs.get("5")
+
+    entry = asyncio.run(start_prompt())
+    assert entry is not None and entry.outputs[0][0]["samples"].shape == (1, 4, 8, 8)
+    assert batcher.results == {}
+
+
+def test_prompt_with_node_that_always_runs_is_not_batched(sampled, monkeypatch):
+    import nodes
+    monkeypatch.setattr(nodes.EmptyLatentImage, "IS_CHANGED", classmethod(lambda s, **kwargs: float("NaN")), raising=False)
+    server = FakeServer()
+    batcher = SamplerBatcher(4)
+    queue(server, ("b", make_prompt("a cat", 2)))
+    assert asyncio.run(run_sampler(server, batcher, make_prompt("a photo", 1))) is None
+    assert len(sampled) == 0
+
+
+def test_results_dropped_when_queue_is_wiped(sampled, monkeypatch):
+    from comfy_execution import sampler_batching
+    server = FakeServer()
+    batcher = SamplerBatcher(4)
+    monkeypatch.setattr(sampler_batching, "batcher", batcher)
+    queue(server, ("b", make_prompt("a cat", 2)), ("c", make_prompt("a dog", 3)))
+    asyncio.run(run_sampler(server, batcher, make_prompt("a photo", 1)))
+    server.prompt_queue.delete_queue_items(["b"])
+    assert set(batcher.results) == {"c"}
+    server.prompt_queue.wipe_queue()
+    assert batcher.results == {}
+
+
+def test_merge_conds_requires_same_options():
+    a = [[torch.ones(1, 77, 8), {"pooled_output": torch.ones(1, 8), "guidance": 3.5}]]
+    b = [[torch.zeros(1, 77, 8), {"pooled_output": torch.zeros(1, 8), "guidance": 3.5}]]
+    merged = merge_conds([a, b], [2, 1])
+    assert merged[0][0][:, 0, 0].tolist() == [1.0, 1.0, 0.0]
+    assert merged[0][1]["guidance"] == 3.5
+    c = [[torch.zeros(1, 77, 8), {"pooled_output": torch.zeros(1, 8), "guidance": 4.0}]]
+    assert merge_conds([a, c], [1, 1]) is None
+    d = [[torch.zeros(1, 154, 8), {"pooled_output": torch.zeros(1, 8), "guidance": 3.5}]]
+    assert merge_conds([a, d], [1, 1]) is None
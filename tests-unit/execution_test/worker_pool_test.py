@@ -0,0 +1,141 @@
+import queue
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+from execution import PromptQueue
+from comfy_execution.workers import WorkerHandle, WorkerPool
+
+
+class FakeServer:
+    def __init__(self):
+        self.prompt_queue = PromptQueue(self)
+        self.sockets_metadata = {}
+        self.last_prompt_id = None
+        self.messages = []
+
+    def queue_updated(self):
+        pass
+
+    def send_sync(self, event, data, sid=None):
+        self.messages.append((event, data, sid))
+
+
+class FakeConnection:
+    """
+    Main process end of a worker connection. Replies are returned by recv in order, an exception
+    is raised instead of being returned.
+    """
+    def __init__(self, replies=(), fail=False):
+        self.sent = []
+        self.replies = queue.Queue()
+        for reply in replies:
+            self.replies.put(reply)
+        self.fail = fail
+        self.closed = False
+
+    def send(self, msg):
+        if self.fail:
+            raise BrokenPipeError("worker died")
+        self.sent.append(msg)
+
+    def recv(self):
+        reply = self.replies.get(timeout=5)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def close(self):
+        self.closed = True
+
+
+def make_item(number):
+    prompt = {"1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "a.safetensors"}}}
+    return (number, "prompt-{}".format(number), prompt, {}, ["1"], {})
+
+
+@pytest.fixture
+def pool():
+    spawned = []
+    with patch.object(WorkerHandle, "spawn", lambda worker: spawned.append(worker.index)):
+        pool = WorkerPool(FakeServer(), 2)
+        yield pool, spawned
+    pool.listener.close()
+
+
+def connect(worker, conn):
+    worker.conn = conn
+    worker.connected.set()
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 5
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_flags_sent_to_every_worker(pool):
+    pool, _ = pool
+    conns = [FakeConnection(), FakeConnection()]
+    for worker, conn in zip(pool.workers, conns):
+        connect(worker, conn)
+    pool.server.prompt_queue.set_flag("unload_models", True)
+    pool.poll_flags()
+    assert [conn.sent for conn in conns] == [[("flags", {"unload_models": True})]] * 2
+
+
+def test_dead_worker_does_not_stop_flags(pool):
+    pool, spawned = pool
+    dead, alive = FakeConnection(fail=True), FakeConnection()
+    connect(pool.workers[0], dead)
+    connect(pool.workers[1], alive)
+    pool.server.prompt_queue.set_flag("free_memory", True)
+    pool.poll_flags()
+    assert alive.sent == [("flags", {"free_memory": True})]
+    assert not pool.workers[0].connected.is_set()
+    assert dead.closed
+    assert spawned == [0]
+
+
+def test_dispatch_relays_messages_and_result(pool):
+    pool, _ = pool
+    q = pool.server.prompt_queue
+    item = make_item(0)
+    status = PromptQueue.ExecutionStatus(status_str="success", completed=True, messages=[])
+    conn = FakeConnection([("send_sync", "executing", {"node": "1"}, None), ("done", {"outputs": {"1": {}}}, status, item[:5])])
+    worker = pool.workers[0]
+    connect(worker, conn)
+    q.put(item)
+    threading.Thread(target=worker.dispatch_loop, daemon=True).start()
+
+    wait_for(lambda: "prompt-0" in q.get_history())
+    assert conn.sent[0][:2] == ("execute", item)
+    assert pool.server.messages == [("executing", {"node": "1"}, None)]
+    history = q.get_history()["prompt-0"]
+    assert history["status"]["status_str"] == "success"
+    assert history["outputs"] == {"1": {}}
+
+
+def test_crashed_worker_fails_its_prompt_and_restarts(pool):
+    pool, spawned = pool
+    q = pool.server.prompt_queue
+    conn = FakeConnection([EOFError()])
+    worker = pool.workers[0]
+    connect(worker, conn)
+    q.put(make_item(0))
+    threading.Thread(target=worker.dispatch_loop, daemon=True).start()
+
+    wait_for(lambda: "prompt-0" in q.get_history())
+    history = q.get_history()["prompt-0"]
+    assert history["status"]["status_str"] == "error"
+    assert history["status"]["messages"][0][1]["exception_type"] == "WorkerError"
+    assert spawned == [0]
+    assert not worker.connected.is_set()
@@ -0,0 +1,92 @@
+import os
+from unittest.mock import patch
+
+import pytest
+
+import folder_paths
+from utils.model_index import DirectoryIndex, ModelIndex
+
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "w").close()
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    root = tmp_path / "models"
+    touch(str(root / "a.safetensors"))
+    touch(str(root / "sub" / "b.pt"))
+    touch(str(root / ".git" / "c.pt"))
+    touch(str(root / "notes.txt"))
+    return str(root)
+
+
+def test_scan_matches_recursive_search(model_dir):
+    index = DirectoryIndex(model_dir)
+    index.scan()
+    files, _ = folder_paths.recursive_search(model_dir, excluded_dir_names=[".git"])
+    assert sorted(index.get_file_names()) == sorted(files)
+
+
+def test_refresh_only_lists_changed_directories(model_dir):
+    index = DirectoryIndex(model_dir)
+    index.scan()
+    version = index.version
+    assert not index.refresh_changed()
+    assert index.version == version
+
+    touch(os.path.join(model_dir, "new", "deep", "d.sft"))
+    os.remove(os.path.join(model_dir, "sub", "b.pt"))
+    with patch.object(index, "_list_dir", wraps=index._list_dir) as list_dir:
+        assert index.refresh_changed()
+    listed = {call.args[0] for call in list_dir.call_args_list}
+    assert os.path.join(model_dir, "sub") in listed
+    assert os.path.join(model_dir, "new", "deep") in listed
+    assert sorted(index.get_file_names()) == ["a.safetensors", os.path.join("new", "deep", "d.sft"), "notes.txt"]
+    assert index.version > version
+
+
+def test_state_round_trip(model_dir, tmp_path):
+    state_file = str(tmp_path / "model_index.json")
+    index = ModelIndex(state_file, watch="poll", poll_interval=60)
+    index.get(model_dir)
+    index.save()
+
+    touch(os.path.join(model_dir, "sub", "e.pt"))
+    restored = ModelIndex(state_file, watch="poll", poll_interval=60)
+    assert model_dir in restored.saved_state
+    assert restored.get(model_dir).contains(os.path.join("sub", "e.pt"))
+    assert restored.get(model_dir).contains("a.safetensors")
+
+
+def test_folder_paths_use_index(model_dir, tmp_path):
+    index = ModelIndex(None, watch="poll", poll_interval=60)
+    with patch.dict(folder_paths.folder_names_and_paths, {"test_models": ([model_dir], folder_paths.supported_pt_extensions)}):
+        folder_paths.set_model_index(index)
+        try:
+            assert folder_paths.get_filename_list("test_models") == ["a.safetensors", os.path.join("sub", "b.pt")]
+            assert folder_paths.get_full_path("test_models", "sub/b.pt") == os.path.join(model_dir, "sub", "b.pt")
+            assert folder_paths.get_full_path("test_models", "missing.pt") is None
+
+            touch(os.path.join(model_dir, "f.pt"))
+            # Found before the index picks it up
+            assert folder_paths.get_full_path("test_models", "f.pt") == os.path.join(model_dir, "f.pt")
+            index.get(model_dir).refresh_changed()
+            assert "f.pt" in folder_paths.get_filename_list("test_models")
+        finally:
+            folder_paths.set_model_index(None)
+
+
+def test_dependency_tracker_records_folders(model_dir):
+    with patch.dict(folder_paths.folder_names_and_paths, {"test_models": ([model_dir], folder_paths.supported_pt_extensions)}):
+        with folder_paths.dependency_tracker.track() as dependencies:
+            folder_paths.get_filename_list("test_models")
+            folder_paths.get_input_directory()
+        assert set(dependencies) == {("folder", "test_models"), ("directory", folder_paths.get_input_directory())}
+        fingerprint = dependencies[("folder", "test_models")]
+        assert folder_paths.get_dependency_fingerprint(("folder", "test_models")) == fingerprint
+
+        touch(os.path.join(model_dir, "sub", "new.pt"))
+        os.utime(os.path.join(model_dir, "sub"), ns=(0, os.stat(os.path.join(model_dir, "sub")).st_mtime_ns + 10**9))
+        assert folder_paths.get_dependency_fingerprint(("folder", "test_models")) != fingerprint
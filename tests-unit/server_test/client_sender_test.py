@@ -0,0 +1,70 @@
+import asyncio
+
+from server import ClientSender
+
+
+class SlowSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+        self.release = asyncio.Event()
+
+    async def send_str(self, message):
+        await self.release.wait()
+        self.sent.append(message)
+
+    async def send_bytes(self, message):
+        await self.release.wait()
+        self.sent.append(message)
+
+    async def close(self):
+        self.closed = True
+
+
+def test_coalesced_messages_keep_only_the_latest():
+    async def run():
+        ws = SlowSocket()
+        sender = ClientSender(ws)
+        sender.put("a")
+        for i in range(10):
+            sender.put("preview {}".format(i), coalesce_key=("preview",))
+        sender.put("b")
+        sender.put("preview 10", coalesce_key=("preview",))
+        assert len(sender) == 3
+        ws.release.set()
+        while len(sender) > 0:
+            await asyncio.sleep(0)
+        sender.close()
+        return ws.sent
+
+    # The replaced preview is not sent, the latest one is sent after the messages queued before it
+    assert asyncio.run(run()) == ["a", "b", "preview 10"]
+
+
+def test_slow_client_is_disconnected():
+    async def run():
+        ws = SlowSocket()
+        sender = ClientSender(ws, max_depth=5)
+        for i in range(6):
+            sender.put("message {}".format(i))
+        await asyncio.sleep(0)
+        return sender, ws
+
+    sender, ws = asyncio.run(run())
+    assert sender.closed and ws.closed
+    assert len(sender) == 0
+
+
+def test_one_slow_client_does_not_block_the_others():
+    async def run():
+        slow, fast = SlowSocket(), SlowSocket()
+        fast.release.set()
+        senders = [ClientSender(slow), ClientSender(fast)]
+        for sender in senders:
+            sender.put("status")
+        await asyncio.sleep(0.01)
+        for sender in senders:
+            sender.close()
+        return slow.sent, fast.sent
+
+    assert asyncio.run(run()) == ([], ["status"])
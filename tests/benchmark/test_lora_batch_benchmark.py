@@ -0,0 +1,59 @@
+"""
+LoRA patching: one torch.mm per key against calculate_weights_batched.
+
+Run with: pytest tests/benchmark/test_lora_batch_benchmark.py -m benchmark
+"""
+import time
+
+import pytest
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+import comfy.lora
+from comfy.weight_adapter import LoRAAdapter
+
+# Many small keys, where the python overhead and kernel launches dominate
+NUM_KEYS = [500, 2000]
+DIM = 128
+RANK = 16
+
+
+def make_patches(num_keys):
+    torch.manual_seed(0)
+    weights = {}
+    patches = {}
+    for i in range(num_keys):
+        key = "blocks.{}.weight".format(i)
+        weights[key] = torch.randn(DIM, DIM)
+        adapter = LoRAAdapter(set(), (torch.randn(DIM, RANK), torch.randn(RANK, DIM), float(RANK), None, None, None))
+        patches[key] = [(1.0, adapter, 1.0, None, None)]
+    return patches, weights
+
+
+@pytest.mark.benchmark
+def test_lora_batch_throughput(skip_timing_checks):
+    print()  # noqa: T201
+    print("{:>8} {:>14} {:>14}".format("keys", "per key ms", "batched ms"))  # noqa: T201
+    for num_keys in NUM_KEYS:
+        patches, weights = make_patches(num_keys)
+        per_key_weights = {k: w.clone() for k, w in weights.items()}
+        batched_weights = {k: w.clone() for k, w in weights.items()}
+
+        start = time.perf_counter()
+        for k in patches:
+            per_key_weights[k] = comfy.lora.calculate_weight(patches[k], per_key_weights[k], k)
+        per_key = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batched_weights = comfy.lora.calculate_weights_batched(patches, batched_weights)
+        batched = time.perf_counter() - start
+
+        print("{:>8} {:>14.1f} {:>14.1f}".format(num_keys, per_key * 1000, batched * 1000))  # noqa: T201
+        for k in patches:
+            torch.testing.assert_close(batched_weights[k], per_key_weights[k], rtol=1e-4, atol=1e-4)
+
+        if not skip_timing_checks:
+            assert batched < per_key
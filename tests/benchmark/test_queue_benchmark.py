@@ -0,0 +1,142 @@
+"""
+/queue latency against queue depth and bulk queue operations on a large queue.
+
+Run with: pytest tests/benchmark/test_queue_benchmark.py -m benchmark
+"""
+import copy
+import heapq
+import json
+import time
+
+import pytest
+import torch
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+from execution import PromptQueue, QueueItem
+
+DEPTHS = [10, 100, 1000]
+
+
+class FakeServer:
+    def queue_updated(self):
+        pass
+
+
+def make_workflow(num_nodes=50):
+    # Roughly the size of the workflow the frontend sends in extra_pnginfo for a large graph
+    return {
+        "nodes": [{"id": i, "type": "KSampler", "pos": [i, i], "size": [300, 200],
+                   "widgets_values": [i, "randomize", 20, 8.0, "euler", "normal", 1.0],
+                   "inputs": [{"name": "model", "link": i}], "outputs": [{"name": "LATENT", "links": [i + 1]}]}
+                  for i in range(num_nodes)],
+        "links": [[i, i, 0, i + 1, 0, "LATENT"] for i in range(num_nodes)],
+    }
+
+
+def make_queue(depth):
+    q = PromptQueue(FakeServer())
+    workflow = make_workflow()
+    for i in range(depth):
+        prompt = {str(n): {"class_type": "KSampler", "inputs": {"seed": i, "steps": 20}} for n in range(50)}
+        extra_data = {"extra_pnginfo": {"workflow": copy.deepcopy(workflow)}, "create_time": i}
+        q.put(QueueItem(i, "prompt-{}".format(i), prompt, extra_data, ["0"], {}))
+    return q
+
+
+def get_queue_response(q):
+    # What the /queue route does when the queue changed since the last poll, otherwise it reuses the
+    # previous response
+    running, queued = q.get_current_queue_volatile()
+    return json.dumps({"queue_running": [item[:5] for item in running],
+                       "queue_pending": [item[:5] for item in queued]})
+
+
+def timed(function, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+@pytest.mark.benchmark
+def test_queue_latency_against_depth(skip_timing_checks):
+    print()  # noqa: T201
+    print("{:>6} {:>14} {:>14} {:>16} {:>18}".format("depth", "snapshot ms", "cached ms", "serialize ms", "deepcopy (old) ms"))  # noqa: T201
+    for depth in DEPTHS:
+        q = make_queue(depth)
+
+        def cold_snapshot():
+            q.snapshot = None
+            q.get_current_queue_volatile()
+
+        snapshot_ms = timed(cold_snapshot)
+        cached_ms = timed(q.get_current_queue_volatile)
+        response_ms = timed(lambda: get_queue_response(q), repeat=1)
+        deepcopy_ms = timed(lambda: copy.deepcopy(q.queue), repeat=1)
+        print("{:>6} {:>14.3f} {:>14.3f} {:>16.3f} {:>18.3f}".format(depth, snapshot_ms, cached_ms, response_ms, deepcopy_ms))  # noqa: T201
+
+        running, queued = q.get_current_queue_volatile()
+        assert len(queued) == depth
+        # Reads share the prompt graph with the queue instead of copying it
+        assert min(queued).extra_data is q.get_queue_item(min(queued).prompt_id).extra_data
+
+        if not skip_timing_checks:
+            # Taking the snapshot under the queue lock must stay far cheaper than copying the graphs
+            assert snapshot_ms * 10 < deepcopy_ms or snapshot_ms < 1.0
+
+
+def make_large_queue(depth):
+    q = PromptQueue(FakeServer())
+    for i in range(depth):
+        q.put(QueueItem(i, "prompt-{}".format(i), {}, {}, ["0"], {}))
+    return q
+
+
+def delete_by_scan(queue, ids):
+    # What /queue did before the queue was indexed, a scan and a heapify for every id
+    for id_to_delete in ids:
+        for x in range(len(queue)):
+            if queue[x][1] == id_to_delete:
+                queue.pop(x)
+                heapq.heapify(queue)
+                break
+
+
+@pytest.mark.benchmark
+def test_bulk_queue_operations(skip_timing_checks):
+    depth = 100000
+    count = 5000
+    ids = ["prompt-{}".format(i) for i in range(depth - count, depth)]
+    print()  # noqa: T201
+    print("{:>8} {:>8} {:>16} {:>14} {:>14} {:>14} {:>14}".format("depth", "ids", "scan delete ms", "delete ms", "priority ms", "front ms", "lookup us"))  # noqa: T201
+
+    q = make_large_queue(depth)
+    old_queue = sorted(q.get_current_queue()[1])
+    # The scan is timed on a sample of the ids
+    scan_ms = timed(lambda: delete_by_scan(list(old_queue), ids[:100]), repeat=1) * count / 100
+
+    start = time.perf_counter()
+    assert len(q.delete_queue_items(ids)) == count
+    delete_ms = (time.perf_counter() - start) * 1000
+    assert q.get_queue_depth() == (depth - count, 0)
+
+    start = time.perf_counter()
+    q.set_priorities({"prompt-{}".format(i): depth + i for i in range(count)})
+    priority_ms = (time.perf_counter() - start) * 1000
+
+    front = ["prompt-{}".format(i) for i in range(depth - 2 * count, depth - count)]
+    start = time.perf_counter()
+    q.move_to_front(front)
+    front_ms = (time.perf_counter() - start) * 1000
+    assert q.get()[0].prompt_id == front[0]
+
+    lookup_us = timed(lambda: q.get_queue_item("prompt-{}".format(depth // 2))) * 1000
+    print("{:>8} {:>8} {:>16.1f} {:>14.1f} {:>14.1f} {:>14.1f} {:>14.3f}".format(depth, count, scan_ms, delete_ms, priority_ms, front_ms, lookup_us))  # noqa: T201
+
+    if not skip_timing_checks:
+        assert delete_ms * 10 < scan_ms
@@ -0,0 +1,81 @@
+"""
+Training dataset loading: pickle shards against memory-mapped safetensors shards.
+
+Run with: pytest tests/benchmark/test_training_dataset_benchmark.py -m benchmark
+"""
+import random
+import time
+
+import pytest
+import torch
+from unittest.mock import patch, MagicMock
+
+from comfy.cli_args import args
+if not torch.cuda.is_available():
+    args.cpu = True
+
+with patch.dict('sys.modules', {'nodes': MagicMock(), 'server': MagicMock()}):
+    from comfy_extras.nodes_dataset import (
+        load_pickle_shards,
+        load_safetensors_shards,
+        save_pickle_shards,
+        save_safetensors_shards,
+    )
+
+NUM_SAMPLES = 2000
+SHARD_SIZE = 500
+BATCH_SIZE = 8
+NUM_BATCHES = 200
+
+
+def make_dataset():
+    # 512x512 SD1.x latents with CLIP-L conditioning
+    latents = [{"samples": torch.randn(1, 4, 64, 64)} for _ in range(NUM_SAMPLES)]
+    conditioning = [[[torch.randn(1, 77, 768), {"pooled_output": torch.randn(1, 768)}]] for _ in range(NUM_SAMPLES)]
+    return latents, conditioning
+
+
+def random_batches(latents):
+    rng = random.Random(0)
+    for _ in range(NUM_BATCHES):
+        indices = rng.sample(range(len(latents)), BATCH_SIZE)
+        torch.cat([latents[i]["samples"] for i in indices]).sum()
+
+
+@pytest.mark.benchmark
+def test_training_dataset_load_throughput(tmp_path, skip_timing_checks):
+    latents, conditioning = make_dataset()
+    pickle_dir = tmp_path / "pickle"
+    safetensors_dir = tmp_path / "safetensors"
+    pickle_dir.mkdir()
+    safetensors_dir.mkdir()
+    save_pickle_shards(str(pickle_dir), latents, conditioning, SHARD_SIZE)
+    index = save_safetensors_shards(str(safetensors_dir), latents, conditioning, SHARD_SIZE)
+    del latents, conditioning
+
+    start = time.perf_counter()
+    pickle_latents, _ = load_pickle_shards(str(pickle_dir))
+    pickle_load = time.perf_counter() - start
+    start = time.perf_counter()
+    random_batches(pickle_latents)
+    pickle_batches = time.perf_counter() - start
+
+    start = time.perf_counter()
+    mmap_latents, _ = load_safetensors_shards(str(safetensors_dir), index)
+    mmap_load = time.perf_counter() - start
+    start = time.perf_counter()
+    random_batches(mmap_latents)
+    mmap_batches = time.perf_counter() - start
+
+    print()  # noqa: T201
+    print("{:>12} {:>12} {:>18}".format("format", "load ms", "batches/s"))  # noqa: T201
+    print("{:>12} {:>12.1f} {:>18.1f}".format("pickle", pickle_load * 1000, NUM_BATCHES / pickle_batches))  # noqa: T201
+    print("{:>12} {:>12.1f} {:>18.1f}".format("safetensors", mmap_load * 1000, NUM_BATCHES / mmap_batches))  # noqa: T201
+
+    assert len(mmap_latents) == len(pickle_latents) == NUM_SAMPLES
+    for i in (0, NUM_SAMPLES - 1):
+        assert torch.equal(mmap_latents[i]["samples"], pickle_latents[i]["samples"])
+
+    if not skip_timing_checks:
+        # Mapping the shards only parses their headers, unpickling reads every tensor
+        assert mmap_load < pickle_load
@@ -187,15 +187,17 @@ class TestExecution:
         { "extra_args" : ["--cache-lru", 0], "should_cache_results" : True },
         { "extra_args" : ["--cache-lru", 100], "should_cache_results" : True },
         { "extra_args" : ["--cache-none"], "should_cache_results" : False },
+        { "extra_args" : ["--parallel-cpu-nodes", 4], "should_cache_results" : True, "parallel_cpu_nodes" : True },
     ])
-    def server(self, args_pytest, request):
-        # Start server
+    def server(self, args_pytest, request, tmp_path_factory):
+        # Start server, with a fresh database so the history starts empty
         pargs = [
             'python','main.py',
             '--output-directory', args_pytest["output_dir"],
             '--listen', args_pytest["listen"],
             '--port', str(args_pytest["port"]),
             '--extra-model-paths-config', 'tests/execution/extra_model_paths.yaml',
+            '--database-url', 'sqlite:///{}'.format(tmp_path_factory.mktemp("database") / "comfyui.db"),
             '--cpu',
         ]
         pargs += [ str(param) for param in request.param["extra_args"] ]
@@ -606,6 +608,30 @@ class TestExecution:
         assert result.did_run(sleep_node2), "Sleep node 2 should have run"
         assert result.did_run(sleep_node3), "Sleep node 3 should have run"
 
+    def test_parallel_cpu_nodes(self, client: ComfyClient, builder: GraphBuilder, server, skip_timing_checks):
+        run_warmup(client)
+
+        g = builder
+        image = g.node("StubImage", content="BLACK", height=512, width=512, batch_size=1)
+        sleep_node1 = g.node("TestCPUSleep", value=image.out(0), seconds=1.9)
+        sleep_node2 = g.node("TestCPUSleep", value=image.out(0), seconds=2.1)
+        sleep_node3 = g.node("TestCPUSleep", value=image.out(0), seconds=2.0)
+        _output1 = g.node("PreviewImage", images=sleep_node1.out(0))
+        _output2 = g.node("PreviewImage", images=sleep_node2.out(0))
+        _output3 = g.node("PreviewImage", images=sleep_node3.out(0))
+
+        start_time = time.time()
+        result = client.run(g)
+        elapsed_time = time.time() - start_time
+
+        # Sync CPU nodes only overlap when the worker pool is enabled
+        if server.get("parallel_cpu_nodes", False) and not skip_timing_checks:
+            assert elapsed_time < 5.9, f"Parallel CPU execution took {elapsed_time}s, expected less than 5.9s"
+
+        assert result.did_run(sleep_node1), "Sleep node 1 should have run"
+        assert result.did_run(sleep_node2), "Sleep node 2 should have run"
+        assert result.did_run(sleep_node3), "Sleep node 3 should have run"
+
     def test_parallel_sleep_expansion(self, client: ComfyClient, builder: GraphBuilder, skip_timing_checks):
         # Warmup execution to ensure server is fully initialized
         run_warmup(client)
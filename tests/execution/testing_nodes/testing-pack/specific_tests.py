@@ -422,6 +422,25 @@ class TestSleep(ComfyNodeABC):
             await asyncio.sleep(0.01)
         return (value,)
 
+class TestCPUSleep(ComfyNodeABC):
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "value": (IO.ANY, {}),
+                "seconds": ("FLOAT", {"default": 1.0, "min": 0.0, "max": 9999.0, "step": 0.01, "tooltip": "The amount of seconds to sleep."}),
+            },
+        }
+    RETURN_TYPES = (IO.ANY,)
+    FUNCTION = "sleep"
+    DEVICE_AFFINITY = "cpu"
+
+    CATEGORY = "_for_testing"
+
+    def sleep(self, value, seconds):
+        time.sleep(seconds)
+        return (value,)
+
 class TestParallelSleep(ComfyNodeABC):
     @classmethod
     def INPUT_TYPES(cls):
@@ -496,6 +515,7 @@ TEST_NODE_CLASS_MAPPINGS = {
     "TestMixedExpansionReturns": TestMixedExpansionReturns,
     "TestSamplingInExpansion": TestSamplingInExpansion,
     "TestSleep": TestSleep,
+    "TestCPUSleep": TestCPUSleep,
     "TestParallelSleep": TestParallelSleep,
     "TestOutputNodeWithSocketOutput": TestOutputNodeWithSocketOutput,
 }
@@ -514,6 +534,7 @@ TEST_NODE_DISPLAY_NAME_MAPPINGS = {
     "TestMixedExpansionReturns": "Mixed Expansion Returns",
     "TestSamplingInExpansion": "Sampling In Expansion",
     "TestSleep": "Test Sleep",
+    "TestCPUSleep": "Test CPU Sleep",
     "TestParallelSleep": "Test Parallel Sleep",
     "TestOutputNodeWithSocketOutput": "Test Output Node With Socket Output",
 }
@@ -0,0 +1,362 @@
+"""
+Persistent index of the files below the model folders.
+
+Each indexed folder is scanned once (or loaded from the state file and checked by directory
+mtime) and then kept up to date incrementally: only directories that inotify reports as changed,
+or whose mtime changed when polling, are listed again. Lookups never touch the filesystem.
+"""
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import errno
+import json
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Optional
+
+STATE_VERSION = 1
+SAVE_DELAY = 2.0
+
+# (mtime, ctime, size)
+FileInfo = tuple[float, float, int]
+
+
+class DirectoryIndex:
+    """
+    The files below one folder, relative to it, as os.walk(followlinks=True) would find them.
+    """
+    def __init__(self, root: str, excluded_dir_names: tuple[str, ...] = (".git",)):
+        self.root = os.path.normpath(root)
+        self.excluded_dir_names = excluded_dir_names
+        self.lock = threading.RLock()
+        # directory -> (mtime, {file name: FileInfo}, subdirectory names)
+        self.dirs: dict[str, tuple[float, dict[str, FileInfo], set[str]]] = {}
+        # relative path -> FileInfo
+        self.files: dict[str, FileInfo] = {}
+        self.version = 0
+
+    def _relpath(self, directory: str, name: str) -> str:
+        if directory == self.root:
+            return name
+        return os.path.join(directory[len(self.root) + 1:], name)
+
+    def _list_dir(self, directory: str) -> Optional[tuple[float, dict[str, FileInfo], set[str]]]:
+        try:
+            mtime = os.path.getmtime(directory)
+            files = {}
+            subdirs = set()
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            if entry.name not in self.excluded_dir_names:
+                                subdirs.add(entry.name)
+                        elif entry.is_file():
+                            stat = entry.stat()
+                            files[entry.name] = (stat.st_mtime, stat.st_ctime, stat.st_size)
+                    except OSError:
+                        logging.warning(f"Warning: Unable to access {entry.path}. Skipping this file.")
+            return mtime, files, subdirs
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        except OSError as e:
+            logging.warning(f"Warning: Unable to access {directory}. Skipping this path. {e}")
+            return None
+
+    def _remove_tree(self, directory: str):
+        old = self.dirs.pop(directory, None)
+        if old is None:
+            return
+        for name in old[1]:
+            self.files.pop(self._relpath(directory, name), None)
+        for name in old[2]:
+            self._remove_tree(os.path.join(directory, name))
+
+    def update_dir(self, directory: str) -> bool:
+        """
+        Lists directory again and applies the difference to the index, descending only into
+        subdirectories that are new. Returns True if anything changed.
+        """
+        with self.lock:
+            old = self.dirs.get(directory)
+            new = self._list_dir(directory)
+            if new is None:
+                if old is None:
+                    return False
+                self._remove_tree(directory)
+                self.version += 1
+                return True
+
+            changed = old is None or old[1] != new[1] or old[2] != new[2]
+            old_files = {} if old is None else old[1]
+            old_subdirs = set() if old is None else old[2]
+            self.dirs[directory] = new
+            for name in old_files.keys() - new[1].keys():
+                self.files.pop(self._relpath(directory, name), None)
+            for name, info in new[1].items():
+                self.files[self._relpath(directory, name)] = info
+            for name in old_subdirs - new[2]:
+                self._remove_tree(os.path.join(directory, name))
+            for name in new[2] - old_subdirs:
+                self.update_dir(os.path.join(directory, name))
+            if changed:
+                self.version += 1
+            return changed
+
+    def scan(self):
+        logging.debug("indexing model directory {}".format(self.root))
+        self.update_dir(self.root)
+        logging.debug("found {} files".format(len(self.files)))
+
+    def refresh_changed(self) -> bool:
+        """
+        Lists again the directories whose mtime changed. This is the polling fallback, it only
+        stats directories.
+        """
+        changed = False
+        with self.lock:
+            directories = list(self.dirs.items()) if self.root in self.dirs else [(self.root, None)]
+        for directory, entry in directories:
+            try:
+                if entry is not None and os.path.getmtime(directory) == entry[0]:
+                    continue
+            except OSError:
+                pass
+            changed = self.update_dir(directory) or changed
+        return changed
+
+    def contains(self, relative_path: str) -> bool:
+        return relative_path in self.files
+
+    def get_files(self) -> dict[str, FileInfo]:
+        with self.lock:
+            return dict(self.files)
+
+    def get_file_names(self) -> list[str]:
+        with self.lock:
+            return list(self.files)
+
+    def to_state(self) -> dict:
+        with self.lock:
+            return {d: [mtime, files, sorted(subdirs)] for d, (mtime, files, subdirs) in self.dirs.items()}
+
+    def load_state(self, state: dict):
+        with self.lock:
+            for directory, (mtime, files, subdirs) in state.items():
+                files = {name: tuple(info) for name, info in files.items()}
+                self.dirs[directory] = (mtime, files, set(subdirs))
+                for name, info in files.items():
+                    self.files[self._relpath(directory, name)] = info
+            self.version += 1
+
+
+class InotifyWatcher:
+    """
+    Minimal inotify binding through libc, reports which watched directories changed.
+    """
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths: dict[int, str] = {}
+        self.watches: dict[str, int] = {}
+
+    def add(self, path: str) -> bool:
+        if path in self.watches:
+            return True
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise OSError(error, "inotify watch limit reached (fs.inotify.max_user_watches)")
+            return False
+        # Watches follow moved directories, the kernel returns the same descriptor for the new path
+        old_path = self.paths.get(wd)
+        if old_path is not None and self.watches.get(old_path) == wd:
+            del self.watches[old_path]
+        self.paths[wd] = path
+        self.watches[path] = wd
+        return True
+
+    def read(self, timeout: float) -> tuple[set[str], bool]:
+        """
+        Returns the directories that changed and whether events were lost.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set(), False
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set(), False
+        changed = set()
+        overflow = False
+        offset = 0
+        while offset + self.EVENT.size <= len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size + length
+            if mask & self.IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            path = self.paths.get(wd)
+            if path is None:
+                continue
+            if mask & self.IN_IGNORED:
+                self.paths.pop(wd, None)
+                if self.watches.get(path) == wd:
+                    del self.watches[path]
+                continue
+            changed.add(path)
+            if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                changed.add(os.path.dirname(path))
+        return changed, overflow
+
+
+class ModelIndex:
+    """
+    DirectoryIndex for every folder that is looked up, kept up to date by a background thread
+    using inotify (watch="inotify" or "auto" on Linux) or by polling directory mtimes every
+    poll_interval seconds. The indexes are saved to state_file so restarts only stat directories.
+    """
+    def __init__(self, state_file: Optional[str] = None, watch: str = "auto", poll_interval: float = 5.0):
+        self.state_file = state_file
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.indexes: dict[str, DirectoryIndex] = {}
+        self.saved_state: dict[str, dict] = {}
+        self.saved_versions: dict[str, int] = {}
+        self.watcher: Optional[InotifyWatcher] = None
+        self.last_change: Optional[float] = None
+        if watch in ("auto", "inotify") and sys.platform.startswith("linux"):
+            try:
+                self.watcher = InotifyWatcher()
+            except (OSError, AttributeError) as e:
+                logging.warning("inotify is not available, polling model folders instead: {}".format(e))
+        elif watch == "inotify":
+            logging.warning("inotify is only available on Linux, polling model folders instead.")
+        self._load()
+        self.thread = threading.Thread(target=self._loop, daemon=True, name="model-index")
+        self.thread.start()
+
+    def _load(self):
+        if self.state_file is None or not os.path.isfile(self.state_file):
+            return
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("version") == STATE_VERSION:
+                self.saved_state = state["roots"]
+        except Exception as e:
+            logging.warning("Failed to load the model index from {}: {}".format(self.state_file, e))
+
+    def _save(self):
+        if self.state_file is None:
+            return
+        with self.lock:
+            indexes = list(self.indexes.items())
+        if all(self.saved_versions.get(root) == index.version for root, index in indexes):
+            return
+        # Folders that were not looked up since the start are kept as they were
+        state = {"version": STATE_VERSION, "roots": dict(self.saved_state)}
+        for root, index in indexes:
+            self.saved_versions[root] = index.version
+            state["roots"][root] = index.to_state()
+        tmp_path = "{}.{}.tmp".format(self.state_file, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_file)
+        except OSError as e:
+            logging.warning("Failed to save the model index to {}: {}".format(self.state_file, e))
+
+    def get(self, directory: str) -> DirectoryIndex:
+        index = self.indexes.get(directory)
+        if index is not None:
+            return index
+        with self.lock:
+            index = self.indexes.get(directory)
+            if index is not None:
+                return index
+            index = DirectoryIndex(directory)
+            saved = self.saved_state.pop(directory, None)
+            if saved is not None:
+                index.load_state(saved)
+                index.refresh_changed()
+            else:
+                index.scan()
+            self._watch(index)
+            self.indexes[directory] = index
+            self.last_change = time.monotonic()
+        return index
+
+    def _watch(self, index: DirectoryIndex):
+        if self.watcher is None:
+            return
+        try:
+            for directory in list(index.dirs):
+                self.watcher.add(directory)
+        except OSError as e:
+            logging.warning("{}, polling model folders instead.".format(e))
+            self.watcher = None
+
+    def _loop(self):
+        while True:
+            try:
+                changed = False
+                if self.watcher is not None:
+                    directories, overflow = self.watcher.read(self.poll_interval)
+                    with self.lock:
+                        indexes = list(self.indexes.values())
+                    for index in indexes:
+                        if overflow or index.root not in index.dirs:
+                            # Lost events or a folder that did not exist yet, fall back to mtimes
+                            changed = index.refresh_changed() or changed
+                            continue
+                        for directory in directories:
+                            if directory in index.dirs:
+                                changed = index.update_dir(directory) or changed
+                    if changed:
+                        for index in indexes:
+                            self._watch(index)
+                else:
+                    time.sleep(self.poll_interval)
+                    with self.lock:
+                        indexes = list(self.indexes.values())
+                    for index in indexes:
+                        changed = index.refresh_changed() or changed
+
+                if changed:
+                    self.last_change = time.monotonic()
+                if self.last_change is not None and time.monotonic() - self.last_change >= SAVE_DELAY:
+                    self.last_change = None
+                    self._save()
+            except Exception:
+                logging.exception("Error while updating the model index")
+                time.sleep(self.poll_interval)
+
+    def save(self):
+        self._save()